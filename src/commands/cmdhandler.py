@@ -35,6 +35,7 @@ command line. The process is as follows:
 
 """
 
+from collections import OrderedDict
 from copy import copy
 from traceback import format_exc
 from twisted.internet.defer import inlineCallbacks, returnValue
@@ -42,13 +43,20 @@ from django.conf import settings
 from src.comms.channelhandler import CHANNELHANDLER
 from src.utils import logger, utils
 from src.commands.cmdparser import at_multimatch_cmd
-from src.utils.utils import string_suggestions, make_iter
+from src.utils.utils import string_suggestions, make_iter, uses_default_method
 
 from django.utils.translation import ugettext as _
 
 __all__ = ("cmdhandler",)
 _GA = object.__getattribute__
-_CMDSET_MERGE_CACHE = {}
+
+# merged cmdsets, keyed on the merge_key (stable identity and version)
+# of all the cmdsets that went into the merge. Least recently used
+# mergers are dropped when the cache grows beyond its max size.
+_CMDSET_MERGE_CACHE = OrderedDict()
+_CMDSET_MERGE_CACHE_SIZE = settings.CMDSET_MERGE_CACHE_SIZE
+# the default Object typeclass, with the default (empty) at_cmdset_get
+_OBJECT = None
 
 # This decides which command parser is to be used.
 # You have to restart the server for changes to take effect.
@@ -85,7 +93,20 @@ class ExecSystemCommand(Exception):
         self.syscmd = syscmd
         self.sysarg = sysarg
 
-# Helper function
+# Helper functions
+
+def _get_merge_key(cmdsets):
+    """
+    Build the merge-cache key for a list of cmdsets. Returns None if
+    any of the cmdsets lacks a stable identity (and thus can't be cached).
+    """
+    mergehash = []
+    for cmdset in cmdsets:
+        if not cmdset.merge_key:
+            return None
+        # duplicates is changed on the fly for local-object cmdsets
+        mergehash.append(cmdset.merge_key + (cmdset.duplicates,))
+    return tuple(mergehash)
 
 
 @inlineCallbacks
@@ -120,6 +141,9 @@ def get_and_merge_cmdsets(caller, session, player, obj,
     @inlineCallbacks
     def _get_local_obj_cmdsets(obj, obj_cmdset):
         "Object-level cmdsets"
+        global _OBJECT
+        if not _OBJECT:
+            from src.objects.objects import Object as _OBJECT
         # Gather cmdsets from location, objects in location or carried
         local_obj_cmdsets = [None]
         try:
@@ -128,11 +152,23 @@ def get_and_merge_cmdsets(caller, session, player, obj,
             location = None
         if location and not obj_cmdset.no_objs:
             # Gather all cmdsets stored on objects in the room and
-            # also in the caller's inventory and the location itself
-            local_objlist = yield (location.contents_get(exclude=obj.dbobj) +
-                                   obj.contents +
-                                   [location])
+            # also in the caller's inventory and the location itself.
+            # We only re-gather the objects if the contents of either
+            # have changed since last time.
+            signature = (location.id, location.contents_version,
+                         obj.contents_version)
+            gathered = obj.cmdset.gathered
+            if gathered and gathered[0] == signature:
+                local_objlist = gathered[1]
+            else:
+                local_objlist = yield (location.contents_get(exclude=obj.dbobj) +
+                                       obj.contents +
+                                       [location])
+                obj.cmdset.gathered = (signature, local_objlist)
             for lobj in local_objlist:
+                if uses_default_method(lobj, "at_cmdset_get", _OBJECT):
+                    # the default hook does nothing
+                    continue
                 try:
                     # call hook in case we need to do dynamic changing to cmdset
                     _GA(lobj, "at_cmdset_get")()
@@ -206,11 +242,11 @@ def get_and_merge_cmdsets(caller, session, player, obj,
            if cmdset.key == "_CMDSET_ERROR"]
 
     if cmdsets:
-        # faster to do tuple on list than to build tuple directly
-        mergehash = tuple([id(cmdset) for cmdset in cmdsets])
-        if mergehash in _CMDSET_MERGE_CACHE:
-            # cached merge exist; use that
-            cmdset = _CMDSET_MERGE_CACHE[mergehash]
+        mergehash = _get_merge_key(cmdsets)
+        if mergehash and mergehash in _CMDSET_MERGE_CACHE:
+            # cached merge exist; use that (and mark it as recently used)
+            cmdset = _CMDSET_MERGE_CACHE.pop(mergehash)
+            _CMDSET_MERGE_CACHE[mergehash] = cmdset
         else:
             # we group and merge all same-prio cmdsets separately (this avoids
             # order-dependent clashes in certain cases, such as
@@ -237,7 +273,10 @@ def get_and_merge_cmdsets(caller, session, player, obj,
             # store the full sets for diagnosis
             cmdset.merged_from = cmdsets
             # cache
-            _CMDSET_MERGE_CACHE[mergehash] = cmdset
+            if mergehash:
+                _CMDSET_MERGE_CACHE[mergehash] = cmdset
+                if len(_CMDSET_MERGE_CACHE) > _CMDSET_MERGE_CACHE_SIZE:
+                    _CMDSET_MERGE_CACHE.popitem(last=False)
     else:
         cmdset = None
 
@@ -134,6 +134,9 @@ class CmdSet(object):
     no_channels = False
     permanent = False
     errmessage = ""
+    # stable identity used by the cmdhandler merge cache. This is set
+    # by the handler providing the cmdset (None means 'don't cache').
+    merge_key = None
     # pre-store properties to duplicate straight off
     to_duplicate = ("key", "cmdsetobj", "no_exits", "no_objs",
                     "no_channels", "permanent", "mergetype",
@@ -160,6 +163,8 @@ class CmdSet(object):
         # initialize system
         self.at_cmdset_creation()
         self._contains_cache = {}
+        # prefix trie over command keys/aliases, built on demand
+        self._match_index = None
 
     # Priority-sensitive merge operations for cmdsets
 
@@ -404,6 +409,48 @@ class CmdSet(object):
             if thiscmd == cmd:
                 return thiscmd
 
+    def _get_match_index(self):
+        """
+        Returns a prefix trie over the lowercased keys and aliases of
+        all commands in the set. Each node is a dict mapping the next
+        character to a child node; the special key None holds a list of
+        (cmdname, cmd) for the names ending at that node. The trie is
+        cached and rebuilt if the command list was changed.
+        """
+        commands = self.commands
+        index = self._match_index
+        if index and index[0] is commands and index[1] == len(commands):
+            return index[2]
+        root = {}
+        for cmd in commands:
+            for cmdname in [cmd.key] + list(cmd.aliases):
+                if not cmdname:
+                    continue
+                node = root
+                for char in cmdname.lower():
+                    node = node.setdefault(char, {})
+                node.setdefault(None, []).append((cmdname, cmd))
+        self._match_index = (commands, len(commands), root)
+        return root
+
+    def match_prefix(self, string):
+        """
+        Return a list of (cmdname, cmd) for every command key or alias
+        that string starts with. This costs O(len(string)) regardless
+        of how many commands are in the set.
+
+        string (str) - the input to match. Should be lower case.
+        """
+        node = self._get_match_index()
+        matches = []
+        for char in string:
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                matches.extend(node[None])
+        return matches
+
     def count(self):
         "Return number of commands in set"
         return len(self.commands)
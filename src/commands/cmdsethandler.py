@@ -63,6 +63,7 @@ can then implement separate sets for different situations. For
 example, you can have a 'On a boat' set, onto which you then tack on
 the 'Fishing' set. Fishing from a boat? No problem!
 """
+from itertools import count
 from src.utils import logger, utils
 from src.commands.cmdset import CmdSet
 from src.server.models import ServerConfig
@@ -71,6 +72,8 @@ from django.utils.translation import ugettext as _
 __all__ = ("import_cmdset", "CmdSetHandler")
 
 _CACHED_CMDSETS = {}
+# unique, never re-used ids for cmdsethandlers (used by the merge cache)
+_HANDLER_UID = count(1)
 
 
 class _ErrorCmdSet(CmdSet):
@@ -166,6 +169,13 @@ class CmdSetHandler(object):
         """
         self.obj = obj
 
+        # unique id and change counter, used as a stable cache key by the
+        # cmdhandler's merge cache. The version is bumped on every update().
+        self.uid = _HANDLER_UID.next()
+        self.version = 0
+        # used by the cmdhandler to cache the objects gathered around obj
+        self.gathered = None
+
         # the id of the "merged" current cmdset for easy access.
         self.key = None
         # this holds the "merged" current command set
@@ -266,6 +276,9 @@ class CmdSetHandler(object):
             except TypeError:
                 continue
             self.mergetype_stack.append(new_current.actual_mergetype)
+        self.version += 1
+        if new_current:
+            new_current.merge_key = (self.uid, self.version)
         self.current = new_current
 
     def add(self, cmdset, emit_to_obj=None, permanent=False):
@@ -10,6 +10,7 @@ from src.utils import create, utils, search
 from src.utils.ansi import raw
 from src.commands.default.muxcommand import MuxCommand
 from src.commands.cmdhandler import get_and_merge_cmdsets
+from src.typeclasses.models import prefetch_attributes
 
 # limit symbol import for API
 __all__ = ("ObjManipCommand", "CmdSetObjAlias", "CmdCopy",
@@ -1910,7 +1911,9 @@ class CmdFind(MuxCommand):
             if self.switches:
                 restrictions = ", %s" % (",".join(self.switches))
             if nresults:
-                # convert result to typeclasses.
+                # load all Attributes in one go, then convert result to typeclasses.
+                results = list(results)
+                prefetch_attributes(results)
                 results = [result.typeclass for result in results]
                 if nresults > 1:
                     string = "{w%i Matches{n(#%i-#%i%s):" % (nresults, low, high, restrictions)
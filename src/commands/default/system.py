@@ -620,7 +620,14 @@ class CmdServerLoad(MuxCommand):
     server load and memory statistics
 
     Usage:
-       @serverload
+       @serverload[/deep][/mccp]
+
+    Switch:
+       deep - measure everything owned by the cached entities
+              (Attributes, handlers, typeclass, ndb data etc) and
+              show the memory use per typeclass. This is slow.
+       mccp - also ask the Portal for statistics on the MCCP
+              compression of telnet output.
 
     This command shows server load statistics and dynamic memory
     usage.
@@ -699,26 +706,77 @@ class CmdServerLoad(MuxCommand):
             # object cache size
             cachedict = _idmapper.cache_size()
             totcache = cachedict["_total"]
-            sorted_cache = sorted([(key, tup[0], tup[1]) for key, tup in cachedict.items() if key !="_total" and tup[0] > 0],
+            sorted_cache = sorted([(key, tup[0], tup[1], tup[2]) for key, tup in cachedict.items() if key !="_total" and tup[0] > 0],
                                     key=lambda tup: tup[2], reverse=True)
             memtable = prettytable.PrettyTable(["entity name",
                                                 "number",
                                                 "cache (MB)",
-                                                "idmapper %%"])
+                                                "idmapper %%",
+                                                "evicted"])
             memtable.align = 'l'
             for tup in sorted_cache:
                 memtable.add_row([tup[0],
                                  "%i" % tup[1],
                                  "%5.2f" % tup[2],
-                                 "%.2f" % (float(tup[2] / totcache[1]) * 100)])
+                                 "%.2f" % (float(tup[2] / totcache[1]) * 100),
+                                 "%i" % tup[3]])
 
             # get sizes of other caches
-            attr_cache_info, prop_cache_info = get_cache_sizes()
+            attr_cache_info, prop_cache_info, lock_cache_info = get_cache_sizes()
             string += "\n{w Entity idmapper cache usage:{n %5.2f MB (%i items)\n%s" % (totcache[1], totcache[0], memtable)
             string += "\n{w On-entity Attribute cache usage:{n %5.2f MB (%i attrs)" % (attr_cache_info[1], attr_cache_info[0])
             string += "\n{w On-entity Property cache usage:{n %5.2f MB (%i props)" % (prop_cache_info[1], prop_cache_info[0])
+            string += "\n{w Lock result cache:{n %i entries (%i hits, %i misses)" % lock_cache_info
             base_mem = vmem - totcache[1] - attr_cache_info[1] - prop_cache_info[1]
             string += "\n{w Base Server usage (virtmem-idmapper-attrcache-propcache):{n %5.2f MB" % base_mem
 
+            if "deep" in self.switches:
+                # walk all cached entities for an accurate measure
+                deepdict, typeclassdict = _idmapper.deep_cache_size()
+                totdeep = deepdict["_total"]
+                deeptable = prettytable.PrettyTable(["entity name",
+                                                     "number",
+                                                     "total (MB)",
+                                                     "idmapper %%"])
+                deeptable.align = 'l'
+                for key, tup in sorted([(key, tup) for key, tup in deepdict.items() if key != "_total" and tup[0] > 0],
+                                       key=lambda tup: tup[1][1], reverse=True):
+                    deeptable.add_row([key,
+                                       "%i" % tup[0],
+                                       "%5.2f" % tup[1],
+                                       "%.2f" % (float(tup[1] / totdeep[1]) * 100)])
+                typeclasstable = prettytable.PrettyTable(["typeclass",
+                                                          "number",
+                                                          "total (MB)",
+                                                          "per entity (KB)"])
+                typeclasstable.align = 'l'
+                for key, tup in sorted(typeclassdict.items(), key=lambda tup: tup[1][1], reverse=True):
+                    typeclasstable.add_row([key,
+                                            "%i" % tup[0],
+                                            "%5.2f" % tup[1],
+                                            "%.2f" % (tup[1] * 1024.0 / tup[0])])
+                string += "\n{w Deep idmapper cache usage:{n %5.2f MB (%i items)\n%s" % (totdeep[1], totdeep[0], deeptable)
+                string += "\n{w Deep idmapper cache usage per typeclass:{n\n%s" % typeclasstable
+
         caller.msg(string)
 
+        if "mccp" in self.switches:
+            # the statistics are kept by the Portal
+            def show_mccp(stats):
+                "Callback showing the Portal's MCCP statistics"
+                if not stats:
+                    # the call failed; amp's errback logged why
+                    caller.msg("{rThe MCCP statistics could not be fetched from the Portal.{n")
+                    return
+                mccptable = prettytable.PrettyTable(["session", "bytes in", "bytes out", "ratio", "level"])
+                mccptable.align = 'l'
+                for sessid, bytes_in, bytes_out, level in sorted(stats["sessions"]):
+                    mccptable.add_row(["%i" % sessid, "%i" % bytes_in, "%i" % bytes_out,
+                                       "%.2f" % (float(bytes_out) / bytes_in if bytes_in else 1.0), "%i" % level])
+                ratio = float(stats["bytes_out"]) / stats["bytes_in"] if stats["bytes_in"] else 1.0
+                caller.msg("{wMCCP compression:{n %i bytes compressed to %i (ratio %.2f), "
+                           "Portal cpu %.1f%%, level %i\n%s" % (stats["bytes_in"], stats["bytes_out"], ratio,
+                                                                 stats["cpu_load"], stats["level"], mccptable))
+            SESSIONS.server.amp_protocol.call_remote_FunctionCall("src.server.portal.mccp",
+                                                                  "mccp_stats").addCallback(show_mccp)
+
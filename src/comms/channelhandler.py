@@ -22,9 +22,27 @@ To delete a channel cleanly, delete the channel object, then call
 update() on the channelhandler. Or use Channel.objects.delete() which
 does this for you.
 
+The cmdset of channels a player may send to is cached. Players with
+the same permissions share the same cmdset, as long as the channels'
+send-locks only check permissions. The cache is bounded by
+CHANNEL_CMDSET_CACHE_SIZE and is emptied when a channel changes.
+
 """
+from collections import OrderedDict
+from itertools import count
+from django.conf import settings
 from src.comms.models import ChannelDB
 from src.commands import cmdset, command
+from src.utils import utils
+
+_CMDSET_CACHE_SIZE = settings.CHANNEL_CMDSET_CACHE_SIZE
+
+# lock functions whose result only depends on the permissions (and
+# superuser status) of the accessing player
+_PERM_LOCKFUNCS = ("true", "all", "false", "none", "superuser", "serversetting",
+                   "perm", "perm_above", "pperm", "pperm_above")
+# lock functions that also depend on the identity of the accessing player
+_ID_LOCKFUNCS = ("id", "pid", "dbref", "pdbref", "self")
 
 
 class ChannelCommand(command.Command):
@@ -86,7 +104,13 @@ class ChannelHandler(object):
     """
     def __init__(self):
         self.cached_channel_cmds = []
-        self.cached_cmdsets = {}
+        self.cached_cmdsets = OrderedDict()
+        # how cmdsets may be cached; "perm", "id" or None, see _cache_key
+        self.cache_mode = "perm"
+        # change counter, bumped whenever the channel commands change.
+        # This is used by the cmdhandler's merge cache.
+        self.version = 0
+        self._cmdset_uid = count(1)
 
     def __str__(self):
         return ", ".join(str(cmd) for cmd in self.cached_channel_cmds)
@@ -96,6 +120,7 @@ class ChannelHandler(object):
         Reset the cache storage.
         """
         self.cached_channel_cmds = []
+        self.version += 1
 
     def _format_help(self, channel):
         "builds a doc string"
@@ -114,6 +139,33 @@ class ChannelHandler(object):
         """ % (key, ustring, desc)
         return string
 
+    def _make_command(self, channel):
+        "map the channel to a searchable command"
+        return ChannelCommand(key=channel.key.strip().lower(),
+                              aliases=channel.aliases.all(),
+                              locks="cmd:all();%s" % channel.locks,
+                              help_category="Channel names",
+                              obj=channel,
+                              is_channel=True)
+
+    def _reset_cmdsets(self):
+        """
+        Empty the cmdset cache and work out how cmdsets may be cached
+        with the current send-locks of the channels.
+        """
+        self.cached_cmdsets = OrderedDict()
+        self.version += 1
+        funcnames = set(func.__name__ for cmd in self.cached_channel_cmds
+                        for func, args, kwargs in cmd.lockhandler.locks.get("send", ("", ()))[1])
+        if funcnames.issubset(_PERM_LOCKFUNCS):
+            self.cache_mode = "perm"
+        elif funcnames.issubset(_PERM_LOCKFUNCS + _ID_LOCKFUNCS):
+            self.cache_mode = "id"
+        else:
+            # locks check other things (like Attributes), which
+            # we can't know when they change. Don't cache.
+            self.cache_mode = None
+
     def add_channel(self, channel):
         """
         Add an individual channel to the handler. This should be
@@ -121,40 +173,74 @@ class ChannelHandler(object):
         remove a channel, simply delete the channel object
         and run self.update on the handler.
         """
-        # map the channel to a searchable command
-        cmd = ChannelCommand(key=channel.key.strip().lower(),
-                             aliases=channel.aliases.all(),
-                             locks="cmd:all();%s" % channel.locks,
-                             help_category="Channel names",
-                             obj=channel,
-                             is_channel=True)
-        self.cached_channel_cmds.append(cmd)
-        self.cached_cmdsets = {}
+        self.cached_channel_cmds.append(self._make_command(channel))
+        self._reset_cmdsets()
+
+    def channel_changed(self, channel):
+        """
+        Re-create the command of a channel whose key or locks changed.
+        This is called automatically when the channel is saved.
+        """
+        for icmd, cmd in enumerate(self.cached_channel_cmds):
+            if cmd.obj == channel:
+                self.cached_channel_cmds[icmd] = self._make_command(channel)
+                self._reset_cmdsets()
+                return
 
     def update(self):
         "Updates the handler completely."
         self.cached_channel_cmds = []
-        self.cached_cmdsets = {}
         for channel in ChannelDB.objects.get_all_channels():
-            self.add_channel(channel)
+            self.cached_channel_cmds.append(self._make_command(channel))
+        self._reset_cmdsets()
+
+    def _cache_key(self, source_object):
+        """
+        Get the key to cache the cmdset of source_object under, or
+        None if it can't be cached. The permissions are always part
+        of the key, so a change of permissions gives a new key.
+        """
+        if not self.cache_mode:
+            return None
+        if utils.inherits_from(source_object, "src.objects.objects.Object"):
+            # the perm lockfuncs combine Object and Player permissions
+            return None
+        try:
+            key = (frozenset(source_object.permissions.all()),
+                   source_object.locks.lock_bypass)
+        except AttributeError:
+            return None
+        if self.cache_mode == "id":
+            key += (source_object.id,)
+        return key
 
     def get_cmdset(self, source_object):
         """
         Retrieve cmdset for channels this source_object has
         access to send to.
         """
-        if source_object in self.cached_cmdsets:
-            return self.cached_cmdsets[source_object]
-        else:
-            # create a new cmdset holding all channels
-            chan_cmdset = cmdset.CmdSet()
-            chan_cmdset.key = '_channelset'
-            chan_cmdset.priority = 10
-            chan_cmdset.duplicates = True
-            for cmd in [cmd for cmd in self.cached_channel_cmds
-                        if cmd.access(source_object, 'send')]:
-                chan_cmdset.add(cmd)
-            self.cached_cmdsets[source_object] = chan_cmdset
+        cachekey = self._cache_key(source_object)
+        try:
+            chan_cmdset = self.cached_cmdsets.pop(cachekey)
+            # re-insert as the most recently used
+            self.cached_cmdsets[cachekey] = chan_cmdset
             return chan_cmdset
+        except KeyError:
+            pass
+        # create a new cmdset holding all channels
+        chan_cmdset = cmdset.CmdSet()
+        chan_cmdset.key = '_channelset'
+        chan_cmdset.priority = 10
+        chan_cmdset.duplicates = True
+        chan_cmdset.merge_key = ("_channelset", self.version,
+                                 self._cmdset_uid.next())
+        for cmd in [cmd for cmd in self.cached_channel_cmds
+                    if cmd.access(source_object, 'send')]:
+            chan_cmdset.add(cmd)
+        if cachekey is not None and _CMDSET_CACHE_SIZE:
+            self.cached_cmdsets[cachekey] = chan_cmdset
+            if len(self.cached_cmdsets) > _CMDSET_CACHE_SIZE:
+                self.cached_cmdsets.popitem(last=False)
+        return chan_cmdset
 
 CHANNELHANDLER = ChannelHandler()
@@ -4,9 +4,14 @@ Default Typeclass for Comms.
 See objects.objects for more information on Typeclassing.
 """
 from src.comms import Msg, TempMsg, ChannelDB
+from src.comms.models import log_channel_message
 from src.typeclasses.typeclass import TypeClass
 from src.utils import logger
-from src.utils.utils import make_iter
+from src.utils.utils import make_iter, to_str, uses_default_method
+
+_SESSIONS = None
+_PLAYER = None
+_OBJECT = None
 
 
 class Channel(TypeClass):
@@ -160,17 +165,40 @@ class Channel(TypeClass):
         """
         Method for grabbing all listeners that a message should be sent to on
         this channel, and sending them a message.
-        """
+
+        The message is sent to the sessions of all listening players in
+        one go, rather than through each player's msg() method. Players
+        whose typeclass overloads msg() are still messaged one by one,
+        as are all players if a sender overloads at_msg_send().
+        """
+        global _SESSIONS, _PLAYER, _OBJECT
+        if not _SESSIONS:
+            from src.server.sessionhandler import SESSIONS as _SESSIONS
+            from src.players.player import Player as _PLAYER
+            from src.objects.objects import Object as _OBJECT
+        batch = all(uses_default_method(sender, "at_msg_send", _OBJECT)
+                    for sender in make_iter(msg.senders))
         # get all players connected to this channel and send to them
+        players = []
         for conn in ChannelDB.objects.get_all_connections(self, online=online):
+            player = getattr(conn, "player", None)
+            if player:
+                if batch and uses_default_method(player.typeclass, "msg", _PLAYER):
+                    players.append(player)
+                else:
+                    try:
+                        player.typeclass.msg(msg.message, from_obj=msg.senders)
+                    except Exception:
+                        logger.log_trace("Cannot send msg to player '%s'" % player)
+                continue
             try:
-                conn.player.msg(msg.message, from_obj=msg.senders)
-            except AttributeError:
-                try:
-                    conn.to_external(msg.message,
-                                     senders=msg.senders, from_channel=self)
-                except Exception:
-                    logger.log_trace("Cannot send msg to connection '%s'" % conn)
+                conn.to_external(msg.message,
+                                 senders=msg.senders, from_channel=self)
+            except Exception:
+                logger.log_trace("Cannot send msg to connection '%s'" % conn)
+        if players:
+            text = to_str(msg.message, force_string=True) if msg.message else ""
+            _SESSIONS.data_out_multi(_SESSIONS.sessions_from_players(players), text=text)
 
     def msg(self, msgobj, header=None, senders=None, sender_strings=None,
             persistent=False, online=False, emit=False, external=False):
@@ -192,8 +220,10 @@ class Channel(TypeClass):
                 this is defined, external will be assumed.
         external - Treat this message agnostic of its sender.
         persistent (default False) - ignored if msgobj is a Msg or TempMsg.
-                If True, a Msg will be created, using header and senders
-                keywords. If False, other keywords will be ignored.
+                If True and the channel has keep_log set, the message is
+                stored as a Msg, using header and senders keywords. This
+                is done in the background, shortly after the message was
+                sent (see CHANNEL_LOG_INTERVAL).
         online (bool) - If this is set true, only messages people who are
                 online. Otherwise, messages all players connected. This can
                 make things faster, but may not trigger listeners on players
@@ -205,15 +235,13 @@ class Channel(TypeClass):
             senders = make_iter(senders)
         else:
             senders = []
+        keep_log = False
         if isinstance(msgobj, basestring):
             # given msgobj is a string
             msg = msgobj
-            if persistent and self.db.keep_log:
-                msgobj = Msg()
-                msgobj.save()
-            else:
-                # Use TempMsg, so this message is not stored.
-                msgobj = TempMsg()
+            # the message is stored later, after it was formatted
+            keep_log = persistent and self.db.keep_log
+            msgobj = TempMsg()
             msgobj.header = header
             msgobj.message = msg
             msgobj.channels = [self.dbobj]  # add this channel
@@ -227,6 +255,8 @@ class Channel(TypeClass):
                                         sender_strings=sender_strings,
                                         external=external)
         self.distribute_message(msgobj, online=online)
+        if keep_log:
+            log_channel_message(msgobj)
         self.post_send_message(msgobj)
         return True
 
@@ -5,7 +5,6 @@ These managers handles the
 import itertools
 from django.db import models
 from django.db.models import Q
-from django.contrib.contenttypes.models import ContentType
 from src.typeclasses.managers import returns_typeclass_list, returns_typeclass
 
 _GA = object.__getattribute__
@@ -14,8 +13,12 @@ _ObjectDB = None
 _ChannelDB = None
 _SESSIONS = None
 _ExternalConnection = None
+_PlayerConnection = None
 _User = None
 
+# in-memory index of the connections to each channel, see channel_connections
+_CHANNEL_CONNECTIONS = {}
+
 # error class
 
 
@@ -132,6 +135,38 @@ def to_object(inp, objtype='player'):
 # Msg manager
 #
 
+def channel_connections(channel):
+    """
+    Returns all connections to a channel as a tuple
+    ({player id: PlayerChannelConnection, ...}, [ExternalChannelConnection, ...])
+    The connections are kept in memory, so only the first call for
+    each channel queries the database. Any change to a connection
+    empties the index (see clear_channel_connections).
+    """
+    global _PlayerConnection, _ExternalConnection
+    if not _PlayerConnection:
+        from src.comms.models import PlayerChannelConnection as _PlayerConnection
+    if not _ExternalConnection:
+        from src.comms.models import ExternalChannelConnection as _ExternalConnection
+    channel = to_object(channel, objtype='channel')
+    try:
+        return _CHANNEL_CONNECTIONS[channel.id]
+    except KeyError:
+        players = dict((conn.db_player_id, conn) for conn in
+                       _PlayerConnection.objects.filter(db_channel=channel).select_related("db_player"))
+        externals = list(_ExternalConnection.objects.filter(db_channel=channel))
+        _CHANNEL_CONNECTIONS[channel.id] = (players, externals)
+        return players, externals
+
+
+def clear_channel_connections(*args, **kwargs):
+    """
+    Empty the index of channel connections. This is connected to the
+    save/delete signals of the connection models.
+    """
+    _CHANNEL_CONNECTIONS.clear()
+
+
 class MsgManager(models.Manager):
     """
     This MsgManager implements methods for searching
@@ -211,6 +246,9 @@ class MsgManager(models.Manager):
         """
         Get all messages sent to one channel
         """
+        # store channel messages still waiting to be logged
+        from src.comms.models import flush_channel_log
+        flush_channel_log(wait=True)
         return self.filter(db_receivers_channels=channel).exclude(db_hide_from_channels=channel)
 
     def message_search(self, sender=None, receiver=None, freetext=None, dbref=None):
@@ -338,22 +376,17 @@ class ChannelManager(models.Manager):
         if not _SESSIONS:
             from src.server.sessionhandler import SESSIONS as _SESSIONS
 
-        PlayerChannelConnection = ContentType.objects.get(app_label="comms",
-                                                          model="playerchannelconnection").model_class()
-        ExternalChannelConnection = ContentType.objects.get(app_label="comms",
-                                                            model="externalchannelconnection").model_class()
-        players = []
+        players, external_connections = channel_connections(channel)
         if online:
-            session_list = _SESSIONS.get_sessions()
-            unique_online_users = set(sess.uid for sess in session_list if sess.logged_in)
-            online_players = (sess.get_player() for sess in session_list if sess.uid in unique_online_users)
-            for player in online_players:
-                players.extend(PlayerChannelConnection.objects.filter(
-                    db_player=player.dbobj, db_channel=channel.dbobj))
+            # go through the listeners or the online players,
+            # whichever are fewer
+            online_uids = _SESSIONS.player_sessions
+            if len(online_uids) < len(players):
+                players = [players[uid] for uid in online_uids if uid in players]
+            else:
+                players = [conn for uid, conn in players.items() if uid in online_uids]
         else:
-            players.extend(PlayerChannelConnection.objects.get_all_connections(channel))
-
-        external_connections = ExternalChannelConnection.objects.get_all_connections(channel)
+            players = players.values()
 
         return itertools.chain(players, external_connections)
 
@@ -415,8 +448,7 @@ class PlayerChannelConnectionManager(models.Manager):
     def has_player_connection(self, player, channel):
         "Checks so a connection exists player<->channel"
         if player and channel:
-            return self.filter(db_player=player.dbobj).filter(
-                db_channel=channel.dbobj).count() > 0
+            return player.id in channel_connections(channel)[0]
         return False
 
     def get_all_connections(self, channel):
@@ -20,8 +20,10 @@ be able to delete connections on the fly).
 """
 
 from datetime import datetime
+from threading import Lock
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete
 from src.typeclasses.models import TypedObject, TagHandler, AttributeHandler, AliasHandler
 from src.utils.idmapper.models import SharedMemoryModel
 from src.comms import managers
@@ -37,6 +39,23 @@ _GA = object.__getattribute__
 _SA = object.__setattr__
 _DA = object.__delattr__
 
+_CHANNELHANDLER = None
+
+_CHANNEL_LOG_INTERVAL = settings.CHANNEL_LOG_INTERVAL
+_CHANNEL_LOG_QUEUE_SIZE = settings.CHANNEL_LOG_QUEUE_SIZE
+_CHANNEL_LOG_MAX_QUEUE_SIZE = settings.CHANNEL_LOG_MAX_QUEUE_SIZE
+# times to try storing a message with others before storing it alone
+_CHANNEL_LOG_RETRIES = 3
+# channel messages waiting to be stored, see log_channel_message
+_CHANNEL_LOG_QUEUE = []
+_CHANNEL_LOG_FLUSH_CALL = None
+# the records handed to the writer thread, until it is done with them
+_CHANNEL_LOG_BATCH = None
+# held while writing, so only one batch is written at a time
+_CHANNEL_LOG_LOCK = Lock()
+# the Msg relations filled in when storing a channel message
+_CHANNEL_LOG_RELATIONS = ("db_sender_players", "db_sender_objects", "db_receivers_channels")
+
 
 #------------------------------------------------------------
 #
@@ -337,6 +356,188 @@ class TempMsg(object):
                                 access_type=access_type, default=default)
 
 
+#------------------------------------------------------------
+#
+# Channel log
+#
+#------------------------------------------------------------
+
+def _store_channel_log(records):
+    """
+    Store channel log records as Msgs, all in one transaction. The Msg
+    rows are inserted directly rather than with save() (which always
+    runs in the reactor thread), and their senders and channels are
+    inserted in bulk, one query per relation.
+    """
+    meta, manager = Msg._meta, Msg._base_manager
+    fields = [field for field in meta.local_fields if not isinstance(field, models.AutoField)]
+    relations = {}
+    for fieldname in _CHANNEL_LOG_RELATIONS:
+        field = meta.get_field(fieldname)
+        relations[fieldname] = (field.rel.through, "%s_id" % field.m2m_field_name(),
+                                "%s_id" % field.m2m_reverse_field_name(), [])
+    with transaction.commit_on_success():
+        for message, header, sender_external, date_sent, related, tries in records:
+            msg = Msg(db_message=message, db_header=header,
+                      db_sender_external=sender_external, db_date_sent=date_sent)
+            # raw, so the time sent is not replaced by auto_now_add
+            msg_id = manager._insert([msg], fields=fields, return_id=True,
+                                     raw=True, using=manager.db)
+            for fieldname, ids in related.items():
+                through, msg_field, target_field, rows = relations[fieldname]
+                rows.extend(through(**{msg_field: msg_id, target_field: target_id})
+                            for target_id in ids)
+        for through, msg_field, target_field, rows in relations.values():
+            if rows:
+                through.objects.bulk_create(rows)
+
+
+def _write_channel_log(records):
+    """
+    Store queued channel messages. This is normally run in a thread.
+    Only one batch is written at a time. Once written, the records
+    list is emptied, so a batch is never written twice.
+
+    If the batch can not be stored, its records are returned, to be
+    queued and tried again with the next batch. A record that failed
+    CHANNEL_LOG_RETRIES times is instead stored on its own (so a bad
+    record, like one referring to a since deleted channel, can not
+    keep the rest from being stored), or discarded if that fails too.
+    """
+    with _CHANNEL_LOG_LOCK:
+        if not records:
+            # already written
+            return []
+        retry = []
+        try:
+            _store_channel_log(records)
+        except Exception:
+            logger.log_trace("Could not store %i channel messages." % len(records))
+            for record in records:
+                tries = record[-1] + 1
+                if tries < _CHANNEL_LOG_RETRIES:
+                    retry.append(record[:-1] + (tries,))
+                    continue
+                try:
+                    _store_channel_log([record])
+                except Exception:
+                    logger.log_trace("Discarded channel message '%s'." % crop(record[0]))
+        del records[:]
+        return retry
+
+
+def _requeue_channel_log(records):
+    "Queue records that could not be stored again, before newer ones"
+    _CHANNEL_LOG_QUEUE[0:0] = records
+    _trim_channel_log_queue()
+
+
+def _trim_channel_log_queue():
+    "Discard the oldest queued messages if the queue is too long"
+    ndiscard = len(_CHANNEL_LOG_QUEUE) - _CHANNEL_LOG_MAX_QUEUE_SIZE
+    if ndiscard > 0:
+        del _CHANNEL_LOG_QUEUE[:ndiscard]
+        logger.log_errmsg("Channel log queue is full, discarded %i messages." % ndiscard)
+
+
+def _channel_log_failed(failure, records):
+    "Called if the writer thread failed, queues the records again"
+    logger.log_errmsg("Could not store %i channel messages: %s" % (len(records),
+                                                                  failure.getErrorMessage()))
+    _requeue_channel_log(records)
+
+
+def _channel_log_written(result):
+    "Called when the writer thread is done, queues up the next write"
+    global _CHANNEL_LOG_BATCH, _CHANNEL_LOG_FLUSH_CALL
+    _CHANNEL_LOG_BATCH = None
+    if len(_CHANNEL_LOG_QUEUE) >= _CHANNEL_LOG_QUEUE_SIZE:
+        flush_channel_log()
+    elif _CHANNEL_LOG_QUEUE and not _CHANNEL_LOG_FLUSH_CALL:
+        from twisted.internet import reactor
+        _CHANNEL_LOG_FLUSH_CALL = reactor.callLater(_CHANNEL_LOG_INTERVAL, flush_channel_log)
+
+
+def flush_channel_log(wait=False):
+    """
+    Store all queued channel messages. This is called automatically
+    CHANNEL_LOG_INTERVAL seconds after a message was queued, or when
+    CHANNEL_LOG_QUEUE_SIZE messages are waiting. The messages are
+    written by a thread, one batch at a time; messages sent while
+    a batch is being written are queued for the next one. At most
+    CHANNEL_LOG_MAX_QUEUE_SIZE messages are kept waiting, the oldest
+    are discarded beyond that.
+
+    wait - write in this thread and return when all messages sent so
+           far are stored (or discarded, after failing to store
+           CHANNEL_LOG_RETRIES times), including those of a batch
+           the writer thread is still busy with. This is used when
+           the server shuts down or reloads, and before reading a
+           channel's log.
+    """
+    global _CHANNEL_LOG_FLUSH_CALL, _CHANNEL_LOG_BATCH
+    if _CHANNEL_LOG_FLUSH_CALL and _CHANNEL_LOG_FLUSH_CALL.active():
+        _CHANNEL_LOG_FLUSH_CALL.cancel()
+    _CHANNEL_LOG_FLUSH_CALL = None
+    if wait:
+        if _CHANNEL_LOG_BATCH:
+            # this waits for the writer thread to finish, or writes
+            # the batch here if the thread has not started on it yet
+            _requeue_channel_log(_write_channel_log(_CHANNEL_LOG_BATCH))
+        # each pass stores, retries or discards every record, so
+        # this ends after at most CHANNEL_LOG_RETRIES passes
+        while _CHANNEL_LOG_QUEUE:
+            records = _CHANNEL_LOG_QUEUE[:]
+            del _CHANNEL_LOG_QUEUE[:]
+            _requeue_channel_log(_write_channel_log(records))
+        return
+    if not _CHANNEL_LOG_QUEUE or _CHANNEL_LOG_BATCH is not None:
+        # nothing to do, or the writer will come back for these when done
+        return
+    from twisted.internet import threads
+    records = _CHANNEL_LOG_BATCH = _CHANNEL_LOG_QUEUE[:]
+    del _CHANNEL_LOG_QUEUE[:]
+    deferred = threads.deferToThread(_write_channel_log, records)
+    deferred.addCallbacks(_requeue_channel_log, _channel_log_failed, errbackArgs=(records,))
+    deferred.addBoth(_channel_log_written)
+
+
+def log_channel_message(msgobj):
+    """
+    Queue a message sent to channels to be stored in the database as a
+    Msg. The message is not stored right away, see flush_channel_log.
+
+    msgobj - a TempMsg (or Msg) holding the message as sent, its
+             senders and its channels.
+    """
+    global _CHANNEL_LOG_FLUSH_CALL
+    related = dict((fieldname, []) for fieldname in _CHANNEL_LOG_RELATIONS)
+    sender_external = None
+    for sender in make_iter(msgobj.senders):
+        obj, typ = identify_object(sender)
+        if typ == "player":
+            related["db_sender_players"].append(obj.id)
+        elif typ == "object":
+            related["db_sender_objects"].append(obj.id)
+        elif typ == "external":
+            sender_external = "1"
+        elif isinstance(obj, basestring):
+            sender_external = obj
+    for channel in make_iter(msgobj.channels):
+        obj, typ = identify_object(channel)
+        if typ == "channel":
+            related["db_receivers_channels"].append(obj.id)
+    # the last item counts the failed tries to store the message
+    _CHANNEL_LOG_QUEUE.append((msgobj.message, msgobj.header, sender_external,
+                               datetime.now(), related, 0))
+    _trim_channel_log_queue()
+    if len(_CHANNEL_LOG_QUEUE) >= _CHANNEL_LOG_QUEUE_SIZE:
+        flush_channel_log()
+    elif not _CHANNEL_LOG_FLUSH_CALL:
+        from twisted.internet import reactor
+        _CHANNEL_LOG_FLUSH_CALL = reactor.callLater(_CHANNEL_LOG_INTERVAL, flush_channel_log)
+
+
 #------------------------------------------------------------
 #
 # Channel
@@ -369,6 +570,25 @@ class ChannelDB(TypedObject):
         _SA(self, "aliases", AliasHandler(self, category_prefix="comm_"))
         _SA(self, "attributes", AttributeHandler(self))
 
+    def _at_db_lock_storage_presave(self):
+        """
+        This hook is called automatically when the locks are saved.
+        The channel command and cached cmdsets must be re-created.
+        """
+        global _CHANNELHANDLER
+        if not _CHANNELHANDLER:
+            from src.comms.channelhandler import CHANNELHANDLER as _CHANNELHANDLER
+        _CHANNELHANDLER.channel_changed(self)
+
+    def _at_db_key_presave(self):
+        """
+        This hook is called automatically when the key is saved.
+        """
+        global _CHANNELHANDLER
+        if not _CHANNELHANDLER:
+            from src.comms.channelhandler import CHANNELHANDLER as _CHANNELHANDLER
+        _CHANNELHANDLER.channel_changed(self)
+
     class Meta:
         "Define Django meta options"
         verbose_name = "Channel"
@@ -426,6 +646,7 @@ class ChannelDB(TypedObject):
         for connection in ChannelDB.objects.get_all_connections(self):
             connection.delete()
         super(ChannelDB, self).delete()
+        managers.clear_channel_connections()
 
     def access(self, accessing_obj, access_type='listen', default=False):
         """
@@ -647,3 +868,11 @@ class ExternalChannelConnection(SharedMemoryModel):
             exec(to_str(self.external_send_code))
         except Exception:
             logger.log_trace("Channel %s could not send to External %s" % (self.channel, self.external_key))
+
+
+# keep the in-memory index of channel connections up to date
+for _model in (PlayerChannelConnection, ExternalChannelConnection):
+    post_save.connect(managers.clear_channel_connections, sender=_model,
+                      dispatch_uid="channelconnections_save_%s" % _model.__name__)
+    post_delete.connect(managers.clear_channel_connections, sender=_model,
+                        dispatch_uid="channelconnections_delete_%s" % _model.__name__)
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""
+Unit testing of the 'comms' Evennia component.
+
+Runs as part of the Evennia's test suite with 'manage.py test"
+
+This tests the channel log, which queues messages sent to channels
+and stores them as Msgs in batches.
+"""
+
+try:
+    from django.utils.unittest import TestCase
+except ImportError:
+    from django.test import TestCase
+
+from src.comms import models
+from src.comms.models import Msg, TempMsg, log_channel_message, flush_channel_log
+from src.utils import create
+
+
+class _Call(object):
+    "Stands in for the pending call to flush the log, so none is made"
+    def active(self):
+        return False
+
+    def cancel(self):
+        pass
+
+
+class TestChannelLog(TestCase):
+    "Queueing and storing of channel messages"
+    def setUp(self):
+        "sets up the testing environment"
+        self.channel = create.create_channel("testlogchannel")
+        self.old = (models._CHANNEL_LOG_FLUSH_CALL, models._CHANNEL_LOG_QUEUE_SIZE,
+                    models._CHANNEL_LOG_MAX_QUEUE_SIZE, models._store_channel_log)
+        # never start the writer thread or schedule a flush
+        models._CHANNEL_LOG_FLUSH_CALL = _Call()
+        models._CHANNEL_LOG_QUEUE_SIZE = 1000
+        del models._CHANNEL_LOG_QUEUE[:]
+
+    def tearDown(self):
+        (models._CHANNEL_LOG_FLUSH_CALL, models._CHANNEL_LOG_QUEUE_SIZE,
+         models._CHANNEL_LOG_MAX_QUEUE_SIZE, models._store_channel_log) = self.old
+        del models._CHANNEL_LOG_QUEUE[:]
+        self.channel.delete()
+
+    def log(self, *messages):
+        "queue messages as sent to the test channel"
+        for message in messages:
+            # log_channel_message schedules a flush if none is pending
+            models._CHANNEL_LOG_FLUSH_CALL = _Call()
+            msgobj = TempMsg(channels=[self.channel], message=message, header="hdr")
+            log_channel_message(msgobj)
+
+    def stored(self):
+        "the messages stored for the test channel"
+        return sorted(msg.db_message for msg in
+                      Msg.objects.filter(db_receivers_channels=self.channel.dbobj))
+
+    def test_queue(self):
+        self.log("one", "two")
+        self.assertEqual(2, len(models._CHANNEL_LOG_QUEUE))
+        self.assertEqual([], self.stored())
+        date_sent = models._CHANNEL_LOG_QUEUE[0][3]
+        flush_channel_log(wait=True)
+        self.assertEqual([], models._CHANNEL_LOG_QUEUE)
+        self.assertEqual(["one", "two"], self.stored())
+        msg = Msg.objects.filter(db_receivers_channels=self.channel.dbobj, db_message="one")[0]
+        self.assertEqual("hdr", msg.db_header)
+        # the time it was sent, not the time it was stored
+        self.assertEqual(date_sent, msg.db_date_sent)
+
+    def test_get_messages_flushes(self):
+        self.log("one")
+        messages = Msg.objects.get_messages_by_channel(self.channel.dbobj)
+        self.assertEqual(["one"], [msg.db_message for msg in messages])
+
+    def test_flush_wait_stores_batch(self):
+        # a batch handed to the writer thread, which did not start on it yet
+        self.log("one")
+        batch = models._CHANNEL_LOG_QUEUE[:]
+        del models._CHANNEL_LOG_QUEUE[:]
+        self.log("two")
+        models._CHANNEL_LOG_BATCH = batch
+        try:
+            flush_channel_log(wait=True)
+        finally:
+            models._CHANNEL_LOG_BATCH = None
+        self.assertEqual([], batch)
+        self.assertEqual(["one", "two"], self.stored())
+        # the thread finds nothing left to store
+        self.assertEqual([], models._write_channel_log(batch))
+        self.assertEqual(["one", "two"], self.stored())
+
+    def test_max_queue_size(self):
+        models._CHANNEL_LOG_MAX_QUEUE_SIZE = 3
+        self.log("one", "two", "three", "four", "five")
+        self.assertEqual(["three", "four", "five"],
+                         [record[0] for record in models._CHANNEL_LOG_QUEUE])
+
+    def test_retry(self):
+        stored = []
+        def store_once_failing(records):
+            if not stored:
+                stored.append(None)
+                raise IOError("database is locked")
+            stored.extend(record[0] for record in records)
+        models._store_channel_log = store_once_failing
+        self.log("one", "two")
+        records = models._CHANNEL_LOG_QUEUE[:]
+        retry = models._write_channel_log(records)
+        self.assertEqual([], records)
+        self.assertEqual([("one", 1), ("two", 1)], [(rec[0], rec[-1]) for rec in retry])
+        self.assertEqual([], models._write_channel_log(retry))
+        self.assertEqual([None, "one", "two"], stored)
+
+    def test_bad_record(self):
+        stored = []
+        def store_failing_bad(records):
+            if any(record[0] == "bad" for record in records):
+                raise IOError("integrity error")
+            stored.extend(record[0] for record in records)
+        models._store_channel_log = store_failing_bad
+        self.log("one", "bad", "two")
+        flush_channel_log(wait=True)
+        # after failing with "bad" in the batch, the others were
+        # stored one by one and "bad" was discarded
+        self.assertEqual(["one", "two"], stored)
+        self.assertEqual([], models._CHANNEL_LOG_QUEUE)
+        self.log("three")
+        flush_channel_log(wait=True)
+        self.assertEqual(["one", "two", "three"], stored)
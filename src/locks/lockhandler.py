@@ -107,11 +107,12 @@ to any other identifier you can use.
 
 import re
 import inspect
+from time import time
 from django.conf import settings
 from src.utils import logger, utils
 from django.utils.translation import ugettext as _
 
-__all__ = ("LockHandler", "LockException")
+__all__ = ("LockHandler", "LockException", "flush_lock_cache")
 
 
 #
@@ -141,6 +142,33 @@ def _cache_lockfuncs():
         else:
             logger.log_errmsg("Couldn't load %s from PERMISSION_FUNC_MODULES." % modulepath)
 
+#
+# Lock result cache
+#
+# The same lock checks are often repeated many times during a single
+# command. If settings.LOCK_RESULT_CACHE_TTL is set, check() results are
+# cached for that many seconds. The cache is flushed when it expires and
+# whenever locks, permissions or tags change.
+
+_LOCK_CACHE_TTL = settings.LOCK_RESULT_CACHE_TTL
+_LOCK_RESULT_CACHE = {}
+_LOCK_CACHE_STATS = {"hits": 0, "misses": 0, "flushed": time()}
+
+def flush_lock_cache():
+    """
+    Clear the lock result cache. This is called automatically whenever
+    locks are changed or the permissions/tags of an object changes.
+    """
+    global _LOCK_RESULT_CACHE
+    _LOCK_RESULT_CACHE = {}
+    _LOCK_CACHE_STATS["flushed"] = time()
+
+def get_lock_cache_stats():
+    """
+    Returns a tuple (size, hits, misses) for the lock result cache.
+    """
+    return len(_LOCK_RESULT_CACHE), _LOCK_CACHE_STATS["hits"], _LOCK_CACHE_STATS["misses"]
+
 #
 # pre-compiled regular expressions
 #
@@ -150,6 +178,93 @@ _RE_SEPS = re.compile(r"(?<=[ )])AND(?=\s)|(?<=[ )])OR(?=\s)|(?<=[ )])NOT(?=\s)"
 _RE_OK = re.compile(r"%s|and|or|not")
 
 
+#
+# Lock compilation
+#
+
+def _compile_lockfunc(func, args, kwargs):
+    "Wrap a single lock function call"
+    def lockfunc(accessing_obj, accessed_obj):
+        return bool(func(accessing_obj, accessed_obj, *args, **kwargs))
+    return lockfunc
+
+def _compile_or(terms):
+    "Short-circuiting OR of compiled terms"
+    def lock_or(accessing_obj, accessed_obj):
+        for term in terms:
+            if term(accessing_obj, accessed_obj):
+                return True
+        return False
+    return lock_or
+
+def _compile_and(terms):
+    "Short-circuiting AND of compiled terms"
+    def lock_and(accessing_obj, accessed_obj):
+        for term in terms:
+            if not term(accessing_obj, accessed_obj):
+                return False
+        return True
+    return lock_and
+
+def _compile_not(term):
+    "Negation of a compiled term"
+    def lock_not(accessing_obj, accessed_obj):
+        return not term(accessing_obj, accessed_obj)
+    return lock_not
+
+def _compile_lock(evalstring, lock_funcs):
+    """
+    Compile a lock definition into a single callable on the form
+    func(accessing_obj, accessed_obj) -> bool.
+
+    evalstring - the purged lock definition, a space-separated
+                 sequence of placeholders '%s' (one per lock function)
+                 and the operators 'and', 'or' and 'not'.
+    lock_funcs - sequence of (func, args, kwargs), one per placeholder.
+
+    The operators have the same precedence as in Python (not > and > or).
+    Evaluation is short-circuited, so lock functions are not called
+    once the result of the lock is known. Raises LockException if the
+    definition is malformed.
+    """
+    tokens = evalstring.split()
+    lock_funcs = list(lock_funcs)
+    pos = [0, 0]  # token position, lock function position
+
+    def _peek():
+        return tokens[pos[0]] if pos[0] < len(tokens) else None
+
+    def _parse_or():
+        terms = [_parse_and()]
+        while _peek() == "or":
+            pos[0] += 1
+            terms.append(_parse_and())
+        return terms[0] if len(terms) == 1 else _compile_or(tuple(terms))
+
+    def _parse_and():
+        terms = [_parse_not()]
+        while _peek() == "and":
+            pos[0] += 1
+            terms.append(_parse_not())
+        return terms[0] if len(terms) == 1 else _compile_and(tuple(terms))
+
+    def _parse_not():
+        token = _peek()
+        pos[0] += 1
+        if token == "not":
+            return _compile_not(_parse_not())
+        elif token == "%s" and pos[1] < len(lock_funcs):
+            func, args, kwargs = lock_funcs[pos[1]]
+            pos[1] += 1
+            return _compile_lockfunc(func, args, kwargs)
+        raise LockException("Lock: unexpected '%s' in '%s'." % (token, evalstring))
+
+    compiled = _parse_or()
+    if pos[0] != len(tokens) or pos[1] != len(lock_funcs):
+        raise LockException("Lock: could not compile '%s'." % evalstring)
+    return compiled
+
+
 #
 #
 # Lock handler
@@ -227,17 +342,18 @@ class LockHandler(object):
             if len(lock_funcs) < nfuncs:
                 continue
             try:
-                # purge the eval string of any superfluous items, then test it
+                # purge the eval string of any superfluous items, then
+                # compile it into a callable
                 evalstring = " ".join(_RE_OK.findall(evalstring))
-                eval(evalstring % tuple(True for func in funclist), {}, {})
-            except Exception:
+                compiled = _compile_lock(evalstring, lock_funcs)
+            except LockException:
                 elist.append(_("Lock: definition '%s' has syntax errors.") % raw_lockstring)
                 continue
             if access_type in locks:
                 duplicates += 1
                 wlist.append(_("Lock: access type '%(access_type)s' changed from '%(source)s' to '%(goal)s' " % \
                                  {"access_type":access_type, "source":locks[access_type][2], "goal":raw_lockstring}))
-            locks[access_type] = (evalstring, tuple(lock_funcs), raw_lockstring)
+            locks[access_type] = (evalstring, tuple(lock_funcs), raw_lockstring, compiled)
         if wlist and self.log_obj:
             # a warning text was set, it's not an error, so only report
             # if log_obj is available.
@@ -300,6 +416,7 @@ class LockHandler(object):
         # cache the locks will get rid of eventual doublets
         self._cache_locks(storage_lockstring)
         self._save_locks()
+        flush_lock_cache()
         self.log_obj = None
         return True
 
@@ -316,7 +433,7 @@ class LockHandler(object):
     def get(self, access_type=None):
         "get the full lockstring or the lockstring of a particular access type."
         if access_type:
-            return self.locks.get(access_type, ["", "", ""])[2]
+            return self.locks.get(access_type, ["", "", "", None])[2]
         return str(self)
 
     def delete(self, access_type):
@@ -324,6 +441,7 @@ class LockHandler(object):
         if access_type in self.locks:
             del self.locks[access_type]
             self._save_locks()
+            flush_lock_cache()
             return True
         return False
 
@@ -332,6 +450,7 @@ class LockHandler(object):
         self.locks = {}
         self.lock_storage = ""
         self._save_locks()
+        flush_lock_cache()
 
     def reset(self):
         """
@@ -356,17 +475,17 @@ class LockHandler(object):
 
         Parsing the lockstring, we (during cache) extract the valid
         lock functions and store their function objects in the right
-        order along with their args/kwargs. These are now executed in
-        sequence, creating a list of True/False values. This is put
-        into the evalstring, which is a string of AND/OR/NOT entries
-        separated by placeholders where each function result should
-        go. We just put those results in and evaluate the string to
-        get a final, combined True/False value for the lockstring.
+        order along with their args/kwargs. The AND/OR/NOT structure
+        of the lockstring is then compiled into a nested set of
+        callables wrapping those lock functions. Checking the lock
+        just calls this compiled lock, which executes the lock
+        functions in order until the combined True/False result is
+        known (so later functions may never be called at all).
 
         The important bit with this solution is that the full
-        lockstring is never blindly evaluated, and thus there (should
-        be) no way to sneak in malign code in it. Only "safe" lock
-        functions (as defined by your settings) are executed.
+        lockstring is never evaluated, and thus there is no way to
+        sneak in malign code in it. Only "safe" lock functions
+        (as defined by your settings) are executed.
 
         """
         try:
@@ -383,15 +502,30 @@ class LockHandler(object):
         # no superuser or bypass -> normal lock operation
         if access_type in self.locks:
             # we have a lock, test it.
-            evalstring, func_tup, raw_string = self.locks[access_type]
-            # execute all lock funcs in the correct order, producing a tuple of True/False results.
-            true_false = tuple(bool(tup[0](accessing_obj, self.obj, *tup[1], **tup[2])) for tup in func_tup)
-            # the True/False tuple goes into evalstring, which combines them
-            # with AND/OR/NOT in order to get the final result.
-            return eval(evalstring % true_false)
+            if _LOCK_CACHE_TTL:
+                return self._cached_check(accessing_obj, access_type)
+            return self.locks[access_type][3](accessing_obj, self.obj)
         else:
             return default
 
+    def _cached_check(self, accessing_obj, access_type):
+        """
+        Check a lock through the lock result cache. The cache entry
+        keeps a reference to the objects so their ids can't be re-used
+        while the entry lives.
+        """
+        if time() - _LOCK_CACHE_STATS["flushed"] > _LOCK_CACHE_TTL:
+            flush_lock_cache()
+        cachekey = (id(self), id(accessing_obj), access_type)
+        try:
+            result = _LOCK_RESULT_CACHE[cachekey][0]
+            _LOCK_CACHE_STATS["hits"] += 1
+        except KeyError:
+            result = self.locks[access_type][3](accessing_obj, self.obj)
+            _LOCK_RESULT_CACHE[cachekey] = (result, self, accessing_obj)
+            _LOCK_CACHE_STATS["misses"] += 1
+        return result
+
     def check_lockstring(self, accessing_obj, lockstring, no_superuser_bypass=False):
         """
         Do a direct check against a lockstring ('atype:func()..'), without any
@@ -410,10 +544,7 @@ class LockHandler(object):
 
         locks = self._parse_lockstring(lockstring)
         for access_type in locks:
-            evalstring, func_tup, raw_string = locks[access_type]
-            true_false = tuple(tup[0](accessing_obj, self.obj, *tup[1],**tup[2])
-                                      for tup in func_tup)
-            return eval(evalstring % true_false)
+            return locks[access_type][3](accessing_obj, self.obj)
 
 
 def _test():
@@ -15,7 +15,8 @@ except ImportError:
     from django.test import TestCase
 
 from django.conf import settings
-from src.locks import lockfuncs
+from src.locks import lockfuncs, lockhandler
+from src.locks.lockhandler import get_lock_cache_stats
 from src.utils import create
 
 #------------------------------------------------------------
@@ -61,3 +62,62 @@ class TestLockfuncs(LockTest):
         self.assertEquals(False, lockfuncs.attr_lt(self.obj2, self.obj1, 'testattr', '45'))
         self.assertEquals(True, lockfuncs.attr_le(self.obj2, self.obj1, 'testattr', '45'))
         self.assertEquals(False, lockfuncs.attr_ne(self.obj2, self.obj1, 'testattr', '45'))
+class TestLockCompile(LockTest):
+    def testrun(self):
+        self.obj2.permissions.add('Builders')
+        # operator precedence is not > and > or, as in Python
+        self.obj1.locks.add("test1:false() and false() or true();test2:not false() and perm(Builders)")
+        self.assertEquals(True, self.obj1.locks.check(self.obj2, 'test1'))
+        self.assertEquals(True, self.obj1.locks.check(self.obj2, 'test2'))
+        # the or short-circuits after true()
+        self.obj1.locks.add("test3:true() or attr(nonexistent)")
+        self.assertEquals(True, self.obj1.locks.check(self.obj2, 'test3'))
+        self.assertEquals(True, self.obj1.locks.check_lockstring(self.obj2, "dummy:perm(Builders) and not false()"))
+
+def _tag(accessing_obj, accessed_obj, *args, **kwargs):
+    "lock function for testing; True if accessing_obj has the tag args[0]"
+    return bool(accessing_obj.tags.get(args[0]))
+
+class TestLockResultCache(LockTest):
+    "check() with LOCK_RESULT_CACHE_TTL set must see changes right away"
+    def setUp(self):
+        super(TestLockResultCache, self).setUp()
+        self.old_ttl = lockhandler._LOCK_CACHE_TTL
+        lockhandler._LOCK_CACHE_TTL = 600
+        if not lockhandler._LOCKFUNCS:
+            lockhandler._cache_lockfuncs()
+        lockhandler._LOCKFUNCS["tag"] = _tag
+        lockhandler.flush_lock_cache()
+    def tearDown(self):
+        lockhandler._LOCK_CACHE_TTL = self.old_ttl
+        del lockhandler._LOCKFUNCS["tag"]
+        lockhandler.flush_lock_cache()
+    def testrun(self):
+        self.obj1.locks.add("edit:perm(Wizards);get:tag(carrier)")
+        self.assertEquals(False, self.obj1.locks.check(self.obj2, 'edit'))
+        hits = get_lock_cache_stats()[1]
+        self.assertEquals(False, self.obj1.locks.check(self.obj2, 'edit'))
+        # the second check came from the cache
+        self.assertEquals(hits + 1, get_lock_cache_stats()[1])
+        # permission
+        self.obj2.permissions.add('Wizards')
+        self.assertEquals(True, self.obj1.locks.check(self.obj2, 'edit'))
+        self.obj2.permissions.remove('Wizards')
+        self.assertEquals(False, self.obj1.locks.check(self.obj2, 'edit'))
+        # tag
+        self.assertEquals(False, self.obj1.locks.check(self.obj2, 'get'))
+        self.obj2.tags.add('carrier')
+        self.assertEquals(True, self.obj1.locks.check(self.obj2, 'get'))
+        self.obj2.tags.remove('carrier')
+        self.assertEquals(False, self.obj1.locks.check(self.obj2, 'get'))
+        # lock
+        self.obj1.locks.add("edit:true()")
+        self.assertEquals(True, self.obj1.locks.check(self.obj2, 'edit'))
+        self.obj1.locks.delete("edit")
+        self.assertEquals(True, self.obj1.locks.check(self.obj2, 'edit', default=True))
+        self.obj1.locks.add("edit:false()")
+        self.assertEquals(False, self.obj1.locks.check(self.obj2, 'edit'))
+        self.obj1.locks.add("get:true()")
+        self.assertEquals(True, self.obj1.locks.check(self.obj2, 'get'))
+        self.obj1.locks.clear()
+        self.assertEquals(False, self.obj1.locks.check(self.obj2, 'get'))
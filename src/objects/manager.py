@@ -15,6 +15,7 @@ _GA = object.__getattribute__
 
 # delayed import
 _ATTR = None
+_PREFETCH_ATTRIBUTES = None
 
 
 # Try to use a custom way to parse id-tagged multimatches.
@@ -178,8 +179,14 @@ class ObjectManager(TypedObjectManager):
 
         excludeobj - one or more object keys to exclude from the match
         """
+        global _PREFETCH_ATTRIBUTES
+        if not _PREFETCH_ATTRIBUTES:
+            from src.typeclasses.models import prefetch_attributes as _PREFETCH_ATTRIBUTES
         exclude_restriction = Q(pk__in=[_GA(obj, "id") for obj in make_iter(excludeobj)]) if excludeobj else Q()
-        return self.filter(db_location=location).exclude(exclude_restriction)
+        contents = list(self.filter(db_location=location).exclude(exclude_restriction))
+        # load the Attributes of all contents in one go
+        _PREFETCH_ATTRIBUTES(contents)
+        return contents
 
     @returns_typeclass_list
     def get_objs_with_key_or_alias(self, ostring, exact=True,
@@ -15,6 +15,7 @@ transparently through the decorating TypeClass.
 """
 
 import traceback
+from collections import defaultdict
 from django.db import models
 from django.conf import settings
 
@@ -25,14 +26,17 @@ from src.players.models import PlayerDB
 from src.commands.cmdsethandler import CmdSetHandler
 from src.commands import cmdhandler
 from src.scripts.scripthandler import ScriptHandler
+from src.scripts.models import validate_scripts_on_obj as _validate_scripts_on_obj
 from src.utils import logger
-from src.utils.utils import make_iter, to_str, to_unicode, variable_from_module
+from src.utils.utils import (make_iter, to_str, to_unicode, variable_from_module,
+                             uses_default_method)
 
 from django.utils.translation import ugettext as _
 
 #__all__ = ("ObjectDB", )
 
 _ScriptDB = None
+_has_active_scripts = None
 _AT_SEARCH_RESULT = variable_from_module(*settings.SEARCH_AT_RESULT.rsplit('.', 1))
 _SESSIONS = None
 
@@ -40,10 +44,33 @@ _GA = object.__getattribute__
 _SA = object.__setattr__
 _DA = object.__delattr__
 
+# in-memory counters tracking changes to the contents of each location,
+# keyed on the location's id. These are bumped whenever an object enters
+# or leaves a location and allow e.g. the cmdhandler to know if it needs
+# to re-gather the objects in a room.
+_CONTENTS_VERSIONS = defaultdict(int)
+
 _ME = _("me")
 _SELF = _("self")
 _HERE = _("here")
 
+# the default Object typeclass, see _has_default_hook
+_OBJECT = None
+
+
+def _has_default_hook(obj, hookname):
+    """
+    Check if obj's class uses the default Object.msg() or
+    Object.at_msg_send() method, given as hookname. The default msg()
+    does nothing but relay to the object's session and the default
+    at_msg_send() does nothing at all, so for such objects a broadcast
+    can be sent directly to the sessions.
+    """
+    global _OBJECT
+    if not _OBJECT:
+        from src.objects.objects import Object as _OBJECT
+    return uses_default_method(obj, hookname, _OBJECT)
+
 
 #------------------------------------------------------------
 #
@@ -144,6 +171,8 @@ class ObjectDB(TypedObject):
         _SA(self, "tags", TagHandler(self, category_prefix="object"))
         _SA(self, "aliases", AliasHandler(self, category_prefix="object"))
         _SA(self, "nicks", NickHandler(self))
+        # remember the location so we know what to update when it changes
+        _SA(self, "_prev_location_id", _GA(self, "db_location_id"))
         # make sure to sync the contents cache when initializing
         #_GA(self, "contents_update")()
 
@@ -154,6 +183,43 @@ class ObjectDB(TypedObject):
         # we need to re-cache this for superusers to bypass.
         self.locks.cache_lock_bypass(self)
 
+    def at_idmapper_flush(self):
+        """
+        Called before this object is evicted from the idmapper cache.
+        Puppeted objects and objects with running scripts are kept.
+        """
+        global _has_active_scripts
+        if not _has_active_scripts:
+            from src.scripts.models import has_active_scripts as _has_active_scripts
+        if _GA(self, "db_sessid") is not None:
+            return False
+        if _has_active_scripts(_GA(self, "id")):
+            return False
+        return super(ObjectDB, self).at_idmapper_flush()
+
+    def _at_db_location_presave(self):
+        """
+        This hook is called automatically when the location field is saved.
+        It marks the contents of both the old and the new location as changed.
+        """
+        new_loc_id = _GA(self, "db_location_id")
+        old_loc_id = _GA(self, "_prev_location_id")
+        if new_loc_id != old_loc_id:
+            if old_loc_id:
+                _CONTENTS_VERSIONS[old_loc_id] += 1
+            if new_loc_id:
+                _CONTENTS_VERSIONS[new_loc_id] += 1
+            # our scripts may not be valid in the new location
+            _validate_scripts_on_obj(_GA(self, "id"))
+            _SA(self, "_prev_location_id", new_loc_id)
+
+    def _at_db_typeclass_path_presave(self):
+        """
+        This hook is called automatically when the typeclass is saved.
+        Scripts on this object may not be valid for the new typeclass.
+        """
+        _validate_scripts_on_obj(_GA(self, "id"))
+
     # cmdset_storage property. We use a custom wrapper to manage this. This also
     # seems very sensitive to caching, so leaving it be for now. /Griatch
     #@property
@@ -232,6 +298,15 @@ class ObjectDB(TypedObject):
         return ObjectDB.objects.get_contents(self)
     contents = property(contents_get)
 
+    #@property
+    def __contents_version_get(self):
+        """
+        A counter that changes whenever an object enters or
+        leaves this object. This is not stored in the database.
+        """
+        return _CONTENTS_VERSIONS[_GA(self, "id")]
+    contents_version = property(__contents_version_get)
+
     #@property
     def __exits_get(self):
         """
@@ -463,12 +538,41 @@ class ObjectDB(TypedObject):
         exclude is a list of objects not to send to. See self.msg() for
                 more info.
         """
+        global _SESSIONS
+        if not _SESSIONS:
+            from src.server.sessionhandler import SESSIONS as _SESSIONS
         contents = _GA(self, "contents")
         if exclude:
             exclude = make_iter(exclude)
             contents = [obj for obj in contents if obj not in exclude]
+        # objects with the default msg() get the message sent to
+        # their sessions all at once, the rest are messaged one by one.
+        # If from_obj has its own at_msg_send(), it must be called
+        # for every receiver, so then all are messaged one by one. So
+        # are they if a sessid is given, since msg() then sends to that
+        # session rather than to each object's own.
+        batch = ((not from_obj or _has_default_hook(from_obj, "at_msg_send"))
+                 and not kwargs.get("sessid"))
+        sessions = []
         for obj in contents:
-            obj.msg(message, from_obj=from_obj, **kwargs)
+            if batch and _has_default_hook(obj, "msg"):
+                sessid = obj.sessid
+                session = sessid and _SESSIONS.session_from_sessid(sessid)
+                if session:
+                    sessions.append(session)
+            else:
+                obj.msg(message, from_obj=from_obj, **kwargs)
+        if sessions:
+            # no sessid was given, so msg() would use each object's own
+            kwargs.pop("sessid", None)
+            if "data" in kwargs:
+                # deprecation warning
+                logger.log_depmsg("ObjectDB.msg_contents(): 'data'-dict keyword is deprecated. Use **kwargs instead.")
+                data = kwargs.pop("data")
+                if isinstance(data, dict):
+                    kwargs.update(data)
+            text = to_str(message, force_string=True) if message else ""
+            _SESSIONS.data_out_multi(sessions, text=text, **kwargs)
 
     def move_to(self, destination, quiet=False,
                 emit_to_obj=None, use_destination=True, to_none=False):
@@ -738,6 +842,11 @@ class ObjectDB(TypedObject):
         # Clear out any non-exit objects located within the object
         _GA(self, "clear_contents")()
         #old_loc = _GA(self, "location")
+        # we are leaving our location
+        old_loc_id = _GA(self, "db_location_id")
+        if old_loc_id:
+            _CONTENTS_VERSIONS[old_loc_id] += 1
+        _CONTENTS_VERSIONS.pop(_GA(self, "id"), None)
         # Perform the deletion of the object
         super(ObjectDB, self).delete()
         # clear object's old  location's content cache of this object
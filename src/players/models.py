@@ -118,6 +118,10 @@ class PlayerDB(TypedObject, AbstractUser):
         _SA(self, "aliases", AliasHandler(self, category_prefix="player_"))
         _SA(self, "nicks", NickHandler(self))
 
+    def at_idmapper_flush(self):
+        "Connected players are never evicted from the idmapper cache."
+        return not _GA(self, "db_is_connected") and super(PlayerDB, self).at_idmapper_flush()
+
     # alias to the objs property
     def __characters_get(self):
         return self.objs
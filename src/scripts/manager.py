@@ -10,6 +10,8 @@ __all__ = ("ScriptManager",)
 
 VALIDATE_ITERATION = 0
 
+_get_scripts_to_validate = None
+
 
 class ScriptManager(TypedObjectManager):
     """
@@ -109,6 +111,12 @@ class ScriptManager(TypedObjectManager):
         If key and/or obj is given, only update the related
         script/object.
 
+        If no arguments are given, not all running scripts are
+        checked, but only those that may have become invalid: those
+        on objects that moved or changed typeclass since the last
+        validation, and those with a custom is_valid(). All scripts
+        not yet started are also checked (and started).
+
         Only one of the arguments are supposed to be supplied
         at a time, since they are exclusive to each other.
 
@@ -160,8 +168,14 @@ class ScriptManager(TypedObjectManager):
                 scripts = self.get_id(dbref)
             elif obj:
                 scripts = self.get_all_scripts_on_obj(obj, key=key)
+            elif key:
+                scripts = self.get_all_scripts(key=key)
             else:
-                scripts = self.get_all_scripts(key=key) #self.model.get_all_cached_instances()
+                global _get_scripts_to_validate
+                if not _get_scripts_to_validate:
+                    from src.scripts.models import get_scripts_to_validate as _get_scripts_to_validate
+                scripts = _get_scripts_to_validate() + \
+                          [dbobj.typeclass for dbobj in self.filter(db_is_active=False)]
 
         if not scripts:
             # no scripts available to validate
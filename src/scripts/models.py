@@ -24,6 +24,7 @@ Common examples of uses of Scripts:
 - give the player/object a time-limited bonus/effect
 
 """
+from collections import defaultdict
 from django.conf import settings
 from django.db import models
 
@@ -32,8 +33,62 @@ from src.typeclasses.models import (TypedObject, TagHandler,
 from src.scripts.manager import ScriptManager
 
 __all__ = ("ScriptDB",)
+_GA = object.__getattribute__
 _SA = object.__setattr__
 
+_Script = None
+
+# ids of the active scripts on each object, keyed on the object's id.
+# This is kept up to date when a script's is_active field is saved.
+_ACTIVE_SCRIPTS_ON_OBJ = defaultdict(set)
+# all active scripts, keyed on their id. Also kept up to date
+# when is_active is saved.
+_ACTIVE_SCRIPTS = {}
+# ids of active scripts to re-check at the next validation
+_SCRIPTS_TO_VALIDATE = set()
+# {typeclass path: bool} - if the typeclass overloads is_valid()
+_CUSTOM_IS_VALID = {}
+
+
+def has_active_scripts(obj_id):
+    "Check if the object with the given id has any running scripts."
+    return obj_id in _ACTIVE_SCRIPTS_ON_OBJ
+
+
+def validate_scripts_on_obj(obj_id):
+    """
+    Mark the active scripts on the object with the given id to be
+    re-checked by the next ScriptDB.objects.validate(). This is
+    called when the object moves or changes typeclass.
+    """
+    if obj_id in _ACTIVE_SCRIPTS_ON_OBJ:
+        _SCRIPTS_TO_VALIDATE.update(_ACTIVE_SCRIPTS_ON_OBJ[obj_id])
+
+
+def get_scripts_to_validate():
+    """
+    Returns the typeclasses of the active scripts that may have
+    become invalid since the last validation; those marked by
+    validate_scripts_on_obj and those with an is_valid() that does
+    not simply return True. The marks are cleared.
+    """
+    global _Script
+    if not _Script:
+        from src.scripts.scripts import Script as _Script
+    marked = _SCRIPTS_TO_VALIDATE.copy()
+    _SCRIPTS_TO_VALIDATE.clear()
+    scripts = []
+    for dbid, dbobj in _ACTIVE_SCRIPTS.items():
+        path = _GA(dbobj, "db_typeclass_path")
+        custom = _CUSTOM_IS_VALID.get(path)
+        if custom is None:
+            is_valid = type(dbobj.typeclass).is_valid
+            custom = getattr(is_valid, "im_func", None) is not _Script.is_valid.im_func
+            _CUSTOM_IS_VALID[path] = custom
+        if custom or dbid in marked:
+            scripts.append(dbobj.typeclass)
+    return scripts
+
 
 #------------------------------------------------------------
 #
@@ -116,6 +171,31 @@ class ScriptDB(TypedObject):
     #
     #
 
+    def _at_db_is_active_presave(self):
+        """
+        This hook is called automatically when the is_active field is
+        saved. It keeps track of which scripts are running, and on
+        which objects.
+        """
+        dbid = _GA(self, "id")
+        if _GA(self, "db_is_active"):
+            _ACTIVE_SCRIPTS[dbid] = self
+        else:
+            _ACTIVE_SCRIPTS.pop(dbid, None)
+        obj_id = _GA(self, "db_obj_id")
+        if obj_id is None:
+            return
+        if _GA(self, "db_is_active"):
+            _ACTIVE_SCRIPTS_ON_OBJ[obj_id].add(_GA(self, "id"))
+        elif obj_id in _ACTIVE_SCRIPTS_ON_OBJ:
+            _ACTIVE_SCRIPTS_ON_OBJ[obj_id].discard(_GA(self, "id"))
+            if not _ACTIVE_SCRIPTS_ON_OBJ[obj_id]:
+                del _ACTIVE_SCRIPTS_ON_OBJ[obj_id]
+
+    def at_idmapper_flush(self):
+        "Running scripts are never evicted from the idmapper cache."
+        return not _GA(self, "db_is_active") and super(ScriptDB, self).at_idmapper_flush()
+
 
     def at_typeclass_error(self):
         """
@@ -134,4 +214,11 @@ class ScriptDB(TypedObject):
         if self.delete_iter > 0:
             return
         self.delete_iter += 1
+        _ACTIVE_SCRIPTS.pop(_GA(self, "id"), None)
+        _SCRIPTS_TO_VALIDATE.discard(_GA(self, "id"))
+        obj_id = _GA(self, "db_obj_id")
+        if obj_id in _ACTIVE_SCRIPTS_ON_OBJ:
+            _ACTIVE_SCRIPTS_ON_OBJ[obj_id].discard(_GA(self, "id"))
+            if not _ACTIVE_SCRIPTS_ON_OBJ[obj_id]:
+                del _ACTIVE_SCRIPTS_ON_OBJ[obj_id]
         super(ScriptDB, self).delete()
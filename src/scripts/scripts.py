@@ -6,12 +6,12 @@ It also defines a few common scripts.
 """
 
 from time import time
-from twisted.internet.defer import maybeDeferred
-from twisted.internet.task import LoopingCall
+from twisted.python.failure import Failure
 from django.conf import settings
 from django.utils.translation import ugettext as _
 from src.typeclasses.typeclass import TypeClass
 from src.scripts.models import ScriptDB
+from src.scripts.ticker import SCRIPT_TICKER
 from src.comms import channelhandler
 from src.utils import logger
 
@@ -44,26 +44,21 @@ class ScriptClass(TypeClass):
             return False
 
     def _start_task(self, start_now=True):
-        "start task runner"
-
-        self.ndb.twisted_task = LoopingCall(self._step_task)
+        "start task runner, by putting the script on the script ticker"
+        self.ndb.time_last_called = int(time())
         if self.ndb._paused_time:
             # we had paused the script, restarting
-            #print " start with paused time:", self.key, self.ndb._paused_time
-            self.ndb.twisted_task.start(self.ndb._paused_time, now=False)
+            SCRIPT_TICKER.schedule(self, self.ndb._paused_time)
         else:
             # starting script anew.
-            #print "_start_task: self.interval:", self.key, self.dbobj.interval
-            self.ndb.twisted_task.start(self.dbobj.interval,
-                                        now=start_now and not self.start_delay)
-        self.ndb.time_last_called = int(time())
+            SCRIPT_TICKER.schedule(self, self.dbobj.interval)
+            if start_now and not self.start_delay:
+                self._step_task()
 
     def _stop_task(self):
         "stop task runner"
         try:
-            #print "stopping twisted task:", id(self.ndb.twisted_task), self.obj
-            if self.ndb.twisted_task and self.ndb.twisted_task.running:
-                self.ndb.twisted_task.stop()
+            SCRIPT_TICKER.unschedule(self)
         except Exception:
             logger.log_trace()
 
@@ -92,27 +87,23 @@ class ScriptClass(TypeClass):
             self.stop()
             return
         else:
+            # saved together with those of other scripts by the ticker
             self.dbobj.db_repeats -= 1
+            SCRIPT_TICKER.save_later(self, "db_repeats")
         self.ndb.time_last_called = int(time())
-        self.save()
 
         if self.ndb._paused_time:
             # this means we were running an unpaused script, for the
-            # time remaining after the pause. Now we start a normal-running
-            # timer again.
-            # print "switching to normal run:", self.key
+            # time remaining after the pause. The ticker already
+            # scheduled the next repeat a normal interval from now.
             del self.ndb._paused_time
-            self._stop_task()
-            self._start_task(start_now=False)
 
     def _step_task(self):
-        "step task"
+        "step task. This is called by the script ticker."
         try:
-            d = maybeDeferred(self._step_succ_callback)
-            d.addErrback(self._step_err_callback)
-            return d
+            self._step_succ_callback()
         except Exception:
-            logger.log_trace()
+            self._step_err_callback(Failure())
 
     # Public methods
 
@@ -125,10 +116,7 @@ class ScriptClass(TypeClass):
         check in on their scripts and when they will next be run.
         """
         try:
-            if self.ndb._paused_time:
-                return max(0, (self.ndb.time_last_called + self.ndb._paused_time) - int(time()))
-            else:
-                return max(0, (self.ndb.time_last_called + self.dbobj.db_interval) - int(time()))
+            return SCRIPT_TICKER.time_until(self)
         except Exception:
             return None
 
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+"""
+Unit testing of the 'scripts' Evennia component.
+
+Runs as part of the Evennia's test suite with 'manage.py test"
+
+This tests the ScriptTicker driving the repeats of timed Scripts. The
+clock and the LoopingCall of the ticker are replaced, so the tests
+decide when time passes and when the ticker ticks.
+"""
+
+try:
+    from django.utils.unittest import TestCase
+except ImportError:
+    from django.test import TestCase
+
+from src.scripts import ticker
+
+
+class _Clock(object):
+    "Replaces time.time in the ticker module"
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class _LoopingCall(object):
+    "Replaces the LoopingCall of the ticker; never fires by itself"
+    def __init__(self, func):
+        self.func = func
+        self.running = False
+
+    def start(self, interval, now=True):
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+
+class _DbObj(object):
+    "Stand-in for a ScriptDB; remembers what was saved"
+    def __init__(self, dbid, interval):
+        self.id = dbid
+        self.db_interval = interval
+        self.saved = []
+        # the number of saves to fail
+        self.fail = 0
+
+    def save(self, update_fields=None):
+        if self.fail:
+            self.fail -= 1
+            raise IOError("database is locked")
+        self.saved.append(update_fields)
+
+
+class _Script(object):
+    "Stand-in for a Script; remembers when it repeated"
+    def __init__(self, dbid, interval, on_step=None):
+        self.dbid = dbid
+        self.dbobj = _DbObj(dbid, interval)
+        self.on_step = on_step
+        self.steps = []
+
+    def _step_task(self):
+        self.steps.append(ticker.time())
+        if self.on_step:
+            self.on_step(self)
+
+
+class TestScriptTicker(TestCase):
+    "Scheduling and repeating Scripts on the timer wheel"
+    def setUp(self):
+        "sets up the testing environment"
+        self.old_time, self.old_loopingcall = ticker.time, ticker.LoopingCall
+        self.clock = _Clock(1000.0)
+        ticker.time = self.clock
+        ticker.LoopingCall = _LoopingCall
+        self.ticker = ticker.ScriptTicker()
+
+    def tearDown(self):
+        ticker.time, ticker.LoopingCall = self.old_time, self.old_loopingcall
+
+    def advance(self, seconds):
+        "let time pass and tick, as the LoopingCall would"
+        self.clock.now += seconds
+        self.ticker.tick()
+
+    def test_schedule_unschedule(self):
+        script = _Script(1, 5)
+        self.ticker.schedule(script, 5)
+        self.assertEqual({1: 1005}, self.ticker.scheduled)
+        self.assertEqual({1005: {1: script}}, self.ticker.slots)
+        self.assertTrue(self.ticker.task.running)
+        # scheduling again replaces the earlier scheduling
+        self.ticker.schedule(script, 3)
+        self.assertEqual({1: 1003}, self.ticker.scheduled)
+        self.assertEqual({1003: {1: script}}, self.ticker.slots)
+        self.ticker.unschedule(script)
+        self.assertEqual({}, self.ticker.scheduled)
+        self.assertEqual({}, self.ticker.slots)
+        self.assertEqual(None, self.ticker.time_until(script))
+
+    def test_repeat(self):
+        script = _Script(1, 5)
+        self.ticker.schedule(script, 5)
+        self.advance(4)
+        self.assertEqual([], script.steps)
+        self.advance(1)
+        self.assertEqual([1005.0], script.steps)
+        self.assertEqual(1010, self.ticker.scheduled[1])
+        self.advance(5)
+        self.assertEqual([1005.0, 1010.0], script.steps)
+
+    def test_reschedule_in_tick(self):
+        def reschedule(script):
+            self.ticker.schedule(script, 2)
+        script = _Script(1, 5, on_step=reschedule)
+        self.ticker.schedule(script, 1)
+        self.advance(1)
+        self.assertEqual([1001.0], script.steps)
+        # the rescheduling from inside the tick wins over the interval
+        self.assertEqual({1: 1003}, self.ticker.scheduled)
+        self.assertEqual({1003: {1: script}}, self.ticker.slots)
+        self.advance(2)
+        self.assertEqual([1001.0, 1003.0], script.steps)
+
+    def test_stop_in_tick(self):
+        def stop(script):
+            self.ticker.unschedule(script)
+        script1 = _Script(1, 1, on_step=stop)
+        script2 = _Script(2, 1)
+        self.ticker.schedule(script1, 1)
+        self.ticker.schedule(script2, 1)
+        self.advance(1)
+        self.assertEqual([1001.0], script1.steps)
+        self.assertEqual({2: 1002}, self.ticker.scheduled)
+        self.advance(1)
+        self.assertEqual([1001.0], script1.steps)
+        self.assertEqual([1001.0, 1002.0], script2.steps)
+
+    def test_stop_other_in_tick(self):
+        script2 = _Script(2, 1)
+        def stop_other(script):
+            self.ticker.unschedule(script2)
+        script1 = _Script(1, 1, on_step=stop_other)
+        self.ticker.schedule(script1, 1)
+        self.ticker.schedule(script2, 2)
+        # both are due in the same tick, script1 in the earlier slot,
+        # so it repeats first and stops script2 before it repeats
+        self.advance(2)
+        self.assertEqual([1002.0], script1.steps)
+        self.assertEqual([], script2.steps)
+        self.assertEqual({1: 1003}, self.ticker.scheduled)
+        self.advance(1)
+        self.assertEqual([1002.0, 1003.0], script1.steps)
+        self.assertEqual([], script2.steps)
+
+    def test_skip_missed(self):
+        script = _Script(1, 2)
+        self.ticker.schedule(script, 2)
+        # the server lags; several repeats are due at once
+        self.advance(11)
+        self.assertEqual([1011.0], script.steps)
+        self.assertEqual({1: 1012}, self.ticker.scheduled)
+        self.advance(1)
+        self.assertEqual([1011.0, 1012.0], script.steps)
+        self.assertEqual({1: 1014}, self.ticker.scheduled)
+
+    def test_time_until(self):
+        self.clock.now = 1000.5
+        script = _Script(1, 3)
+        self.ticker.schedule(script, 3)
+        self.assertEqual(1004, self.ticker.scheduled[1])
+        self.assertEqual(4, self.ticker.time_until(script))
+        self.clock.now = 1002.2
+        self.assertEqual(2, self.ticker.time_until(script))
+        # due but not yet ticked
+        self.clock.now = 1004.5
+        self.assertEqual(0, self.ticker.time_until(script))
+        self.ticker.tick()
+        self.assertEqual(3, self.ticker.time_until(script))
+
+    def test_stop_when_empty(self):
+        once = _Script(1, 0)
+        self.ticker.schedule(once, 1)
+        task = self.ticker.task
+        self.assertTrue(task.running)
+        self.advance(1)
+        self.assertEqual([1001.0], once.steps)
+        self.assertEqual({}, self.ticker.scheduled)
+        self.assertFalse(task.running)
+        # scheduling again starts the ticker again
+        self.ticker.schedule(once, 1)
+        self.assertTrue(self.ticker.task.running)
+        self.advance(1)
+        self.assertEqual([1001.0, 1002.0], once.steps)
+
+    def test_failed_save(self):
+        script = _Script(1, 1)
+        script.dbobj.fail = 1
+        self.ticker.save_later(script, "db_repeats")
+        self.ticker.save_dirty()
+        self.assertEqual([], script.dbobj.saved)
+        # kept to be saved after the next tick
+        self.assertEqual({1: (script.dbobj, set(["db_repeats"]))}, self.ticker.dirty)
+        self.ticker.save_dirty()
+        self.assertEqual([["db_repeats"]], script.dbobj.saved)
+        self.assertEqual({}, self.ticker.dirty)
+
+    def test_failed_save_given_up(self):
+        script1, script2 = _Script(1, 1), _Script(2, 1)
+        script1.dbobj.fail = 100
+        for _ in range(ticker._SAVE_RETRIES):
+            self.ticker.save_later(script1, "db_repeats")
+            self.ticker.save_later(script2, "db_repeats")
+            self.ticker.save_dirty()
+        self.assertEqual({}, self.ticker.dirty)
+        self.assertEqual([], script1.dbobj.saved)
+        self.assertEqual([["db_repeats"]] * ticker._SAVE_RETRIES, script2.dbobj.saved)
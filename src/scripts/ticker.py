@@ -0,0 +1,181 @@
+"""
+The script ticker drives the at_repeat() calls of all timed Scripts.
+
+Rather than each Script running its own LoopingCall (which gives the
+reactor one timer per Script to keep track of), all Scripts are kept
+on a timer wheel; a dict mapping each second to the Scripts due to
+repeat at that second. A single LoopingCall ticks once per second and
+repeats all Scripts due since the last tick in one go, then puts them
+back on the wheel at their next due time.
+
+Script intervals are in whole seconds, so this is also the precision
+of the ticker; a Script repeats within a second after it is due.
+
+Database fields changed by the repeats (the count of repeats left)
+are not saved by each Script but marked with save_later(), and saved
+for all Scripts together, in one transaction, at the end of the tick.
+
+The ticker is used through the Script's start/stop/pause methods and
+should not normally need to be accessed directly.
+"""
+
+from math import ceil
+from time import time
+from twisted.internet.task import LoopingCall
+from django.db import transaction
+from src.utils import logger
+
+__all__ = ("ScriptTicker", "SCRIPT_TICKER")
+
+# times to try saving a script before giving up on its changes
+_SAVE_RETRIES = 3
+
+
+class ScriptTicker(object):
+    """
+    The timer wheel of Scripts. Each slot of the wheel is an
+    integer timestamp, holding the Scripts to repeat at that second.
+    """
+
+    def __init__(self):
+        # {slot: {dbid: script}}
+        self.slots = {}
+        # {dbid: slot} of all scheduled scripts
+        self.scheduled = {}
+        # {dbid: (dbobj, set of fieldnames)} to save after this tick
+        self.dirty = {}
+        # {dbid: number of failed saves} of scripts that could not be saved
+        self.failures = {}
+        # the last slot repeated
+        self.last_slot = int(time())
+        self.task = None
+
+    def _start(self):
+        "Start ticking, if not already running"
+        if not (self.task and self.task.running):
+            self.last_slot = int(time())
+            self.task = LoopingCall(self.tick)
+            self.task.start(1, now=False)
+
+    def schedule(self, script, delay):
+        """
+        Schedule script to repeat in delay seconds (rounded up to the
+        next whole second), replacing any earlier scheduling of it.
+        """
+        slot = int(ceil(time() + delay))
+        self.schedule_slot(script, slot)
+
+    def schedule_slot(self, script, slot):
+        "Schedule script to repeat at the given slot (timestamp)"
+        dbid = script.dbid
+        self.unschedule(script, dbid=dbid)
+        # never schedule into a slot already repeated
+        slot = max(slot, self.last_slot + 1)
+        self.scheduled[dbid] = slot
+        self.slots.setdefault(slot, {})[dbid] = script
+        self._start()
+
+    def unschedule(self, script, dbid=None):
+        "Remove script from the wheel, if it is on it"
+        dbid = dbid if dbid is not None else script.dbid
+        slot = self.scheduled.pop(dbid, None)
+        if slot is not None:
+            scripts = self.slots.get(slot)
+            if scripts:
+                scripts.pop(dbid, None)
+                if not scripts:
+                    del self.slots[slot]
+
+    def save_later(self, script, *fieldnames):
+        """
+        Mark database fields of script as changed, to be saved at the
+        end of the current tick (or at the next one, if called outside
+        of a tick) together with those of all other scripts.
+        """
+        dbobj = script.dbobj
+        self.dirty.setdefault(dbobj.id, (dbobj, set()))[1].update(fieldnames)
+
+    def save_dirty(self):
+        """
+        Save the fields marked by save_later, all in one transaction.
+        This is also called when the server shuts down or reloads.
+
+        Each script is saved in a savepoint, so one failing save does
+        not undo the others. A script that could not be saved is tried
+        again after the next tick, a few times at most.
+        """
+        if not self.dirty:
+            return
+        dirty = self.dirty
+        self.dirty = {}
+        failed = []
+        with transaction.commit_on_success():
+            for dbid, (dbobj, fieldnames) in dirty.items():
+                if dbobj.id is None:
+                    # the script was stopped and deleted
+                    continue
+                sid = transaction.savepoint()
+                try:
+                    dbobj.save(update_fields=list(fieldnames))
+                    transaction.savepoint_commit(sid)
+                    self.failures.pop(dbid, None)
+                except Exception:
+                    transaction.savepoint_rollback(sid)
+                    logger.log_trace("Could not save script %s." % dbobj)
+                    failed.append(dbid)
+        for dbid in failed:
+            nfailed = self.failures.get(dbid, 0) + 1
+            if nfailed < _SAVE_RETRIES:
+                self.failures[dbid] = nfailed
+                # merge with fields changed since
+                dbobj, fieldnames = dirty[dbid]
+                self.dirty.setdefault(dbid, (dbobj, set()))[1].update(fieldnames)
+            else:
+                logger.log_errmsg("Gave up saving script %s." % dirty[dbid][0])
+                self.failures.pop(dbid, None)
+
+    def time_until(self, script):
+        """
+        Returns the time in seconds until the script repeats, or
+        None if it is not scheduled.
+        """
+        slot = self.scheduled.get(script.dbid)
+        if slot is None:
+            return None
+        return max(0, int(ceil(slot - time())))
+
+    def tick(self):
+        """
+        Repeat all scripts due since the last tick. Each script is
+        put back on the wheel before its at_repeat is called, so it
+        may stop or reschedule itself from there.
+        """
+        now = int(time())
+        scheduled = self.scheduled
+        for slot in xrange(self.last_slot + 1, now + 1):
+            self.last_slot = slot
+            scripts = self.slots.pop(slot, None)
+            if not scripts:
+                continue
+            for dbid, script in scripts.items():
+                if scheduled.get(dbid) != slot:
+                    # stopped or rescheduled by an earlier script
+                    continue
+                interval = script.dbobj.db_interval
+                if interval > 0:
+                    # if we lag behind, skip the missed repeats
+                    next_slot = max(slot + interval, now + 1)
+                    scheduled[dbid] = next_slot
+                    self.slots.setdefault(next_slot, {})[dbid] = script
+                else:
+                    del scheduled[dbid]
+                try:
+                    script._step_task()
+                except Exception:
+                    logger.log_trace()
+        self.save_dirty()
+        if not scheduled and self.task and self.task.running:
+            # nothing left to tick
+            self.task.stop()
+
+SCRIPT_TICKER = ScriptTicker()
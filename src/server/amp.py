@@ -14,20 +14,35 @@ Server - (AMP server) Handles all mud operations. The server holds its own list
          of sessions tied to player objects. This is synced against the portal
          at startup and when a session connects/disconnects
 
+Text messages going in either direction are by default collected
+during one reactor iteration and sent together as one MsgBatch
+command, rather than one AMP command per message (see the
+AMP_BATCH_MESSAGES setting).
+
+The keyword data of text messages is encoded with the codec set by
+AMP_CODEC (see encode_msgdata). Admin commands always use pickle.
+
 """
 
 # imports needed on both server and portal side
 import os
+import marshal
 from collections import defaultdict
 from textwrap import wrap
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 from twisted.protocols import amp
-from twisted.internet import protocol
+from twisted.internet import protocol, reactor
 from twisted.internet.defer import Deferred
+from django.conf import settings
 from src.utils.utils import to_str, variable_from_module
+from src.utils import logger
 
 # communication bits
 
@@ -42,6 +57,7 @@ SSYNC = chr(8)        # server sessigon sync
 
 MAXLEN = 65535  # max allowed data length in AMP protocol
 _MSGBUFFER = defaultdict(list)
+_BATCH_MESSAGES = settings.AMP_BATCH_MESSAGES
 
 def get_restart_mode(restart_file):
     """
@@ -196,6 +212,22 @@ class PortalAdmin(amp.Command):
     response = []
 
 
+class MsgBatch(amp.Command):
+    """
+    Bidirectional
+
+    Many messages portal -> server or server -> portal, for
+    any number of sessions, sent as one command.
+    """
+    key = "MsgBatch"
+    arguments = [('sessid', amp.Integer()),
+                 ('ipart', amp.Integer()),
+                 ('nparts', amp.Integer()),
+                 ('data', amp.String())]
+    errors = [(Exception, 'EXCEPTION')]
+    response = []
+
+
 class FunctionCall(amp.Command):
     """
     Bidirectional
@@ -217,6 +249,42 @@ class FunctionCall(amp.Command):
 dumps = lambda data: to_str(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
 loads = lambda data: pickle.loads(to_str(data))
 
+# codecs for message data, name: (tag, encoder, decoder). The tag is
+# stored as the first byte of the encoded data, so the receiving side
+# can always decode it, whatever codec the sender used.
+_MSGDATA_CODECS = {"pickle": ("p", dumps, loads),
+                   "marshal": ("m", marshal.dumps, marshal.loads)}
+if msgpack:
+    _MSGDATA_CODECS["msgpack"] = ("M", msgpack.packb, msgpack.unpackb)
+_MSGDATA_DECODERS = dict((tag, decoder) for tag, encoder, decoder in _MSGDATA_CODECS.values())
+try:
+    _MSGDATA_TAG, _MSGDATA_ENCODER = _MSGDATA_CODECS[settings.AMP_CODEC][:2]
+except KeyError:
+    raise ImportError("AMP_CODEC '%s' is not available. Available codecs: %s." %
+                      (settings.AMP_CODEC, ", ".join(_MSGDATA_CODECS)))
+
+
+def encode_msgdata(data):
+    """
+    Encode the keyword data of a message (or a whole batch of messages)
+    for sending over AMP. Empty data is sent as an empty string. If the
+    chosen codec cannot handle the data (marshal only supports Python
+    builtins, for example), pickle is used instead.
+    """
+    if not data:
+        return ""
+    try:
+        return _MSGDATA_TAG + _MSGDATA_ENCODER(data)
+    except (ValueError, TypeError):
+        return "p" + dumps(data)
+
+
+def decode_msgdata(data):
+    "Decode data encoded with encode_msgdata"
+    if not data:
+        return {}
+    return _MSGDATA_DECODERS[data[0]](data[1:])
+
 # multipart message store
 
 
@@ -235,6 +303,13 @@ class AMPProtocol(amp.AMP):
     subclasses that specify the datatypes of the input/output of these methods.
     """
 
+    def __init__(self, *args, **kwargs):
+        "Set up the message batching"
+        amp.AMP.__init__(self, *args, **kwargs)
+        self.msgbatch = []
+        self.msgbatch_command = None
+        self.msgbatch_call = None
+
     # helper methods
 
     def connectionMade(self):
@@ -335,6 +410,38 @@ class AMPProtocol(amp.AMP):
                 recv_kwargs = dict((key, "".join(kw[key] for kw in buf)) for key in kwargs)
                 return recv_kwargs
 
+    def batch_send(self, command, sessid, msg, data):
+        """
+        Queue a message for sending with the next batch. The batch is
+        sent at the next reactor iteration, so all messages sent during
+        this one are sent together. If batching is turned off, the
+        message is sent directly with the given command.
+        """
+        if not _BATCH_MESSAGES:
+            return self.safe_send(command, sessid, msg=msg, data=encode_msgdata(data))
+        self.msgbatch.append((sessid, msg, data))
+        self.msgbatch_command = command
+        if not self.msgbatch_call:
+            self.msgbatch_call = reactor.callLater(0, self.flush_batch)
+
+    def flush_batch(self):
+        """
+        Send all queued messages. This is called automatically, but
+        must also be called before sending anything that must not
+        overtake the queued messages (like a disconnect).
+        """
+        if self.msgbatch_call and self.msgbatch_call.active():
+            self.msgbatch_call.cancel()
+        self.msgbatch_call = None
+        batch, self.msgbatch = self.msgbatch, []
+        if not batch:
+            return
+        if len(batch) == 1 and not isinstance(batch[0][0], (list, tuple)):
+            # no need to batch a single message
+            sessid, msg, data = batch[0]
+            return self.safe_send(self.msgbatch_command, sessid, msg=msg, data=encode_msgdata(data))
+        return self.safe_send(MsgBatch, 0, data=encode_msgdata(batch))
+
 #    def send_split_msg(self, sessid, msg, data, command):
 #        """
 #        This helper method splits the sending of a msg into multiple parts
@@ -386,7 +493,7 @@ class AMPProtocol(amp.AMP):
         if ret is not None:
             self.factory.server.sessions.data_in(sessid,
                                                  text=ret["text"],
-                                                 **loads(ret["data"]))
+                                                 **decode_msgdata(ret["data"]))
         return {}
 #        global MSGBUFFER
 #        if nparts > 1:
@@ -409,9 +516,8 @@ class AMPProtocol(amp.AMP):
         Access method called by the Portal and executed on the Portal.
         """
         #print "msg portal->server (portal side):", sessid, msg, data
-        return self.safe_send(MsgPortal2Server, sessid,
-                              msg=to_str(msg) if msg is not None else "",
-                              data=dumps(data))
+        return self.batch_send(MsgPortal2Server, sessid,
+                               to_str(msg) if msg is not None else "", data)
 #        try:
 #            return self.callRemote(MsgPortal2Server,
 #                            sessid=sessid,
@@ -436,7 +542,7 @@ class AMPProtocol(amp.AMP):
         if ret is not None:
             self.factory.portal.sessions.data_out(sessid,
                                                   text=ret["text"],
-                                                  **loads(ret["data"]))
+                                                  **decode_msgdata(ret["data"]))
         return {}
 #        global MSGBUFFER
 #        if nparts > 1:
@@ -460,9 +566,8 @@ class AMPProtocol(amp.AMP):
         Access method called by the Server and executed on the Server.
         """
         #print "msg server->portal (server side):", sessid, msg, data
-        return self.safe_send(MsgServer2Portal, sessid,
-                              msg=to_str(msg) if msg is not None else "",
-                              data=dumps(data))
+        return self.batch_send(MsgServer2Portal, sessid,
+                               to_str(msg) if msg is not None else "", data)
 
 #        try:
 #            return self.callRemote(MsgServer2Portal,
@@ -476,6 +581,52 @@ class AMPProtocol(amp.AMP):
 #            # We need to send in blocks.
 #            return self.send_split_msg(sessid, msg, data, MsgServer2Portal)
 
+    def call_remote_MsgServer2PortalMulti(self, sessids, msg, data=""):
+        """
+        Access method called by the Server and executed on the Server.
+        This sends the same message to many sessions (a broadcast). The
+        message is sent over the wire only once, together with the
+        list of sessids to relay it to on the Portal side.
+        """
+        msg = to_str(msg) if msg is not None else ""
+        sessids = tuple(sessids)
+        if not sessids:
+            return
+        if len(sessids) == 1:
+            return self.call_remote_MsgServer2Portal(sessids[0], msg, data)
+        if not _BATCH_MESSAGES:
+            return self.safe_send(MsgBatch, 0, data=encode_msgdata([(sessids, msg, data)]))
+        self.batch_send(MsgServer2Portal, sessids, msg, data)
+
+    # Batched messages, either direction
+
+    def amp_msg_batch(self, sessid, ipart, nparts, data):
+        """
+        Relays a batch of messages to their sessions. This is executed
+        on the Server or the Portal, depending on who sent the batch.
+        A message with a list of sessids instead of a single one is a
+        broadcast, sent on to all those sessions by the Portal.
+        """
+        ret = self.safe_recv(MsgBatch, sessid, ipart, nparts, data=data)
+        if ret is not None:
+            if hasattr(self.factory, "portal"):
+                relay = self.factory.portal.sessions.data_out
+                relay_multi = self.factory.portal.sessions.data_out_multi
+            else:
+                relay = self.factory.server.sessions.data_in
+                relay_multi = None
+            for sessid, msg, kwargs in decode_msgdata(ret["data"]):
+                # don't let one bad message stop the rest of the batch
+                try:
+                    if relay_multi and isinstance(sessid, (list, tuple)):
+                        relay_multi(sessid, text=msg, **kwargs)
+                    else:
+                        relay(sessid, text=msg, **kwargs)
+                except Exception:
+                    logger.log_trace()
+        return {}
+    MsgBatch.responder(amp_msg_batch)
+
     # Server administration from the Portal side
     def amp_server_admin(self, sessid, ipart, nparts, operation, data):
         """
@@ -518,6 +669,7 @@ class AMPProtocol(amp.AMP):
         Access method called by the Portal and Executed on the Portal.
         """
         #print "serveradmin (portal side):", sessid, ord(operation), data
+        self.flush_batch()
         data = dumps(data)
         return self.safe_send(ServerAdmin, sessid, operation=operation, data=data)
 #        return self.callRemote(ServerAdmin,
@@ -570,6 +722,7 @@ class AMPProtocol(amp.AMP):
         """
         Access method called by the server side.
         """
+        self.flush_batch()
         self.safe_send(PortalAdmin, sessid, operation=operation, data=dumps(data))
         #print "portaladmin (server side):", sessid, ord(operation), data
 #        return self.callRemote(PortalAdmin,
@@ -613,6 +766,7 @@ class AMPProtocol(amp.AMP):
             A deferred that fires with the return value of the remote
             function call
         """
+        self.flush_batch()
         return self.callRemote(FunctionCall,
                                module=modulepath,
                                function=functionname,
@@ -181,13 +181,15 @@ def flush_prop_cache():
 
 def get_cache_sizes():
     """
-    Get cache sizes, expressed in number of objects and memory size in MB
+    Get cache sizes, expressed in number of objects and memory size in MB.
+    The lock result cache is reported as (entries, hits, misses).
     """
     global _ATTR_CACHE, _PROP_CACHE
+    from src.locks.lockhandler import get_lock_cache_stats
     attr_n = len(_ATTR_CACHE)
     attr_mb = sum(getsizeof(obj) for obj in _ATTR_CACHE) / 1024.0
     prop_n = sum(len(dic) for dic in _PROP_CACHE.values())
     prop_mb = sum(sum([getsizeof(obj) for obj in dic.values()]) for dic in _PROP_CACHE.values()) / 1024.0
-    return (attr_n, attr_mb), (prop_n, prop_mb)
+    return (attr_n, attr_mb), (prop_n, prop_mb), get_lock_cache_stats()
 
 
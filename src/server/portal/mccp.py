@@ -11,23 +11,105 @@ as normal.  Note: On modern hardware you are not likely to notice the
 effect of MCCP unless you have extremely heavy traffic or sits on a
 terribly slow connection.
 
-This protocol is implemented by the telnet protocol importing
-mccp_compress and calling it from its write methods.
+This protocol is implemented by the telnet protocol sending all its
+output through the write method of its Mccp instance.
+
+All writes to a client during one reactor iteration are collected and
+compressed together (MCCP_COALESCE_WRITES), which gives much better
+compression of short lines than flushing the zlib stream after each
+of them. The compression level is set by MCCP_COMPRESSION_LEVEL. If
+MCCP_CPU_THRESHOLD is set and the Portal is busier than that, the
+compression streams are restarted with MCCP_LOW_COMPRESSION_LEVEL
+until the load goes down again.
+
+mccp_stats() returns the number of bytes compressed and sent.
 """
+import os
+import time
 import zlib
+from twisted.internet import reactor
+from django.conf import settings
 
 # negotiations for v1 and v2 of the protocol
 MCCP = chr(86)
 FLUSH = zlib.Z_SYNC_FLUSH
+FINISH = zlib.Z_FINISH
+
+_COMPRESSION_LEVEL = settings.MCCP_COMPRESSION_LEVEL
+_LOW_COMPRESSION_LEVEL = settings.MCCP_LOW_COMPRESSION_LEVEL
+_CPU_THRESHOLD = settings.MCCP_CPU_THRESHOLD
+_COALESCE_WRITES = settings.MCCP_COALESCE_WRITES
+
+# how often (in seconds) to re-measure the cpu use of the Portal
+_CPU_INTERVAL = 10
+# last cpu measure; [timestamp, cpu time used, load in percent]
+_CPU_LOAD = [time.time(), sum(os.times()[:2]), 0.0]
+
+# total bytes given to (in) and sent from (out) the compressors
+_BYTES = [0, 0]
+
+
+def portal_cpu_load():
+    """
+    Returns the percentage of one cpu used by the Portal process,
+    averaged since the last measure. A new measure is made at most
+    every _CPU_INTERVAL seconds.
+    """
+    now = time.time()
+    if now - _CPU_LOAD[0] >= _CPU_INTERVAL:
+        cputime = sum(os.times()[:2])
+        _CPU_LOAD[2] = 100.0 * (cputime - _CPU_LOAD[1]) / (now - _CPU_LOAD[0])
+        _CPU_LOAD[0], _CPU_LOAD[1] = now, cputime
+    return _CPU_LOAD[2]
+
+
+def compression_level():
+    "Returns the compression level to use for compression streams"
+    if _CPU_THRESHOLD and portal_cpu_load() > _CPU_THRESHOLD:
+        return _LOW_COMPRESSION_LEVEL
+    return _COMPRESSION_LEVEL
 
 
 def mccp_compress(protocol, data):
     "Handles zlib compression, if applicable"
     if hasattr(protocol, 'zlib'):
-        return protocol.zlib.compress(data) + protocol.zlib.flush(FLUSH)
+        compressed = protocol.zlib.compress(data) + protocol.zlib.flush(FLUSH)
+        _BYTES[0] += len(data)
+        _BYTES[1] += len(compressed)
+        mccp = getattr(protocol, "mccp", None)
+        if mccp:
+            mccp.bytes_in += len(data)
+            mccp.bytes_out += len(compressed)
+        return compressed
     return data
 
 
+def mccp_stats():
+    """
+    Returns a dict with the MCCP statistics of the Portal, for
+    measuring how much bandwidth the compression saves. This is
+    usually called from the Server, over AMP.
+
+        bytes_in - total bytes given to the compressors
+        bytes_out - total compressed bytes sent
+        cpu_load - the current cpu load of the Portal, in percent
+        level - the compression level currently used for new streams
+        sessions - list of (sessid, bytes_in, bytes_out, level) for
+                   every session using MCCP
+    """
+    from src.server.portal.portalsessionhandler import PORTAL_SESSIONS
+    sessions = []
+    for sessid, session in PORTAL_SESSIONS.sessions.items():
+        mccp = getattr(session, "mccp", None)
+        if mccp and hasattr(session, "zlib"):
+            sessions.append((sessid, mccp.bytes_in, mccp.bytes_out, mccp.level))
+    return {"bytes_in": _BYTES[0],
+            "bytes_out": _BYTES[1],
+            "cpu_load": portal_cpu_load(),
+            "level": compression_level(),
+            "sessions": sessions}
+
+
 class Mccp(object):
     """
     Implements the MCCP protocol. Add this to a
@@ -44,6 +126,13 @@ class Mccp(object):
 
         self.protocol = protocol
         self.protocol.protocol_flags['MCCP'] = False
+        self.level = None
+        self.buffer = []
+        self.flush_call = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # the protocol writes through us, also during the negotiation
+        self.protocol.mccp = self
         # ask if client will mccp, connect callbacks to handle answer
         self.protocol.will(MCCP).addCallbacks(self.do_mccp, self.no_mccp)
 
@@ -52,6 +141,9 @@ class Mccp(object):
         Called if client doesn't support mccp or chooses to turn it off
         """
         if hasattr(self.protocol, 'zlib'):
+            # send what is queued and end the compressed stream
+            self.flush()
+            self.protocol.transport.write(self.protocol.zlib.flush(FINISH))
             del self.protocol.zlib
         self.protocol.protocol_flags['MCCP'] = False
 
@@ -62,4 +154,41 @@ class Mccp(object):
         """
         self.protocol.protocol_flags['MCCP'] = True
         self.protocol.requestNegotiation(MCCP, '')
-        self.protocol.zlib = zlib.compressobj(9)
+        self.level = compression_level()
+        self.protocol.zlib = zlib.compressobj(self.level)
+
+    def write(self, data):
+        """
+        Write data to the client, compressing it if MCCP is active.
+        Compressed data is queued and compressed together with all
+        other writes made during this reactor iteration.
+        """
+        protocol = self.protocol
+        if not hasattr(protocol, 'zlib'):
+            protocol.transport.write(data)
+        elif not _COALESCE_WRITES:
+            protocol.transport.write(mccp_compress(protocol, data))
+        else:
+            self.buffer.append(data)
+            if not self.flush_call:
+                self.flush_call = reactor.callLater(0, self.flush)
+
+    def flush(self):
+        """
+        Compress and send all queued data. This is called
+        automatically, but must also be called before the
+        connection is closed.
+        """
+        if self.flush_call and self.flush_call.active():
+            self.flush_call.cancel()
+        self.flush_call = None
+        buf, self.buffer = self.buffer, []
+        protocol = self.protocol
+        if buf and hasattr(protocol, 'zlib'):
+            protocol.transport.write(mccp_compress(protocol, "".join(buf)))
+            if _CPU_THRESHOLD and compression_level() != self.level:
+                # restart the stream with the new level. MCCP v2 allows
+                # ending a stream and negotiating a new one at any time.
+                protocol.transport.write(protocol.zlib.flush(FINISH))
+                del protocol.zlib
+                self.do_mccp(MCCP)
@@ -26,6 +26,8 @@ class PortalSessionHandler(SessionHandler):
         """
         self.portal = None
         self.sessions = {}
+        # webclient sessions by suid, see session_from_suid
+        self.suids = {}
         self.latest_sessid = 0
         self.uptime = time.time()
         self.connection_time = 0
@@ -48,6 +50,7 @@ class PortalSessionHandler(SessionHandler):
         session.sessid = sessid
         sessdata = session.get_sync_data()
         self.sessions[sessid] = session
+        self.index_suid(session)
         # sync with server-side
         if self.portal.amp_protocol:  # this is a timing issue
             self.portal.amp_protocol.call_remote_ServerAdmin(sessid,
@@ -62,6 +65,7 @@ class PortalSessionHandler(SessionHandler):
         sessid = session.sessid
         if sessid in self.sessions:
             del self.sessions[sessid]
+        self.unindex_suid(session)
         del session
         # tell server to also delete this session
         self.portal.amp_protocol.call_remote_ServerAdmin(sessid,
@@ -77,6 +81,7 @@ class PortalSessionHandler(SessionHandler):
             if sessid in self.sessions:
                 # in case sess.disconnect doesn't delete it
                 del self.sessions[sessid]
+            self.unindex_suid(session)
             del session
 
     def server_disconnect_all(self, reason=""):
@@ -87,6 +92,7 @@ class PortalSessionHandler(SessionHandler):
             session.disconnect(reason)
             del session
         self.sessions = {}
+        self.suids = {}
 
     def server_logged_in(self, sessid, data):
         """
@@ -94,7 +100,9 @@ class PortalSessionHandler(SessionHandler):
         authenticated. Updated it.
         """
         sess = self.get_session(sessid)
+        self.unindex_suid(sess)
         sess.load_sync_data(data)
+        self.index_suid(sess)
 
     def server_session_sync(self, serversessions):
         """
@@ -111,6 +119,8 @@ class PortalSessionHandler(SessionHandler):
         # save protocols
         for sessid in to_save:
             self.sessions[sessid].load_sync_data(serversessions[sessid])
+        self.suids = dict((sess.suid, sess) for sess in self.sessions.values()
+                          if getattr(sess, "suid", None))
         # disconnect out-of-sync missing protocols
         for sessid in to_delete:
             self.server_disconnect(sessid)
@@ -124,10 +134,27 @@ class PortalSessionHandler(SessionHandler):
     def session_from_suid(self, suid):
         """
         Given a session id, retrieve the session (this is primarily
-        intended to be called by web clients)
+        intended to be called by web clients). Returns a list with
+        the session, or an empty list.
         """
-        return [sess for sess in self.get_sessions(include_unloggedin=True)
-                if hasattr(sess, 'suid') and sess.suid == suid]
+        sess = self.suids.get(suid)
+        return [sess] if sess else []
+
+    def index_suid(self, session):
+        """
+        Add a session to the suid lookup index, if it has a suid.
+        """
+        suid = getattr(session, "suid", None)
+        if suid:
+            self.suids[suid] = session
+
+    def unindex_suid(self, session):
+        """
+        Remove a session from the suid lookup index.
+        """
+        suid = getattr(session, "suid", None)
+        if suid and self.suids.get(suid) is session:
+            del self.suids[suid]
 
     def data_in(self, session, text="", **kwargs):
         """
@@ -155,4 +182,16 @@ class PortalSessionHandler(SessionHandler):
         if session:
             session.data_out(text=text, **kwargs)
 
+    def data_out_multi(self, sessids, text=None, **kwargs):
+        """
+        Called by server for having the portal relay the same message
+        to many sessions. Each protocol converts the text for its own
+        client, but the conversions (ANSI, HTML) cache their results, so
+        sessions with the same client settings share one rendering.
+        """
+        for sessid in sessids:
+            session = self.sessions.get(sessid, None)
+            if session:
+                session.data_out(text=text, **kwargs)
+
 PORTAL_SESSIONS = PortalSessionHandler()
@@ -11,7 +11,7 @@ import re
 from twisted.conch.telnet import Telnet, StatefulTelnetProtocol, IAC, LINEMODE
 from src.server.session import Session
 from src.server.portal import ttype, mssp, msdp
-from src.server.portal.mccp import Mccp, mccp_compress, MCCP
+from src.server.portal.mccp import Mccp, MCCP
 from src.utils import utils, ansi, logger
 
 _RE_N = re.compile(r"\{n$")
@@ -89,6 +89,8 @@ class TelnetProtocol(Telnet, StatefulTelnetProtocol, Session):
         the disconnect method
         """
         self.sessionhandler.disconnect(self)
+        # send anything still queued for compression
+        self.mccp.flush()
         self.transport.loseConnection()
 
     def dataReceived(self, data):
@@ -129,7 +131,7 @@ class TelnetProtocol(Telnet, StatefulTelnetProtocol, Session):
         # print "_write (%s): %s" % (self.state,  " ".join(str(ord(c)) for c in data))
         data = data.replace('\n', '\r\n').replace('\r\r\n', '\r\n')
         #data = data.replace('\n', '\r\n')
-        super(TelnetProtocol, self)._write(mccp_compress(self, data))
+        self.mccp.write(data)
 
     def sendLine(self, line):
         "hook overloading the one used by linereceiver"
@@ -137,7 +139,7 @@ class TelnetProtocol(Telnet, StatefulTelnetProtocol, Session):
         #escape IAC in line mode, and correctly add \r\n
         line += self.delimiter
         line = line.replace(IAC, IAC + IAC).replace('\n', '\r\n')
-        return self.transport.write(mccp_compress(self, line))
+        return self.mccp.write(line)
 
     def lineReceived(self, string):
         """
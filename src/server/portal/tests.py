@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+"""
+Unit testing of the 'portal' Evennia component.
+
+Runs as part of the Evennia's test suite with 'manage.py test"
+
+This tests the WebSocket protocol of the webclient: the handshake and
+the reading, writing and re-assembling of frames. The transport and
+the sessionhandler are replaced, so no reactor is needed.
+"""
+
+import struct
+
+try:
+    from django.utils.unittest import TestCase
+except ImportError:
+    from django.test import TestCase
+
+from src.server.portal import websocket
+from src.server.portal.websocket import (WebSocketProtocol, make_frame, unmask,
+                                         CONT, TEXT, BINARY, CLOSE, PING, PONG,
+                                         CLOSE_NORMAL, CLOSE_PROTOCOL_ERROR,
+                                         CLOSE_TOO_BIG)
+
+# the example handshake of RFC 6455
+_KEY = "dGhlIHNhbXBsZSBub25jZQ=="
+_ACCEPT = "s3pPLMBiTxaQ9kYGzzhZRbK+xOo="
+_REQUEST = ("GET /chat HTTP/1.1\r\n"
+            "Host: server.example.com\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            "Sec-WebSocket-Key: %s\r\n"
+            "Sec-WebSocket-Version: 13\r\n\r\n" % _KEY)
+
+
+def client_frame(opcode, payload, fin=True, mask="\x37\xfa\x21\x3d"):
+    "Build a masked (client->server) frame"
+    length = len(payload)
+    byte0 = (0x80 if fin else 0) | opcode
+    if length < 126:
+        header = struct.pack("!BB", byte0, 0x80 | length)
+    elif length < 65536:
+        header = struct.pack("!BBH", byte0, 0x80 | 126, length)
+    else:
+        header = struct.pack("!BBQ", byte0, 0x80 | 127, length)
+    # masking is its own inverse
+    return header + mask + unmask(mask, payload)
+
+
+class _Transport(object):
+    "Collects what the protocol writes"
+    client = ("127.0.0.1", 4000)
+
+    def __init__(self):
+        self.written = []
+        self.lost = False
+
+    def write(self, data):
+        self.written.append(data)
+
+    def loseConnection(self):
+        self.lost = True
+
+
+class _SessionHandler(object):
+    "Collects the connected sessions and the data they send in"
+    def __init__(self):
+        self.sessions = {}
+        self.connected = []
+        self.data = []
+
+    def connect(self, session):
+        self.connected.append(session)
+
+    def data_in(self, session, text=None, **kwargs):
+        self.data.append((text, kwargs.get("data")))
+
+
+class _Factory(object):
+    def __init__(self):
+        self.sessionhandler = _SessionHandler()
+
+
+class TestFrames(TestCase):
+    "Building and unmasking frames"
+    def test_make_frame(self):
+        self.assertEqual("\x81\x05hello", make_frame(TEXT, "hello"))
+        self.assertEqual("\x8a\x00", make_frame(PONG, ""))
+        payload = "a" * 126
+        self.assertEqual("\x81\x7e\x00\x7e" + payload, make_frame(TEXT, payload))
+        payload = "a" * 65535
+        self.assertEqual("\x82\x7e\xff\xff" + payload, make_frame(BINARY, payload))
+        payload = "a" * 65536
+        self.assertEqual("\x81\x7f" + struct.pack("!Q", 65536) + payload,
+                         make_frame(TEXT, payload))
+
+    def test_unmask(self):
+        # the masked "Hello" of RFC 6455
+        self.assertEqual("Hello", unmask("\x37\xfa\x21\x3d", "\x7f\x9f\x4d\x51\x58"))
+        self.assertEqual("", unmask("\x37\xfa\x21\x3d", ""))
+
+
+class TestWebSocketProtocol(TestCase):
+    "The handshake and the handling of frames from the client"
+    def setUp(self):
+        "sets up the testing environment"
+        self.old_max_size = websocket.MAX_MESSAGE_SIZE
+        self.proto = WebSocketProtocol()
+        self.proto.factory = _Factory()
+        self.proto.transport = self.transport = _Transport()
+        self.proto.connectionMade()
+        self.handler = self.proto.factory.sessionhandler
+
+    def tearDown(self):
+        websocket.MAX_MESSAGE_SIZE = self.old_max_size
+
+    def connect(self):
+        "do the handshake and forget what was written"
+        self.proto.dataReceived(_REQUEST)
+        del self.transport.written[:]
+
+    def closed_with(self, status):
+        "check that the protocol sent a close frame with status and hung up"
+        self.assertTrue(self.proto.closed)
+        self.assertTrue(self.transport.lost)
+        self.assertEqual(make_frame(CLOSE, struct.pack("!H", status)),
+                         self.transport.written[-1])
+
+    def test_handshake(self):
+        self.proto.dataReceived(_REQUEST)
+        self.assertTrue(self.proto.handshake_done)
+        self.assertEqual([self.proto], self.handler.connected)
+        self.assertEqual(["HTTP/1.1 101 Switching Protocols\r\n"
+                          "Upgrade: websocket\r\n"
+                          "Connection: Upgrade\r\n"
+                          "Sec-WebSocket-Accept: %s\r\n\r\n" % _ACCEPT],
+                         self.transport.written)
+        self.assertFalse(self.transport.lost)
+
+    def test_handshake_split(self):
+        # the request arrives in pieces, followed by a frame
+        data = _REQUEST + client_frame(TEXT, "look")
+        self.proto.dataReceived(data[:20])
+        self.assertFalse(self.proto.handshake_done)
+        self.assertEqual([], self.transport.written)
+        self.proto.dataReceived(data[20:])
+        self.assertTrue(self.proto.handshake_done)
+        self.assertEqual([("look", None)], self.handler.data)
+
+    def test_handshake_bad(self):
+        self.proto.dataReceived("GET / HTTP/1.1\r\nHost: server.example.com\r\n\r\n")
+        self.assertFalse(self.proto.handshake_done)
+        self.assertEqual(["HTTP/1.1 400 Bad Request\r\n\r\n"], self.transport.written)
+        self.assertTrue(self.transport.lost)
+        self.assertEqual([], self.handler.connected)
+
+    def test_handshake_too_big(self):
+        self.proto.dataReceived("GET / HTTP/1.1\r\n" + "X" * websocket.MAX_HANDSHAKE_SIZE)
+        self.assertTrue(self.proto.closed)
+        self.assertTrue(self.transport.lost)
+        self.assertEqual([], self.handler.connected)
+
+    def test_read_frame(self):
+        self.proto.buffer = client_frame(TEXT, "hello") + client_frame(BINARY, "x", fin=False)
+        self.assertEqual((0x80, TEXT, "hello"), self.proto.read_frame())
+        self.assertEqual((0, BINARY, "x"), self.proto.read_frame())
+        self.assertEqual("", self.proto.buffer)
+        # frames from the client must be masked, but unmasked ones are read too
+        self.proto.buffer = make_frame(TEXT, "hello")
+        self.assertEqual((0x80, TEXT, "hello"), self.proto.read_frame())
+
+    def test_read_frame_extended_length(self):
+        for length in (125, 126, 65535, 65536):
+            payload = "".join(chr(i % 256) for i in xrange(length))
+            frame = client_frame(BINARY, payload)
+            self.proto.buffer = frame
+            self.assertEqual((0x80, BINARY, payload), self.proto.read_frame())
+            self.assertEqual("", self.proto.buffer)
+        # the header size tells which length was used
+        self.assertEqual(2 + 4 + 125, len(client_frame(TEXT, "a" * 125)))
+        self.assertEqual(4 + 4 + 126, len(client_frame(TEXT, "a" * 126)))
+        self.assertEqual(10 + 4 + 65536, len(client_frame(TEXT, "a" * 65536)))
+
+    def test_read_frame_partial(self):
+        for payload in ("hello", "a" * 300, "a" * 65536):
+            frame = client_frame(TEXT, payload)
+            # cut inside the header, the extended length, the mask and the payload
+            for cut in (1, 3, 9, 12, len(frame) - 1):
+                if cut >= len(frame):
+                    continue
+                self.proto.buffer = frame[:cut]
+                self.assertEqual(None, self.proto.read_frame())
+                self.assertEqual(frame[:cut], self.proto.buffer)
+            self.proto.buffer = frame
+            self.assertEqual((0x80, TEXT, payload), self.proto.read_frame())
+        self.assertFalse(self.proto.closed)
+
+    def test_read_frame_too_big(self):
+        websocket.MAX_MESSAGE_SIZE = 100
+        # refused on the length alone, before the payload arrived
+        self.proto.buffer = client_frame(TEXT, "a" * 101)[:10]
+        self.assertEqual(None, self.proto.read_frame())
+        self.closed_with(CLOSE_TOO_BIG)
+
+    def test_partial_frames(self):
+        self.connect()
+        data = client_frame(TEXT, "hello") + client_frame(TEXT, "a" * 200)
+        for i in xrange(len(data)):
+            self.proto.dataReceived(data[i])
+        self.assertEqual([("hello", None), ("a" * 200, None)], self.handler.data)
+
+    def test_json(self):
+        self.connect()
+        self.proto.dataReceived(client_frame(TEXT, '{"msg": "look", "data": {"a": 1}}'))
+        self.proto.dataReceived(client_frame(TEXT, '{not json'))
+        # binary frames are never json
+        self.proto.dataReceived(client_frame(BINARY, '{"msg": "look"}'))
+        self.assertEqual([("look", {"a": 1}), ("{not json", None),
+                          ('{"msg": "look"}', None)], self.handler.data)
+
+    def test_fragments(self):
+        self.connect()
+        self.proto.dataReceived(client_frame(TEXT, "hel", fin=False))
+        self.proto.dataReceived(client_frame(CONT, "lo ", fin=False))
+        # control frames may come between the fragments
+        self.proto.dataReceived(client_frame(PING, "ping"))
+        self.assertEqual([make_frame(PONG, "ping")], self.transport.written)
+        self.assertEqual([], self.handler.data)
+        self.proto.dataReceived(client_frame(CONT, "world"))
+        self.assertEqual([("hello world", None)], self.handler.data)
+        self.assertEqual([], self.proto.fragments)
+        self.assertEqual(None, self.proto.fragment_opcode)
+        # the opcode of the first fragment is the one of the message
+        self.proto.dataReceived(client_frame(BINARY, '{"msg"', fin=False))
+        self.proto.dataReceived(client_frame(CONT, ': "x"}'))
+        self.assertEqual(('{"msg": "x"}', None), self.handler.data[-1])
+        self.assertFalse(self.proto.closed)
+
+    def test_fragments_too_big(self):
+        websocket.MAX_MESSAGE_SIZE = 100
+        self.connect()
+        self.proto.dataReceived(client_frame(TEXT, "a" * 60, fin=False))
+        self.proto.dataReceived(client_frame(CONT, "a" * 60))
+        self.assertEqual([], self.handler.data)
+        self.closed_with(CLOSE_TOO_BIG)
+
+    def test_continuation_without_start(self):
+        self.connect()
+        self.proto.dataReceived(client_frame(CONT, "hello"))
+        self.assertEqual([], self.handler.data)
+        self.closed_with(CLOSE_PROTOCOL_ERROR)
+
+    def test_unknown_opcode(self):
+        self.connect()
+        self.proto.dataReceived(client_frame(0x3, "hello"))
+        self.closed_with(CLOSE_PROTOCOL_ERROR)
+
+    def test_close(self):
+        self.connect()
+        self.proto.dataReceived(client_frame(CLOSE, struct.pack("!H", CLOSE_NORMAL)) +
+                                client_frame(TEXT, "hello"))
+        self.closed_with(CLOSE_NORMAL)
+        self.assertEqual(1, len(self.transport.written))
+        # nothing is read after the close
+        self.assertEqual([], self.handler.data)
+        self.proto.dataReceived(client_frame(TEXT, "hello"))
+        self.assertEqual([], self.handler.data)
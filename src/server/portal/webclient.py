@@ -20,6 +20,8 @@ import time
 from hashlib import md5
 
 from twisted.web import server, resource
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
 
 from django.utils import simplejson
 from django.utils.functional import Promise
@@ -31,6 +33,9 @@ from src.server import session
 
 SERVERNAME = settings.SERVERNAME
 ENCODINGS = settings.ENCODINGS
+IDLE_TIMEOUT = settings.WEBCLIENT_IDLE_TIMEOUT
+# how often (in seconds) to look for abandoned clients
+SWEEP_INTERVAL = 60
 
 
 # defining a simple json encoder for returning
@@ -64,6 +69,12 @@ class WebClient(resource.Resource):
     def __init__(self):
         self.requests = {}
         self.databuffer = {}
+        self.flush_calls = {}
+        # time of the last request from each client
+        self.last_active = {}
+        if IDLE_TIMEOUT:
+            self.sweeper = LoopingCall(self.sweep)
+            self.sweeper.start(SWEEP_INTERVAL, now=False)
 
     #def getChild(self, path, request):
     #    """
@@ -81,29 +92,58 @@ class WebClient(resource.Resource):
     def lineSend(self, suid, string, data=None):
         """
         This adds the data to the buffer and/or sends it to
-        the client as soon as possible.
+        the client as soon as possible. All data sent during
+        one reactor iteration is returned to the client in
+        the same response.
         """
+        self.databuffer.setdefault(suid, []).append({'msg': string, 'data': data})
+        if suid in self.requests and suid not in self.flush_calls:
+            # we have a request waiting. Return at the end of this iteration.
+            self.flush_calls[suid] = reactor.callLater(0, self.flush, suid)
+
+    def flush(self, suid):
+        """
+        Return all buffered data to the waiting request, if any.
+        """
+        self.flush_calls.pop(suid, None)
         request = self.requests.get(suid)
-        if request:
-            # we have a request waiting. Return immediately.
-            request.write(jsonify({'msg': string, 'data': data}))
+        dataentries = self.databuffer.get(suid)
+        if request and dataentries:
+            self.databuffer[suid] = []
+            request.write(jsonify(dataentries))
             request.finish()
             del self.requests[suid]
-        else:
-            # no waiting request. Store data in buffer
-            dataentries = self.databuffer.get(suid, [])
-            dataentries.append(jsonify({'msg': string, 'data': data}))
-            self.databuffer[suid] = dataentries
 
     def client_disconnect(self, suid):
         """
         Disconnect session with given suid.
         """
+        if suid in self.flush_calls:
+            # send what is waiting (like the disconnect reason) first
+            self.flush_calls.pop(suid).cancel()
+            self.flush(suid)
         if suid in self.requests:
             self.requests[suid].finish()
             del self.requests[suid]
         if suid in self.databuffer:
             del self.databuffer[suid]
+        self.last_active.pop(suid, None)
+
+    def sweep(self):
+        """
+        Disconnect clients that have not made a request for
+        IDLE_TIMEOUT seconds. Browsers that are closed or crash
+        don't always tell us they are leaving. A client with a
+        request waiting for data is not idle.
+        """
+        expired = time.time() - IDLE_TIMEOUT
+        for suid in set(self.databuffer).union(self.last_active):
+            if suid in self.requests or self.last_active.get(suid, 0) > expired:
+                continue
+            sess = self.sessionhandler.session_from_suid(suid)
+            if sess:
+                sess[0].sessionhandler.disconnect(sess[0])
+            self.client_disconnect(suid)
 
     def mode_init(self, request):
         """
@@ -121,6 +161,7 @@ class WebClient(resource.Resource):
             # creating a unique id hash string
             suid = md5(str(time.time())).hexdigest()
             self.databuffer[suid] = []
+            self.last_active[suid] = time.time()
 
             sess = WebClientSession()
             sess.client = self
@@ -151,15 +192,17 @@ class WebClient(resource.Resource):
         that it is ready to receive data as soon as it is
         available. This is the basis of a long-polling (comet)
         mechanism: the server will wait to reply until data is
-        available.
+        available. All buffered data is returned at once, as a
+        list of {'msg':..., 'data':...} entries.
         """
         suid = request.args.get('suid', ['0'])[0]
         if suid == '0':
             return ''
 
-        dataentries = self.databuffer.get(suid, [])
+        dataentries = self.databuffer.get(suid)
         if dataentries:
-            return dataentries.pop(0)
+            self.databuffer[suid] = []
+            return jsonify(dataentries)
         request.notifyFinish().addErrback(self._responseFailed, suid, request)
         if suid in self.requests:
             self.requests[suid].finish()  # Clear any stale request.
@@ -179,8 +222,8 @@ class WebClient(resource.Resource):
                 sess = self.sessionhandler.session_from_suid(suid)[0]
                 sess.sessionhandler.disconnect(sess)
             except IndexError:
-                self.client_disconnect(suid)
                 pass
+            self.client_disconnect(suid)
         return ''
 
     def render_POST(self, request):
@@ -193,6 +236,9 @@ class WebClient(resource.Resource):
         there is actual data available.
         """
         dmode = request.args.get('mode', [None])[0]
+        suid = request.args.get('suid', ['0'])[0]
+        if suid != '0':
+            self.last_active[suid] = time.time()
         if dmode == 'init':
             # startup. Setup the server.
             return self.mode_init(request)
@@ -0,0 +1,272 @@
+"""
+WebSocket protocol for the webclient.
+
+This implements a WebSocket (RFC 6455) server for the Evennia
+webclient. Compared to the ajax long-polling of the WebClient
+resource, a WebSocket is a single, persistent connection over which
+both the client and the server may send data at any time, so no http
+requests are needed for sending input or waiting for output.
+
+The protocol is started by the Portal if WEBSOCKET_ENABLED is set, on
+WEBSOCKET_PORTS. The webclient javascript uses it if the browser
+supports WebSockets, otherwise it falls back to long-polling.
+
+Data is sent in text frames as json objects, the same as returned by
+the WebClient resource: {'msg': text, 'data': data}. The client sends
+its input the same way, or as plain text in a text or binary frame.
+"""
+import struct
+from base64 import b64encode
+from hashlib import sha1
+
+from twisted.internet.protocol import Protocol
+from django.utils import simplejson
+from src.server.session import Session
+from src.server.portal.webclient import jsonify
+from src.utils import utils, logger
+from src.utils.text2html import parse_html
+
+# the key the server must append to the client's handshake key
+_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# frame opcodes
+CONT, TEXT, BINARY, CLOSE, PING, PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+
+# close status codes
+CLOSE_NORMAL, CLOSE_PROTOCOL_ERROR, CLOSE_TOO_BIG = 1000, 1002, 1009
+
+# max size of a message (after re-assembling fragments) from the client
+MAX_MESSAGE_SIZE = 65536
+# max size of the http handshake
+MAX_HANDSHAKE_SIZE = 8192
+
+
+def make_frame(opcode, payload):
+    "Build an unmasked (server->client), unfragmented frame"
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def unmask(mask, payload):
+    "Unmask the payload of a client frame"
+    data = bytearray(payload)
+    mask = bytearray(mask)
+    for i in xrange(len(data)):
+        data[i] ^= mask[i % 4]
+    return str(data)
+
+
+class WebSocketProtocol(Protocol, Session):
+    """
+    Each webclient connecting over a WebSocket gets an instance of
+    this protocol, handling the handshake and the framing of data.
+    """
+
+    def connectionMade(self):
+        """
+        This is called when the connection is first established.
+        The session is connected once the handshake is done.
+        """
+        self.handshake_done = False
+        self.closed = False
+        self.buffer = ""
+        self.fragments = []
+        self.fragment_opcode = None
+        client_address = self.transport.client
+        self.init_session("websocket", client_address, self.factory.sessionhandler)
+
+    def dataReceived(self, data):
+        """
+        Collect incoming data, handle the handshake and decode
+        all complete frames.
+        """
+        if self.closed:
+            return
+        self.buffer += data
+        if not self.handshake_done:
+            if "\r\n\r\n" not in self.buffer:
+                if len(self.buffer) > MAX_HANDSHAKE_SIZE:
+                    self.closed = True
+                    self.transport.loseConnection()
+                return
+            request, self.buffer = self.buffer.split("\r\n\r\n", 1)
+            if not self.handshake(request):
+                return
+        while self.buffer and not self.closed:
+            frame = self.read_frame()
+            if not frame:
+                # not a complete frame yet
+                return
+            self.handle_frame(*frame)
+
+    def handshake(self, request):
+        """
+        Answer the client's http upgrade request. Returns False
+        (and closes the connection) if it's not a valid request.
+        """
+        lines = request.split("\r\n")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+        key = headers.get("sec-websocket-key")
+        if not (lines[0].startswith("GET ") and key and
+                headers.get("upgrade", "").lower() == "websocket"):
+            self.closed = True
+            self.transport.write("HTTP/1.1 400 Bad Request\r\n\r\n")
+            self.transport.loseConnection()
+            return False
+        accept = b64encode(sha1(key + _GUID).digest())
+        self.transport.write("HTTP/1.1 101 Switching Protocols\r\n"
+                             "Upgrade: websocket\r\n"
+                             "Connection: Upgrade\r\n"
+                             "Sec-WebSocket-Accept: %s\r\n\r\n" % accept)
+        self.handshake_done = True
+        self.sessionhandler.connect(self)
+        return True
+
+    def read_frame(self):
+        """
+        Read one frame off the buffer. Returns (fin, opcode, payload)
+        or None if the buffer does not hold a complete frame.
+        """
+        buf = self.buffer
+        if len(buf) < 2:
+            return None
+        byte0, byte1 = struct.unpack("!BB", buf[:2])
+        length = byte1 & 0x7f
+        pos = 2
+        if length == 126:
+            if len(buf) < 4:
+                return None
+            length = struct.unpack("!H", buf[2:4])[0]
+            pos = 4
+        elif length == 127:
+            if len(buf) < 10:
+                return None
+            length = struct.unpack("!Q", buf[2:10])[0]
+            pos = 10
+        if length > MAX_MESSAGE_SIZE:
+            self.close(CLOSE_TOO_BIG)
+            return None
+        masked = byte1 & 0x80
+        end = pos + (4 if masked else 0) + length
+        if len(buf) < end:
+            return None
+        if masked:
+            payload = unmask(buf[pos:pos + 4], buf[pos + 4:end])
+        else:
+            payload = buf[pos:end]
+        self.buffer = buf[end:]
+        return byte0 & 0x80, byte0 & 0x0f, payload
+
+    def handle_frame(self, fin, opcode, payload):
+        """
+        Handle a frame from the client. Data frames may be split
+        into fragments, which are put together here.
+        """
+        if opcode == CLOSE:
+            self.close(CLOSE_NORMAL)
+        elif opcode == PING:
+            self.transport.write(make_frame(PONG, payload))
+        elif opcode == PONG:
+            pass
+        elif opcode in (TEXT, BINARY, CONT):
+            if opcode != CONT:
+                self.fragment_opcode = opcode
+                self.fragments = []
+            elif self.fragment_opcode is None:
+                self.close(CLOSE_PROTOCOL_ERROR)
+                return
+            self.fragments.append(payload)
+            if sum(len(part) for part in self.fragments) > MAX_MESSAGE_SIZE:
+                self.close(CLOSE_TOO_BIG)
+                return
+            if fin:
+                message = "".join(self.fragments)
+                opcode = self.fragment_opcode
+                self.fragments, self.fragment_opcode = [], None
+                self.message_received(opcode, message)
+        else:
+            self.close(CLOSE_PROTOCOL_ERROR)
+
+    def message_received(self, opcode, message):
+        """
+        A complete message arrived from the client. Text messages
+        are json, {'msg': text, 'data': data}, or plain text.
+        """
+        text, data = message, None
+        if opcode == TEXT and message.startswith("{"):
+            try:
+                message = simplejson.loads(message)
+                text, data = message.get("msg", ""), message.get("data", None)
+            except (ValueError, AttributeError):
+                pass
+        self.data_in(text=text, data=data)
+
+    def send_message(self, text, data=None):
+        "Send a message to the client as a json text frame"
+        self.transport.write(make_frame(TEXT, jsonify({'msg': text, 'data': data})))
+
+    def close(self, status=CLOSE_NORMAL):
+        "Send a close frame and drop the connection"
+        if self.closed:
+            return
+        self.closed = True
+        self.transport.write(make_frame(CLOSE, struct.pack("!H", status)))
+        self.transport.loseConnection()
+
+    def connectionLost(self, reason):
+        """
+        This is executed when the connection is lost for whatever
+        reason. It can also be called directly, from the disconnect
+        method.
+        """
+        if self.sessid in self.sessionhandler.sessions:
+            self.sessionhandler.disconnect(self)
+        self.transport.loseConnection()
+
+    # Session hooks
+
+    def disconnect(self, reason=None):
+        """
+        generic hook for the engine to call in order to
+        disconnect this protocol.
+        """
+        if reason:
+            self.data_out(reason)
+        self.close(CLOSE_NORMAL)
+        self.connectionLost(reason)
+
+    def data_in(self, text=None, **kwargs):
+        """
+        Data WebSocket -> Server
+        """
+        self.sessionhandler.data_in(self, text=text, **kwargs)
+
+    def data_out(self, text=None, **kwargs):
+        """
+        Data Evennia -> Player access hook.
+
+        webclient flags checked are
+        raw=True - no parsing at all (leave ansi-to-html markers unparsed)
+        nomarkup=True - clean out all ansi/html markers and tokens
+        """
+        # string handling is similar to the ajax webclient
+        try:
+            text = utils.to_str(text if text else "", encoding=self.encoding)
+            raw = kwargs.get("raw", False)
+            nomarkup = kwargs.get("nomarkup", False)
+            if raw:
+                self.send_message(text)
+            else:
+                self.send_message(parse_html(text, strip_ansi=nomarkup))
+        except Exception:
+            logger.log_trace()
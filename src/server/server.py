@@ -17,6 +17,7 @@ if os.name == 'nt':
 from twisted.web import server, static
 from twisted.application import internet, service
 from twisted.internet import reactor, defer
+from twisted.internet.task import LoopingCall
 import django
 from django.db import connection
 from django.conf import settings
@@ -27,6 +28,7 @@ from src.server.models import ServerConfig
 from src.server import initial_setup
 
 from src.utils.utils import get_evennia_version, mod_import, make_iter
+from src.utils.idmapper.base import conditional_flush
 from src.comms import channelhandler
 from src.server.sessionhandler import SESSIONS
 
@@ -118,6 +120,11 @@ class Evennia(object):
         # initialize channelhandler
         channelhandler.CHANNELHANDLER.update()
 
+        # keep the idmapper cache within its memory budget
+        if settings.IDMAPPER_CACHE_MAXRSS:
+            self.idmapper_flush_task = LoopingCall(conditional_flush)
+            self.idmapper_flush_task.start(settings.IDMAPPER_CACHE_FLUSH_INTERVAL, now=False)
+
         # set a callback if the server is killed abruptly,
         # by Ctrl-C, reboot etc.
         reactor.addSystemEventTrigger('before', 'shutdown',
@@ -336,6 +343,16 @@ class Evennia(object):
             if SERVER_STARTSTOP_MODULE:
                 SERVER_STARTSTOP_MODULE.at_server_cold_stop()
 
+        # save Attributes still waiting to be written
+        from src.typeclasses.models import flush_attributes
+        flush_attributes()
+        # store channel messages still waiting to be logged
+        from src.comms.models import flush_channel_log
+        flush_channel_log(wait=True)
+        # save repeat counts of scripts changed since the last tick
+        from src.scripts.ticker import SCRIPT_TICKER
+        SCRIPT_TICKER.save_dirty()
+
         # stopping time
         from src.utils import gametime
         gametime.save()
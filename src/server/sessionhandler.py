@@ -177,6 +177,8 @@ class ServerSessionHandler(SessionHandler):
         Init the handler.
         """
         self.sessions = {}
+        # {uid: {sessid: session}} of logged-in sessions, see index_session
+        self.player_sessions = {}
         self.server = None
         self.server_data = {"servername": SERVERNAME}
 
@@ -203,6 +205,7 @@ class ServerSessionHandler(SessionHandler):
         # validate all script
         _ScriptDB.objects.validate()
         self.sessions[sess.sessid] = sess
+        self.index_session(sess)
         sess.data_in(CMD_LOGINSTART)
 
     def portal_disconnect(self, sessid):
@@ -218,6 +221,7 @@ class ServerSessionHandler(SessionHandler):
             nsess = len(self.sessions_from_player(player))
             remaintext = nsess and "%i session%s remaining" % (nsess, nsess > 1 and "s" or "") or "no more sessions"
             session.log(_('Connection dropped: %s %s (%s)' % (session.player, session.address, remaintext)))
+        self.unindex_session(session)
         session.at_disconnect()
         session.disconnect()
         del self.sessions[session.sessid]
@@ -238,6 +242,7 @@ class ServerSessionHandler(SessionHandler):
             # we delete the old session to make sure to catch eventual
             # lingering references.
             del sess
+        self.player_sessions = {}
 
         for sessid, sessdict in portalsessions.items():
             sess = _ServerSession()
@@ -246,6 +251,7 @@ class ServerSessionHandler(SessionHandler):
             if sess.uid:
                 sess.player = _PlayerDB.objects.get_player_from_uid(sess.uid)
             self.sessions[sessid] = sess
+            self.index_session(sess)
             sess.at_sync()
 
         # after sync is complete we force-validate all scripts
@@ -283,6 +289,7 @@ class ServerSessionHandler(SessionHandler):
 
         # sets up and assigns all properties on the session
         session.at_login(player)
+        self.index_session(session)
 
         # player init
         player.at_init()
@@ -326,6 +333,7 @@ class ServerSessionHandler(SessionHandler):
             remaintext = nsess and "%i session%s remaining" % (nsess, nsess > 1 and "s" or "") or "no more sessions"
             session.log(_('Logged out: %s %s (%s)' % (session.player, session.address, remaintext)))
 
+        self.unindex_session(session)
         session.at_disconnect()
         sessid = session.sessid
         del self.sessions[sessid]
@@ -387,7 +395,7 @@ class ServerSessionHandler(SessionHandler):
         player may have more than one session depending on settings).
         Only logged-in players are counted here.
         """
-        return len(set(session.uid for session in self.sessions.values() if session.logged_in))
+        return len(self.player_sessions)
 
     def session_from_sessid(self, sessid):
         """
@@ -402,12 +410,47 @@ class ServerSessionHandler(SessionHandler):
         session = self.sessions.get(sessid)
         return session and session.logged_in and player.uid == session.uid and session or None
 
+    def index_session(self, session):
+        """
+        Add a logged-in session to the index of sessions per player.
+        This is called whenever a session logs in or is synced.
+        """
+        if session.logged_in and session.uid:
+            # keyed on sessid; sessions compare equal by address only
+            self.player_sessions.setdefault(session.uid, {})[session.sessid] = session
+
+    def unindex_session(self, session):
+        """
+        Remove a session from the index of sessions per player. This
+        is called before the session is logged out/disconnected.
+        """
+        sessions = self.player_sessions.get(session.uid)
+        if sessions and sessions.get(session.sessid) is session:
+            del sessions[session.sessid]
+            if not sessions:
+                del self.player_sessions[session.uid]
+
     def sessions_from_player(self, player):
         """
         Given a player, return all matching sessions.
         """
-        uid = player.uid
-        return [session for session in self.sessions.values() if session.logged_in and session.uid == uid]
+        sessions = self.player_sessions.get(player.uid)
+        return sessions.values() if sessions else []
+
+    def sessions_from_players(self, players):
+        """
+        Given many players, return all their sessions.
+        """
+        player_sessions = self.player_sessions
+        uids = set(player.uid for player in players)
+        return [session for uid in uids if uid in player_sessions
+                for session in player_sessions[uid].itervalues()]
+
+    def player_is_online(self, uid):
+        """
+        Check if the player with the given uid has any logged-in sessions.
+        """
+        return uid in self.player_sessions
 
     def sessions_from_character(self, character):
         """
@@ -433,6 +476,15 @@ class ServerSessionHandler(SessionHandler):
                                                               msg=text,
                                                               data=kwargs)
 
+    def data_out_multi(self, sessions, text="", **kwargs):
+        """
+        Sending the same data Server -> Portal to many sessions
+        (a broadcast). The data is only sent over AMP once.
+        """
+        self.server.amp_protocol.call_remote_MsgServer2PortalMulti([sess.sessid for sess in sessions],
+                                                                   msg=text,
+                                                                   data=kwargs)
+
     def data_in(self, sessid, text="", **kwargs):
         """
         Data Portal -> Server
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""
+Unit testing of the 'server' Evennia component.
+
+Runs as part of the Evennia's test suite with 'manage.py test"
+
+This tests the index of sessions per player kept by the
+ServerSessionHandler. This also runs the Portal tests defined in
+src/server/portal/tests.py.
+"""
+
+import sys
+try:
+    from django.utils.unittest import TestCase
+except ImportError:
+    from django.test import TestCase
+try:
+    from django.utils import unittest
+except ImportError:
+    import unittest
+
+from src.server.portal import tests as portaltests
+from src.server.serversession import ServerSession
+from src.server.sessionhandler import ServerSessionHandler
+
+
+class _Player(object):
+    "Stand-in for a Player; the index only needs the uid"
+    def __init__(self, uid):
+        self.uid = uid
+
+
+def _make_session(sessid, uid, address):
+    "Create a logged-in session without a protocol"
+    session = ServerSession()
+    session.sessid = sessid
+    session.uid = uid
+    session.address = address
+    session.logged_in = True
+    return session
+
+
+class TestPlayerSessionIndex(TestCase):
+    "Sessions of the same player connecting from the same address"
+    def setUp(self):
+        "sets up the testing environment"
+        self.handler = ServerSessionHandler()
+        self.player = _Player(1)
+        # e.g. two webclient sessions from the same IP; these
+        # compare equal, since ServerSession.__eq__ checks the address
+        self.sess1 = _make_session(1, 1, "127.0.0.1")
+        self.sess2 = _make_session(2, 1, "127.0.0.1")
+
+    def test_index_both(self):
+        self.handler.index_session(self.sess1)
+        self.handler.index_session(self.sess2)
+        sessions = self.handler.sessions_from_player(self.player)
+        self.assertEqual(2, len(sessions))
+        self.assertTrue(any(sess is self.sess1 for sess in sessions))
+        self.assertTrue(any(sess is self.sess2 for sess in sessions))
+        self.assertEqual(2, len(self.handler.sessions_from_players([self.player, self.player])))
+        self.assertEqual(1, self.handler.player_count())
+
+    def test_unindex_right_session(self):
+        self.handler.index_session(self.sess1)
+        self.handler.index_session(self.sess2)
+        self.handler.unindex_session(self.sess1)
+        sessions = self.handler.sessions_from_player(self.player)
+        self.assertEqual(1, len(sessions))
+        self.assertTrue(sessions[0] is self.sess2)
+        self.assertTrue(self.handler.player_is_online(1))
+        self.handler.unindex_session(self.sess2)
+        self.assertEqual([], self.handler.sessions_from_player(self.player))
+        self.assertFalse(self.handler.player_is_online(1))
+
+    def test_relogin_same_address(self):
+        # a re-login disconnects the old session after the new one logged in
+        self.handler.index_session(self.sess1)
+        self.handler.index_session(self.sess2)
+        self.handler.unindex_session(self.sess1)
+        self.handler.unindex_session(self.sess1)
+        sessions = self.handler.sessions_from_player(self.player)
+        self.assertEqual(1, len(sessions))
+        self.assertTrue(sessions[0] is self.sess2)
+
+
+def suite():
+    """
+    This function is called automatically by the django test runner.
+    This also runs the Portal tests defined in src/server/portal/tests.py.
+    """
+    tsuite = unittest.TestSuite()
+    tsuite.addTest(unittest.defaultTestLoader.loadTestsFromModule(sys.modules[__name__]))
+    tsuite.addTest(unittest.defaultTestLoader.loadTestsFromModule(portaltests))
+    return tsuite
@@ -35,6 +35,19 @@ TELNET_INTERFACES = ['0.0.0.0']
 # server-side (see OOB_FUNC_MODULE). TELNET_ENABLED is required for this
 # to work.
 TELNET_OOB_ENABLED = False
+# MCCP compresses the data sent to telnet clients supporting it. This
+# is the zlib compression level to use, from 1 (fastest) to 9 (best
+# compression). The higher levels cost much more cpu for only a few
+# percent smaller output.
+MCCP_COMPRESSION_LEVEL = 6
+# If the Portal process uses more than this percentage of a cpu,
+# compression is switched to MCCP_LOW_COMPRESSION_LEVEL until the
+# load goes down again. Set to 0 to always use MCCP_COMPRESSION_LEVEL.
+MCCP_CPU_THRESHOLD = 0
+MCCP_LOW_COMPRESSION_LEVEL = 1
+# Collect all data sent to a client during one reactor iteration and
+# compress it together. This compresses short lines much better.
+MCCP_COALESCE_WRITES = True
 # Start the evennia django+twisted webserver so you can
 # browse the evennia website and the admin interface
 # (Obs - further web configuration can be found below
@@ -62,6 +75,18 @@ WEBSERVER_THREADPOOL_LIMITS = (1, 20)
 # Start the evennia ajax client on /webclient
 # (the webserver must also be running)
 WEBCLIENT_ENABLED = True
+# Webclients that have not contacted the server for this many seconds
+# are disconnected (the client sends an idle message every 3 minutes
+# while the page is open). Set to 0 to never disconnect idle clients.
+WEBCLIENT_IDLE_TIMEOUT = 600
+# Activate the WebSocket protocol. The webclient will use it instead
+# of ajax long-polling if the browser supports WebSockets (a
+# persistent connection, much lighter on the Portal).
+WEBSOCKET_ENABLED = False
+# Ports to use for WebSockets
+WEBSOCKET_PORTS = [8001]
+# Interface addresses to listen to. If 0.0.0.0, listen to all. Use :: for IPv6.
+WEBSOCKET_INTERFACES = ['0.0.0.0']
 # Activate SSH protocol (SecureShell)
 SSH_ENABLED = False
 # Ports to use for SSH
@@ -120,6 +145,22 @@ ENCODINGS = ["utf-8", "latin-1", "ISO-8859-1"]
 AMP_HOST = 'localhost'
 AMP_PORT = 5000
 AMP_INTERFACE = '127.0.0.1'
+# Text messages between the portal and the server are collected during
+# each reactor iteration and sent over AMP as one batch, instead of
+# one AMP command per message. This gives much less overhead when
+# messages are sent to many sessions at once. Turn off to send every
+# message immediately on its own.
+AMP_BATCH_MESSAGES = True
+# How the extra data of messages between portal and server (such as
+# OOB instructions) is encoded for sending. "marshal" is fast but only
+# handles Python builtin types (pickle is used automatically for
+# anything else), "pickle" handles everything and "msgpack" is
+# available if the msgpack package is installed.
+AMP_CODEC = "marshal"
+# The ANSI colour markup parser remembers this many of the strings it
+# has translated (like room descriptions and prompts) so it does not
+# need to parse them again. 0 turns this off.
+ANSI_PARSE_CACHE_SIZE = 2000
 # Caching speeds up all forms of database access, often considerably. There
 # are (currently) only two settings, "local" or None, the latter of which turns
 # off all caching completely. Local caching stores data in the process. It's
@@ -132,6 +173,28 @@ GAME_CACHE_TYPE = "local"
 # cache and resets it if it's too big. This variable sets the maximum
 # size (in MB).
 ATTRIBUTE_CACHE_MAXSIZE = 100
+# The command handler caches the result of merging cmdsets together.
+# This sets how many merged cmdsets are kept around before the least
+# recently used ones are discarded.
+CMDSET_MERGE_CACHE_SIZE = 1000
+# Database entities (Objects, Players, Scripts etc) are kept in memory by
+# the idmapper cache once loaded. This sets the max number of entities
+# cached per database model before the least recently used ones are
+# evicted. 0 means no limit (never evict). The limit can be set
+# separately per model name, like {"ObjectDB": 10000}. Entities with
+# non-persistent (ndb) data, connected Players/Characters and active
+# Scripts are never evicted.
+IDMAPPER_CACHE_MAXSIZE = 0
+IDMAPPER_CACHE_MAXSIZE_PER_MODEL = {}
+# Memory budget for the server process (in MB, resident memory). If
+# set, the server checks its memory every IDMAPPER_CACHE_FLUSH_INTERVAL
+# seconds. When first above the limit, it evicts the least recently
+# used tenth of the idmapper cache, then keeps the cache from growing
+# beyond that size for as long as it stays above the limit (Python
+# rarely hands freed memory back, so it reuses it instead). 0 turns
+# this off. Only works on Linux.
+IDMAPPER_CACHE_MAXRSS = 0
+IDMAPPER_CACHE_FLUSH_INTERVAL = 60
 
 ######################################################################
 # Evennia Database config
@@ -204,6 +267,13 @@ MSSP_META_MODULE = ""
 # Tuple of modules implementing lock functions. All callable functions
 # inside these modules will be available as lock functions.
 LOCK_FUNC_MODULES = ("src.locks.lockfuncs",)
+# The same lock checks are often repeated many times while handling a
+# single command. If this is set to a time in seconds, lock check results
+# are cached for that long. The cache is cleared whenever locks,
+# permissions or tags change, but locks depending on other things (like
+# Attributes or location) may return stale results until it expires.
+# Set to 0 to turn off lock result caching.
+LOCK_RESULT_CACHE_TTL = 0
 # Module holding OOB (Out of Band) hook objects. This allows for customization
 # and expansion of which hooks OOB protocols are allowed to call on the server
 # protocols for attaching tracker hooks for when various object field change
@@ -278,6 +348,18 @@ CHARACTER_DEFAULT_HOME = "#2"
 # out of sync between the processes. Keep on unless you face such
 # issues.
 TYPECLASS_AGGRESSIVE_CACHE = True
+# Normally every change to an Attribute's value (including changes to
+# lists and dicts stored in it) is saved to the database immediately.
+# With write-behind on, changed Attributes are instead collected and
+# saved together in one transaction ATTRIBUTE_WRITE_BEHIND_INTERVAL
+# seconds later (0 means at the next reactor iteration). This greatly
+# reduces database writes for Attributes changing many times per
+# second. Pending changes are saved when the server shuts down or
+# reloads, but would be lost if the server crashed. Since changes are
+# not visible in the database until saved, don't use this if other
+# processes need to read Attributes.
+ATTRIBUTE_WRITE_BEHIND = False
+ATTRIBUTE_WRITE_BEHIND_INTERVAL = 0
 
 ######################################################################
 # Batch processors
@@ -356,6 +438,23 @@ CHANNEL_MUDINFO = ("MUDinfo", '', 'Informative messages',
 # Channel showing when new people connecting
 CHANNEL_CONNECTINFO = ("MUDconnections", '', 'Connection log',
                     "control:perm(Immortals);listen:perm(Wizards);send:false()")
+# The cmdset of the channels a player may send to is cached and shared
+# between players with the same permissions (as long as the channels'
+# send-locks only check permissions or dbrefs). This is how many such
+# cmdsets to keep cached. 0 turns off the caching.
+CHANNEL_CMDSET_CACHE_SIZE = 1000
+# Messages sent with persistent=True to channels keeping a log are
+# queued and stored by a background thread, many at a time, so busy
+# channels don't hold up the server. They are stored this many seconds
+# after being sent, or at once when CHANNEL_LOG_QUEUE_SIZE messages are
+# waiting. Messages sent while the thread is busy are queued for its
+# next batch, but no more than CHANNEL_LOG_MAX_QUEUE_SIZE of them; the
+# oldest are discarded beyond that (this only happens if the database
+# can't keep up or is failing). Queued messages are stored when the
+# server shuts down or reloads, but would be lost if the server crashed.
+CHANNEL_LOG_INTERVAL = 2
+CHANNEL_LOG_QUEUE_SIZE = 500
+CHANNEL_LOG_MAX_QUEUE_SIZE = 5000
 
 ######################################################################
 # External Channel connections
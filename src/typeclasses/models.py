@@ -34,7 +34,7 @@ import sys
 import traceback
 #from collections import defaultdict
 
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.utils.encoding import smart_str
 from django.contrib.contenttypes.models import ContentType
@@ -46,16 +46,20 @@ from src.server.caches import get_attr_cache, set_attr_cache
 #from src.server.caches import call_ndb_hooks
 from src.server.models import ServerConfig
 from src.typeclasses import managers
-from src.locks.lockhandler import LockHandler
+from src.locks.lockhandler import LockHandler, flush_lock_cache
 from src.utils import logger
 from src.utils.utils import make_iter, is_iter, to_str
-from src.utils.dbserialize import to_pickle, from_pickle
+from src.utils.dbserialize import to_pickle, from_pickle, is_cacheable
 from src.utils.picklefield import PickledObjectField
 
 __all__ = ("Attribute", "TypeNick", "TypedObject")
 
 _PERMISSION_HIERARCHY = [p.lower() for p in settings.PERMISSION_HIERARCHY]
 _TYPECLASS_AGGRESSIVE_CACHE = settings.TYPECLASS_AGGRESSIVE_CACHE
+_ATTRIBUTE_WRITE_BEHIND = settings.ATTRIBUTE_WRITE_BEHIND
+_ATTRIBUTE_WRITE_BEHIND_INTERVAL = settings.ATTRIBUTE_WRITE_BEHIND_INTERVAL
+# the number of entities to prefetch Attributes for with each query
+_PREFETCH_CHUNK_SIZE = 500
 
 _CTYPEGET = ContentType.objects.get
 _GA = object.__getattribute__
@@ -69,6 +73,68 @@ _DA = object.__delattr__
 #
 #------------------------------------------------------------
 
+# Attributes with changed values waiting to be saved, keyed on id.
+# Only used if ATTRIBUTE_WRITE_BEHIND is set.
+_DIRTY_ATTRIBUTES = {}
+_ATTRIBUTE_FLUSH_CALL = None
+# {id: number of failed saves} of Attributes that could not be saved
+_ATTRIBUTE_SAVE_FAILURES = {}
+# times to try saving an Attribute before giving up on its new value
+_ATTRIBUTE_SAVE_RETRIES = 3
+
+
+def flush_attributes():
+    """
+    Save all Attributes whose values were changed since the last
+    flush, all in one transaction. With ATTRIBUTE_WRITE_BEHIND set,
+    this is called automatically every ATTRIBUTE_WRITE_BEHIND_INTERVAL
+    seconds (if anything changed) and when the server shuts down or
+    reloads.
+
+    Each Attribute is saved in a savepoint, so one failing save does
+    not undo the others. An Attribute that could not be saved is
+    tried again with the next flush, a few times at most.
+    """
+    global _ATTRIBUTE_FLUSH_CALL
+    if _ATTRIBUTE_FLUSH_CALL and _ATTRIBUTE_FLUSH_CALL.active():
+        _ATTRIBUTE_FLUSH_CALL.cancel()
+    _ATTRIBUTE_FLUSH_CALL = None
+    if not _DIRTY_ATTRIBUTES:
+        return
+    dirty = _DIRTY_ATTRIBUTES.items()
+    _DIRTY_ATTRIBUTES.clear()
+    failed = []
+    with transaction.commit_on_success():
+        for attrid, attr in dirty:
+            sid = transaction.savepoint()
+            try:
+                attr.save(update_fields=["db_value"])
+                transaction.savepoint_commit(sid)
+                _ATTRIBUTE_SAVE_FAILURES.pop(attrid, None)
+            except Exception:
+                transaction.savepoint_rollback(sid)
+                logger.log_trace("Could not save Attribute %s." % attr)
+                failed.append((attrid, attr))
+    for attrid, attr in failed:
+        nfailed = _ATTRIBUTE_SAVE_FAILURES.get(attrid, 0) + 1
+        if nfailed < _ATTRIBUTE_SAVE_RETRIES:
+            # try again with the next flush
+            _ATTRIBUTE_SAVE_FAILURES[attrid] = nfailed
+            _schedule_attribute_save(attr)
+        else:
+            logger.log_errmsg("Gave up saving Attribute %s, its new value is lost." % attr)
+            _ATTRIBUTE_SAVE_FAILURES.pop(attrid, None)
+
+
+def _schedule_attribute_save(attr):
+    "Mark attr as changed and make sure a flush is scheduled"
+    global _ATTRIBUTE_FLUSH_CALL
+    _DIRTY_ATTRIBUTES[_GA(attr, "id")] = attr
+    if not _ATTRIBUTE_FLUSH_CALL:
+        from twisted.internet import reactor
+        _ATTRIBUTE_FLUSH_CALL = reactor.callLater(_ATTRIBUTE_WRITE_BEHIND_INTERVAL, flush_attributes)
+
+
 class Attribute(SharedMemoryModel):
     """
     Abstract django model.
@@ -117,6 +183,8 @@ class Attribute(SharedMemoryModel):
         "Initializes the parent first -important!"
         SharedMemoryModel.__init__(self, *args, **kwargs)
         self.locks = LockHandler(self)
+        # (db_value, value) - the last value converted by from_pickle
+        self._cached_value = None
 
     class Meta:
         "Define Django meta options"
@@ -135,20 +203,35 @@ class Attribute(SharedMemoryModel):
     def __value_get(self):
         """
         Getter. Allows for value = self.value.
-        We cannot cache here since it makes certain cases (such
-        as storing a dbobj which is then deleted elsewhere) out-of-sync.
-        The overhead of unpickling seems hard to avoid.
-        """
-        return from_pickle(self.db_value, db_obj=self)
+        The converted value is cached until a new value is set. We
+        cannot cache values holding database objects, since it makes
+        certain cases (such as storing a dbobj which is then deleted
+        elsewhere) out-of-sync, nor values holding mutables that would
+        not save when changed (see dbserialize.is_cacheable). Those
+        are converted every time.
+        """
+        db_value = _GA(self, "db_value")
+        cached = _GA(self, "_cached_value")
+        if cached and cached[0] is db_value:
+            return cached[1]
+        value = from_pickle(db_value, db_obj=self)
+        if is_cacheable(db_value):
+            _SA(self, "_cached_value", (db_value, value))
+        return value
 
     #@value.setter
     def __value_set(self, new_value):
         """
-        Setter. Allows for self.value = value. We cannot cache here,
-        see self.__value_get.
+        Setter. Allows for self.value = value. This clears the
+        cached value, see self.__value_get.
         """
+        _SA(self, "_cached_value", None)
         self.db_value = to_pickle(new_value)
-        self.save()
+        if _ATTRIBUTE_WRITE_BEHIND and _GA(self, "id"):
+            # save later, together with other changed Attributes
+            _schedule_attribute_save(self)
+        else:
+            self.save()
         try:
             self._track_db_value_change.update(self.cached_value)
         except AttributeError:
@@ -173,6 +256,15 @@ class Attribute(SharedMemoryModel):
     def __unicode__(self):
         return u"%s(%s)" % (_GA(self, "db_key"), _GA(self, "id"))
 
+    def delete(self, *args, **kwargs):
+        "Don't try to save a deleted Attribute later"
+        _DIRTY_ATTRIBUTES.pop(_GA(self, "id"), None)
+        super(Attribute, self).delete(*args, **kwargs)
+
+    def at_idmapper_flush(self):
+        "Attributes waiting to be saved are kept in the idmapper cache."
+        return _GA(self, "id") not in _DIRTY_ATTRIBUTES
+
     def access(self, accessing_obj, access_type='read', default=False, **kwargs):
         """
         Determines if another object has permission to access.
@@ -210,11 +302,14 @@ class AttributeHandler(object):
         self.obj = obj
         self._cache = None
 
-    def _recache(self):
+    def _recache(self, attrs=None):
+        "Rebuild the cache, from attrs if given, otherwise from the database"
+        if attrs is None:
+            attrs = _GA(self.obj, self._m2m_fieldname).all()
         self._cache = dict(("%s_%s" % (to_str(attr.db_key).lower(),
                                        to_str(attr.db_category,
                                        force_string=True).lower()), attr)
-                        for attr in _GA(self.obj, self._m2m_fieldname).all())
+                        for attr in attrs)
         set_attr_cache(self.obj, self._cache) # currently only for testing
 
     def has(self, key, category=None):
@@ -250,6 +345,17 @@ class AttributeHandler(object):
         """
         if self._cache is None or not _TYPECLASS_AGGRESSIVE_CACHE:
             self._recache()
+        if isinstance(key, basestring) and not accessing_obj:
+            # fast path for the common case of getting a single Attribute
+            catkey = "none" if category is None else to_str(category, force_string=True).lower()
+            attr_obj = self._cache.get("%s_%s" % (key.lower(), catkey))
+            if not attr_obj:
+                if raise_exception:
+                    raise AttributeError
+                return default
+            if return_obj:
+                return attr_obj
+            return attr_obj.strvalue if strattr else attr_obj.value
         ret = []
         catkey = to_str(category, force_string=True).lower()
         if not key:
@@ -312,7 +418,9 @@ class AttributeHandler(object):
         else:
             # pickle arbitrary data
             attr_obj.value = value
-            attr_obj.strvalue = None
+            if attr_obj.db_strvalue is not None:
+                # (each assignment is a save)
+                attr_obj.strvalue = None
 
     def remove(self, key, raise_exception=False, category=None,
                accessing_obj=None, default_access=True):
@@ -360,6 +468,43 @@ class AttributeHandler(object):
         catkey = "_%s" % to_str(category, force_string=True).lower()
         return [attr for key, attr in self._cache.items() if key.endswith(catkey)]
 
+def prefetch_attributes(objs):
+    """
+    Fill the Attribute caches of many entities at once, using one
+    database query per model instead of one query per entity. Use
+    this before looping over many entities that will all access
+    their Attributes. Entities whose caches are already filled are
+    skipped.
+
+    objs - iterable of typeclassed entities or their database objects
+    """
+    if not _TYPECLASS_AGGRESSIVE_CACHE:
+        # caches are rebuilt on every access anyway
+        return
+    # group the uncached entities by model
+    bymodel = {}
+    for obj in objs:
+        obj = obj.dbobj if hasattr(obj, "dbobj") else obj
+        try:
+            handler = _GA(obj, "attributes")
+        except AttributeError:
+            continue
+        if handler._cache is None:
+            bymodel.setdefault(obj.__class__, {})[_GA(obj, "id")] = (handler, [])
+    for model, handlers in bymodel.items():
+        field = model._meta.get_field(AttributeHandler._m2m_fieldname)
+        objfield, attrfield = field.m2m_field_name(), field.m2m_reverse_field_name()
+        through, ids = field.rel.through, handlers.keys()
+        # one query per chunk of ids; sqlite allows at most 999
+        # variables in a query
+        for ichunk in xrange(0, len(ids), _PREFETCH_CHUNK_SIZE):
+            query = {"%s__in" % objfield: ids[ichunk:ichunk + _PREFETCH_CHUNK_SIZE]}
+            for row in through.objects.filter(**query).select_related(attrfield):
+                handlers[getattr(row, "%s_id" % objfield)][1].append(getattr(row, attrfield))
+        for handler, attrs in handlers.values():
+            handler._recache(attrs)
+
+
 class NickHandler(AttributeHandler):
     """
     Handles the addition and removal of Nicks
@@ -429,6 +574,67 @@ class NAttributeHandler(object):
             return [val for val in self.ndb.__dict__.keys() if not val.startswith('_')]
 
 
+class DbHolder(object):
+    """
+    Holder for allowing property access of attributes, as obj.db.
+    Looking up an attribute goes straight to the Attribute cache of
+    the object's AttributeHandler.
+    """
+    __slots__ = ("obj", "attrhandler")
+
+    def __init__(self, obj):
+        _SA(self, "obj", obj)
+        _SA(self, "attrhandler", _GA(obj, "attributes"))
+
+    def __getattribute__(self, attrname):
+        handler = _GA(self, "attrhandler")
+        cache = handler._cache
+        if cache is None or not _TYPECLASS_AGGRESSIVE_CACHE:
+            handler._recache()
+            cache = handler._cache
+        # this is the cache key of an Attribute without category
+        attr = cache.get("%s_none" % attrname.lower())
+        if attr:
+            return attr.value
+        if attrname == 'all':
+            # we allow to overload our default .all
+            return _GA(self, 'all')
+        return None
+
+    def __setattr__(self, attrname, value):
+        _GA(self, "attrhandler").add(attrname, value)
+
+    def __delattr__(self, attrname):
+        _GA(self, "attrhandler").remove(attrname)
+
+    def get_all(self):
+        return _GA(self, "attrhandler").all()
+    all = property(get_all)
+
+
+class NdbHolder(object):
+    """
+    Holder for storing non-persistent attributes, as obj.ndb. The
+    attributes are stored in the holder's __dict__.
+    """
+    def get_all(self):
+        return [val for val in self.__dict__.keys()
+                if not val.startswith('_')]
+    all = property(get_all)
+
+    def __getattribute__(self, key):
+        # return None if no matching attribute was found.
+        try:
+            return _GA(self, key)
+        except AttributeError:
+            return None
+
+    def __setattr__(self, key, value):
+        # hook the oob handler here
+        #call_ndb_hooks(self, key, value)
+        _SA(self, key, value)
+
+
 #------------------------------------------------------------
 #
 # Tags
@@ -518,6 +724,8 @@ class TagHandler(object):
             if self._cache is None:
                 self._recache()
             self._cache[tagstr] = tagobj
+        # tags and permissions may affect lock results
+        flush_lock_cache()
 
     def get(self, key, category="", return_data=False):
         """
@@ -551,12 +759,14 @@ class TagHandler(object):
             if tagobj:
                 _GA(self.obj, self._m2m_fieldname).remove(tagobj[0])
         self._recache()
+        flush_lock_cache()
 
     def clear(self):
         "Remove all tags from the handler"
         for tag in _GA(self.obj, self._m2m_fieldname).filter(db_category__startswith=self.prefix):
             _GA(self.obj, self._m2m_fieldname).remove(tag)
         self._recache()
+        flush_lock_cache()
 
     def all(self, category=None, return_key_and_category=False):
         """
@@ -1112,6 +1322,17 @@ class TypedObject(SharedMemoryModel):
         """
         self.__class__.flush_cached_instance(self)
 
+    def at_idmapper_flush(self):
+        """
+        Called before this object is evicted from the idmapper cache.
+        Objects with non-persistent (ndb) data are not evicted, since
+        that data would be lost.
+        """
+        try:
+            return not _GA(_GA(self, "_ndb_holder"), "__dict__")
+        except AttributeError:
+            return True
+
     #
     # Attribute storage
     #
@@ -1130,34 +1351,10 @@ class TypedObject(SharedMemoryModel):
                       named 'all', in which case that will be returned instead).
         """
         try:
-            return self._db_holder
+            return _GA(self, "_db_holder")
         except AttributeError:
-            class DbHolder(object):
-                "Holder for allowing property access of attributes"
-                def __init__(self, obj):
-                    _SA(self, 'obj', obj)
-                    _SA(self, "attrhandler", _GA(_GA(self, "obj"), "attributes"))
-
-                def __getattribute__(self, attrname):
-                    if attrname == 'all':
-                        # we allow to overload our default .all
-                        attr = _GA(self, "attrhandler").get("all")
-                        if attr:
-                            return attr
-                        return _GA(self, 'all')
-                    return _GA(self, "attrhandler").get(attrname)
-
-                def __setattr__(self, attrname, value):
-                    _GA(self, "attrhandler").add(attrname, value)
-
-                def __delattr__(self, attrname):
-                    _GA(self, "attrhandler").remove(attrname)
-
-                def get_all(self):
-                    return _GA(self, "attrhandler").all()
-                all = property(get_all)
-            self._db_holder = DbHolder(self)
-            return self._db_holder
+            _SA(self, "_db_holder", DbHolder(self))
+            return _GA(self, "_db_holder")
 
     #@db.setter
     def __db_set(self, value):
@@ -1185,28 +1382,10 @@ class TypedObject(SharedMemoryModel):
         property, e.g. obj.ndb.attr = value etc.
         """
         try:
-            return self._ndb_holder
+            return _GA(self, "_ndb_holder")
         except AttributeError:
-            class NdbHolder(object):
-                "Holder for storing non-attr_obj attributes."
-                def get_all(self):
-                    return [val for val in self.__dict__.keys()
-                            if not val.startswith('_')]
-                all = property(get_all)
-
-                def __getattribute__(self, key):
-                    # return None if no matching attribute was found.
-                    try:
-                        return _GA(self, key)
-                    except AttributeError:
-                        return None
-
-                def __setattr__(self, key, value):
-                    # hook the oob handler here
-                    #call_ndb_hooks(self, key, value)
-                    _SA(self, key, value)
-            self._ndb_holder = NdbHolder()
-            return self._ndb_holder
+            _SA(self, "_ndb_holder", NdbHolder())
+            return _GA(self, "_ndb_holder")
 
     #@ndb.setter
     def __ndb_set(self, value):
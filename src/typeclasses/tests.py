@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+"""
+Unit testing of the 'typeclasses' Evennia component.
+
+Runs as part of the Evennia's test suite with 'manage.py test"
+
+This tests filling the Attribute caches of many entities at once and
+saving changed Attributes later (ATTRIBUTE_WRITE_BEHIND).
+"""
+
+from django.test import TestCase
+from django.conf import settings
+from src.typeclasses import models
+from src.typeclasses.models import Attribute, prefetch_attributes, flush_attributes
+from src.utils.dbserialize import from_pickle
+from src.utils import create
+
+
+class TestPrefetchAttributes(TestCase):
+    "Prefetching Attributes in chunks"
+    def setUp(self):
+        "sets up the testing environment"
+        self.objs = [create.create_object(settings.BASE_OBJECT_TYPECLASS, key="obj%i" % i)
+                     for i in range(5)]
+        for i, obj in enumerate(self.objs):
+            obj.db.num = i
+            obj.db.name = "obj%i" % i
+        # empty the caches, as for objects not accessed since loaded
+        for obj in self.objs:
+            obj.dbobj.attributes._cache = None
+        self.old_chunk_size = models._PREFETCH_CHUNK_SIZE
+
+    def tearDown(self):
+        models._PREFETCH_CHUNK_SIZE = self.old_chunk_size
+
+    def test_prefetch(self):
+        models._PREFETCH_CHUNK_SIZE = 2
+        # 5 objects in chunks of 2
+        self.assertNumQueries(3, prefetch_attributes, self.objs)
+        for i, obj in enumerate(self.objs):
+            cache = obj.dbobj.attributes._cache
+            self.assertEqual(i, cache["num_none"].value)
+            self.assertEqual("obj%i" % i, cache["name_none"].value)
+        def read():
+            for i, obj in enumerate(self.objs):
+                self.assertEqual(i, obj.db.num)
+                self.assertEqual("obj%i" % i, obj.db.name)
+        self.assertNumQueries(0, read)
+
+    def test_skip_cached(self):
+        self.objs[0].attributes.all()
+        self.assertNumQueries(1, prefetch_attributes, self.objs)
+        # already cached entities cost no query
+        self.assertNumQueries(0, prefetch_attributes, self.objs)
+
+
+class _Call(object):
+    "Stands in for the pending call to flush Attributes, so none is made"
+    def active(self):
+        return False
+
+    def cancel(self):
+        pass
+
+
+class TestAttributeWriteBehind(TestCase):
+    "Saving changed Attribute values later, all together"
+    def setUp(self):
+        "sets up the testing environment"
+        self.obj = create.create_object(settings.BASE_OBJECT_TYPECLASS, key="obj")
+        self.obj.db.hp = 0
+        self.obj.db.mp = 0
+        self.hp = self.obj.attributes.get("hp", return_obj=True)
+        self.mp = self.obj.attributes.get("mp", return_obj=True)
+        self.old = (models._ATTRIBUTE_WRITE_BEHIND, models._ATTRIBUTE_FLUSH_CALL)
+        models._ATTRIBUTE_WRITE_BEHIND = True
+        models._ATTRIBUTE_FLUSH_CALL = _Call()
+
+    def tearDown(self):
+        models._DIRTY_ATTRIBUTES.clear()
+        models._ATTRIBUTE_SAVE_FAILURES.clear()
+        models._ATTRIBUTE_WRITE_BEHIND, models._ATTRIBUTE_FLUSH_CALL = self.old
+
+    def stored(self, attr):
+        "the value of attr as stored in the database"
+        raw = Attribute.objects.filter(id=attr.id).values_list("db_value", flat=True)[0]
+        return from_pickle(Attribute._meta.get_field("db_value").to_python(raw))
+
+    def test_coalesce(self):
+        def change():
+            for hp in range(1, 11):
+                self.obj.db.hp = hp
+            self.obj.db.mp = 5
+        self.assertNumQueries(0, change)
+        self.assertEqual({self.hp.id: self.hp, self.mp.id: self.mp}, models._DIRTY_ATTRIBUTES)
+        self.assertEqual(10, self.obj.db.hp)
+        self.assertEqual(0, self.stored(self.hp))
+        # one save per changed Attribute
+        saves = []
+        def counted(attr):
+            save = attr.save
+            def save_counted(*args, **kwargs):
+                saves.append(attr.db_key)
+                save(*args, **kwargs)
+            return save_counted
+        self.hp.save, self.mp.save = counted(self.hp), counted(self.mp)
+        try:
+            flush_attributes()
+        finally:
+            del self.hp.save, self.mp.save
+        self.assertEqual(["hp", "mp"], sorted(saves))
+        self.assertEqual({}, models._DIRTY_ATTRIBUTES)
+        self.assertEqual(10, self.stored(self.hp))
+        self.assertEqual(5, self.stored(self.mp))
+
+    def test_shutdown_flush(self):
+        # the server calls flush_attributes when shutting down or
+        # reloading, before the scheduled flush would have run
+        class _PendingCall(_Call):
+            cancelled = False
+            def active(self):
+                return not self.cancelled
+            def cancel(self):
+                self.cancelled = True
+        call = models._ATTRIBUTE_FLUSH_CALL = _PendingCall()
+        self.obj.db.hp = 3
+        flush_attributes()
+        self.assertTrue(call.cancelled)
+        self.assertEqual(None, models._ATTRIBUTE_FLUSH_CALL)
+        self.assertEqual(3, self.stored(self.hp))
+
+    def test_failed_save(self):
+        def fail(*args, **kwargs):
+            raise IOError("database is locked")
+        self.obj.db.hp = 7
+        self.obj.db.mp = 8
+        self.hp.save = fail
+        try:
+            flush_attributes()
+            # the other Attribute is saved, the failed one kept for later
+            self.assertEqual(8, self.stored(self.mp))
+            self.assertEqual(0, self.stored(self.hp))
+            self.assertEqual({self.hp.id: self.hp}, models._DIRTY_ATTRIBUTES)
+            for _ in range(models._ATTRIBUTE_SAVE_RETRIES - 1):
+                models._ATTRIBUTE_FLUSH_CALL = _Call()
+                flush_attributes()
+            # given up on
+            self.assertEqual({}, models._DIRTY_ATTRIBUTES)
+        finally:
+            del self.hp.save
+        self.obj.db.hp = 9
+        models._ATTRIBUTE_FLUSH_CALL = _Call()
+        flush_attributes()
+        self.assertEqual(9, self.stored(self.hp))
@@ -14,6 +14,8 @@ user.
 
 """
 import re
+from collections import OrderedDict
+from django.conf import settings
 from src.utils import utils
 
 # ANSI definitions
@@ -59,6 +61,11 @@ ANSI_SPACE = " "
 # Escapes
 ANSI_ESCAPES = ("{{", "%%", "\\\\")
 
+# max number of parsed strings to remember
+_PARSE_CACHE_SIZE = settings.ANSI_PARSE_CACHE_SIZE
+# longer strings are not cached
+_PARSE_CACHE_MAXLEN = 4096
+
 
 class ANSIParser(object):
     """
@@ -144,6 +151,26 @@ class ANSIParser(object):
         self.ansi_sub = [(re.compile(sub[0], re.DOTALL), sub[1])
                          for sub in self.ansi_map]
 
+        # all escapes and mappings combined into one regex, so the
+        # string can be translated in one pass. Plain-text mappings are
+        # looked up directly from the matched text. Escapes go first,
+        # then the regex mappings (in order) and the plain ones, longest
+        # first so no mapping hides another one it is the start of.
+        self.ansi_plain = {}
+        self.ansi_regex_sub = []
+        for pattern, repl in self.ansi_map:
+            if not re.search(r"[\\\[\]().*+?|^$]", pattern):
+                self.ansi_plain.setdefault(pattern, repl)
+            else:
+                self.ansi_regex_sub.append((re.compile(pattern, re.DOTALL), repl))
+        self.ansi_combined = re.compile("|".join(
+            list(ANSI_ESCAPES) +
+            [regex.pattern for regex, repl in self.ansi_regex_sub] +
+            [re.escape(plain) for plain in sorted(self.ansi_plain, key=len, reverse=True)]),
+            re.DOTALL)
+        # cache of parsed strings, (string, strip_ansi, xterm256): result
+        self.parse_cache = OrderedDict()
+
         # prepare matching ansi codes overall
         self.ansi_regex = re.compile("\033\[[0-9;]+m")
 
@@ -151,6 +178,24 @@ class ANSIParser(object):
         # instance of each
         self.ansi_escapes = re.compile(r"(%s)" % "|".join(ANSI_ESCAPES), re.DOTALL)
 
+    def sub_markup(self, match):
+        """
+        This is a replacer method called by re.sub with a match of
+        self.ansi_combined. It returns the translation of the matched
+        escape or markup.
+        """
+        markup = match.group()
+        try:
+            return self.ansi_plain[markup]
+        except KeyError:
+            pass
+        for regex, repl in self.ansi_regex_sub:
+            submatch = regex.match(markup)
+            if submatch and submatch.end() == len(markup):
+                return repl(submatch) if callable(repl) else repl
+        # an escape; replace with a single instance
+        return markup[0]
+
     def parse_rgb(self, rgbmatch):
         """
         This is a replacer method called by re.sub with the matched
@@ -243,21 +288,26 @@ class ANSIParser(object):
         """
         if not string:
             return ''
-        self.do_xterm256 = xterm256
         string = utils.to_str(string)
-
-        # go through all available mappings and translate them
-        parts = self.ansi_escapes.split(string) + [" "]
-        string = ""
-        for part, sep in zip(parts[::2], parts[1::2]):
-            for sub in self.ansi_sub:
-                part = sub[0].sub(sub[1], part)
-            string += "%s%s" % (part, sep[0].strip())
+        cachekey = (string, strip_ansi, xterm256)
+        try:
+            result = self.parse_cache.pop(cachekey)
+            # re-insert as the most recently used
+            self.parse_cache[cachekey] = result
+            return result
+        except KeyError:
+            pass
+        self.do_xterm256 = xterm256
+        result = self.ansi_combined.sub(self.sub_markup, string)
         if strip_ansi:
             # remove all ansi codes (including those manually
             # inserted in string)
-            string = self.ansi_regex.sub("", string)
-        return string
+            result = self.ansi_regex.sub("", result)
+        if _PARSE_CACHE_SIZE and len(string) <= _PARSE_CACHE_MAXLEN:
+            self.parse_cache[cachekey] = result
+            if len(self.parse_cache) > _PARSE_CACHE_SIZE:
+                self.parse_cache.popitem(last=False)
+        return result
 
 ANSI_PARSER = ANSIParser()
 
@@ -17,8 +17,14 @@ used by Attributes - without it, one would not be able to update mutables
 in-situ, e.g obj.db.mynestedlist[3][5] = 3 would never be saved and
 be out of sync with the database.
 
+Each Saver* iterable also caches its converted (to_pickle) form. A
+change only clears the cache of the changed iterable and its parents,
+so saving after e.g. obj.db.mylist[3][5] = 3 does not need to convert
+the unchanged parts of the structure again.
+
 """
 
+from datetime import datetime, date, time, timedelta
 from functools import update_wrapper
 from collections import defaultdict, MutableSequence, MutableSet, MutableMapping
 try:
@@ -32,7 +38,8 @@ from src.server.models import ServerConfig
 from src.utils.utils import to_str, uses_database
 from src.utils import logger
 
-__all__ = ("to_pickle", "from_pickle", "do_pickle", "do_unpickle")
+__all__ = ("to_pickle", "from_pickle", "do_pickle", "do_unpickle",
+           "is_cacheable")
 
 PICKLE_PROTOCOL = 2
 
@@ -44,6 +51,9 @@ _FROM_MODEL_MAP = None
 _TO_MODEL_MAP = None
 _TO_TYPECLASS = lambda o: hasattr(o, 'typeclass') and o.typeclass or o
 _IS_PACKED_DBOBJ = lambda o: type(o) == tuple and len(o) == 4 and o[0] == '__packed_dbobj__'
+# types that can not be changed in-place, see is_cacheable
+_IMMUTABLE_TYPES = (type(None), str, unicode, int, long, float, complex, bool,
+                    datetime, date, time, timedelta)
 if uses_database("mysql") and ServerConfig.objects.get_mysql_db_version() < '5.6.4':
     # mysql <5.6.4 don't support millisecond precision
     _DATESTRING = "%Y:%m:%d-%H:%M:%S:000000"
@@ -101,9 +111,12 @@ class _SaverMutable(object):
         self._parent = kwargs.pop("parent", None)
         self._db_obj = kwargs.pop("db_obj", None)
         self._data = None
+        # cached to_pickle form of this subtree, None if changed
+        self._packed = None
 
     def _save_tree(self):
         "recursively traverse back up the tree, save when we reach the root"
+        self._packed = None
         if self._parent:
             self._parent._save_tree()
         elif self._db_obj:
@@ -213,12 +226,20 @@ def pack_dbobj(item):
     """
     _init_globals()
     obj = hasattr(item, 'dbobj') and item.dbobj or item
+    try:
+        # this never changes, so it is cached on the object
+        return _GA(obj, "_packed_dbobj")
+    except AttributeError:
+        pass
     natural_key = _FROM_MODEL_MAP[hasattr(obj, "id") and hasattr(obj, "db_date_created") and
                                   hasattr(obj, '__class__') and obj.__class__.__name__.lower()]
+    if not natural_key:
+        return item
     # build the internal representation as a tuple
     #  ("__packed_dbobj__", key, creation_time, id)
-    return natural_key and ('__packed_dbobj__', natural_key,
-                             _TO_DATESTRING(obj), _GA(obj, "id")) or item
+    packed = ('__packed_dbobj__', natural_key, _TO_DATESTRING(obj), _GA(obj, "id"))
+    _SA(obj, "_packed_dbobj", packed)
+    return packed
 
 
 def unpack_dbobj(item):
@@ -252,7 +273,8 @@ def to_pickle(data):
     structure and returns data on a form that is safe to pickle (including
     having converted any database models to their internal representation).
     We also convert any Saver*-type objects back to their normal
-    representations, they are not pickle-safe.
+    representations, they are not pickle-safe. Saver*-types that have not
+    changed since they were last converted return their cached form.
     """
     def process_item(item):
         "Recursive processor and identification of data"
@@ -261,11 +283,22 @@ def to_pickle(data):
             return item
         elif dtype == tuple:
             return tuple(process_item(val) for val in item)
-        elif dtype in (list, _SaverList):
+        elif dtype in (_SaverList, _SaverDict, _SaverSet):
+            packed = item._packed
+            if packed is None:
+                if dtype == _SaverList:
+                    packed = [process_item(val) for val in item._data]
+                elif dtype == _SaverDict:
+                    packed = dict((key, process_item(val)) for key, val in item._data.items())
+                else:
+                    packed = set(process_item(val) for val in item._data)
+                item._packed = packed
+            return packed
+        elif dtype == list:
             return [process_item(val) for val in item]
-        elif dtype in (dict, _SaverDict):
+        elif dtype == dict:
             return dict((key, process_item(val)) for key, val in item.items())
-        elif dtype in (set, _SaverSet):
+        elif dtype == set:
             return set(process_item(val) for val in item)
         elif hasattr(item, '__item__'):
             # we try to conserve the iterable class, if not convert to list
@@ -277,6 +310,43 @@ def to_pickle(data):
     return process_item(data)
 
 
+def is_cacheable(data):
+    """
+    Check if the value from_pickle converts data (on the form returned
+    by to_pickle) to can be kept and used again, rather than being
+    converted anew every time it is used. This is not the case if data
+    holds any database objects, since these may have been deleted. Nor
+    is it if the value holds mutable containers other than the lists,
+    dicts and sets that from_pickle wraps in _Saver* types (such as a
+    list in a root tuple, or a deque); changes made to those in-place
+    would show in the kept value but never be saved.
+    """
+    def immutable(item):
+        "Check if item can not change in-place"
+        dtype = type(item)
+        if dtype in _IMMUTABLE_TYPES:
+            return True
+        elif _IS_PACKED_DBOBJ(item):
+            return False
+        elif dtype in (tuple, frozenset):
+            return all(immutable(val) for val in item)
+        return False
+
+    def saved(item):
+        "Check if item, in a _Saver* iterable, is saved when changed"
+        dtype = type(item)
+        if dtype == dict:
+            return all(saved(val) for val in item.itervalues())
+        elif dtype in (list, set):
+            return all(saved(val) for val in item)
+        return immutable(item)
+
+    if type(data) in (list, dict, set):
+        # these become _Saver* iterables, see from_pickle
+        return saved(data)
+    return immutable(data)
+
+
 @transaction.autocommit
 def from_pickle(data, db_obj=None):
     """
@@ -330,15 +400,18 @@ def from_pickle(data, db_obj=None):
         elif dtype == list:
             dat = _SaverList(parent=parent)
             dat._data.extend(process_tree(val, dat) for val in item)
+            dat._packed = item
             return dat
         elif dtype == dict:
             dat = _SaverDict(parent=parent)
             dat._data.update(dict((key, process_tree(val, dat))
                                    for key, val in item.items()))
+            dat._packed = item
             return dat
         elif dtype == set:
             dat = _SaverSet(parent=parent)
             dat._data.update(set(process_tree(val, dat) for val in item))
+            dat._packed = item
             return dat
         elif hasattr(item, '__iter__'):
             try:
@@ -354,19 +427,24 @@ def from_pickle(data, db_obj=None):
     if db_obj:
         # convert lists, dicts and sets to their Saved* counterparts. It
         # is only relevant if the "root" is an iterable of the right type.
+        # the data is already in packed form; keep it as the cache
+        # of each converted iterable until they change.
         dtype = type(data)
         if dtype == list:
             dat = _SaverList(db_obj=db_obj)
             dat._data.extend(process_tree(val, parent=dat) for val in data)
+            dat._packed = data
             return dat
         elif dtype == dict:
             dat = _SaverDict(db_obj=db_obj)
             dat._data.update((key, process_tree(val, parent=dat))
                               for key, val in data.items())
+            dat._packed = data
             return dat
         elif dtype == set:
             dat = _SaverSet(db_obj=db_obj)
             dat._data.update(process_tree(val, parent=dat) for val in data)
+            dat._packed = data
             return dat
     return process_item(data)
 
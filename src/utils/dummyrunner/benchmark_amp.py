@@ -0,0 +1,72 @@
+"""
+This is a little routine for timing the encoding of messages sent
+between the Portal and the Server over AMP. It round-trips typical
+messages through the AMP protocol's safe_send and safe_recv methods
+(no network is involved) using each available AMP_CODEC, comparing
+with pickling the data of every message (as was done before).
+
+Run from the game/ directory:
+
+    python ../src/utils/dummyrunner/benchmark_amp.py
+
+"""
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+os.environ["DJANGO_SETTINGS_MODULE"] = "game.settings"
+from timeit import timeit
+
+from src.server import amp
+
+# number of round trips of each message type to time
+NTRIPS = 20000
+
+# (name, text, data) of the messages to send
+MESSAGES = (
+    ("telnet text", "You see a {rred{n door and a brass key here.", {}),
+    ("text + flags", "Hello there.", {"raw": True, "nomarkup": False}),
+    ("oob/msdp", "", {"oob": (("REPORT", ("HEALTH", "MANA", "MOVEMENT"), {}),
+                              ("SEND", ("ROOM", "ROOM_EXITS"), {"area": u"The Marsh"}))}),
+    ("multipart", "x" * 200000, {"oob": (("LIST", ("COMMANDS",), {}),)}))
+
+
+class _AMPProtocol(amp.AMPProtocol):
+    "AMP protocol sending straight to its own safe_recv"
+    def callRemote(self, command, **kwargs):
+        self.received = self.safe_recv(command, **kwargs)
+        return self
+
+    def addErrback(self, *args):
+        pass
+
+
+def roundtrip(protocol, encode, decode, text, data):
+    "Send a message and decode it again on the 'other side'"
+    protocol.safe_send(amp.MsgServer2Portal, 1, msg=text, data=encode(data))
+    ret = protocol.received
+    return ret["msg"], decode(ret["data"])
+
+
+if __name__ == "__main__":
+
+    protocol = _AMPProtocol()
+    codecs = [("pickle (old)", amp.dumps, amp.loads)]
+    for name in sorted(amp._MSGDATA_CODECS):
+        tag, encoder, decoder = amp._MSGDATA_CODECS[name]
+        def encode(data, tag=tag, encoder=encoder):
+            "switch the codec used by encode_msgdata, then encode"
+            amp._MSGDATA_TAG, amp._MSGDATA_ENCODER = tag, encoder
+            return amp.encode_msgdata(data)
+        codecs.append((name, encode, amp.decode_msgdata))
+
+    print "%i round trips of each message" % NTRIPS
+    print "%-14s" % "message" + "".join("%14s" % codec[0] for codec in codecs)
+    for msgname, text, data in MESSAGES:
+        times = []
+        for codecname, encode, decode in codecs:
+            if roundtrip(protocol, encode, decode, text, data) != (text, data):
+                # msgpack, for example, returns tuples as lists
+                print "(%s does not return %s unchanged)" % (codecname, msgname)
+            ntrips = NTRIPS if len(text) < amp.MAXLEN else NTRIPS / 100
+            t = timeit(lambda: roundtrip(protocol, encode, decode, text, data), number=ntrips)
+            times.append(t * NTRIPS / ntrips)
+        print "%-14s" % msgname + "".join("%13.4fs" % t for t in times)
@@ -0,0 +1,69 @@
+"""
+This is a little routine for timing the ANSI markup parser on
+typical coloured output; room descriptions, prompts, channel
+messages and xterm256 text. It compares the one-pass parser (with
+and without its cache of parsed strings) against the old way of
+running one regex substitution per markup code over the text.
+
+Run from the game/ directory:
+
+    python ../src/utils/dummyrunner/benchmark_ansi.py
+
+"""
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+os.environ["DJANGO_SETTINGS_MODULE"] = "game.settings"
+from timeit import timeit
+
+from src.utils import ansi, utils
+
+# number of times to parse each text
+NPARSES = 20000
+
+TEXTS = (
+    ("room", "{cThe Old Tavern{n\n{WA dimly lit room with a {ylarge fireplace{W. "
+             "Smoke hangs under the ceiling and the floor is sticky with "
+             "old ale.{n\n{wExits:{n {gnorth{n, {gsouth{n, {gup{n\n"
+             "{wYou see:{n a {rrusty sword{n, {b%cbBarkeep Bob{n and 100%% of nothing."),
+    ("prompt", "{g<{rHP:{n 100/120 {bMP:{n 34/50 {yMV:{n 80/80{g>{n "),
+    ("channel", "{w[{gPublic{w]{n {cAnna{n: hey, anyone up for the {{quest}} tonight? \\o/"),
+    ("xterm256", "{500red{050green{005blue{n {b123back{n %c432and%cn {{escaped"),
+    ("plain", "Just a plain line of text without any markup in it at all."))
+
+
+class OldANSIParser(ansi.ANSIParser):
+    "The parser as it was, running each regex over each part"
+    def parse_ansi(self, string, strip_ansi=False, xterm256=False):
+        if not string:
+            return ''
+        self.do_xterm256 = xterm256
+        string = utils.to_str(string)
+        parts = self.ansi_escapes.split(string) + [" "]
+        string = ""
+        for part, sep in zip(parts[::2], parts[1::2]):
+            for sub in self.ansi_sub:
+                part = sub[0].sub(sub[1], part)
+            string += "%s%s" % (part, sep[0].strip())
+        if strip_ansi:
+            string = self.ansi_regex.sub("", string)
+        return string
+
+
+if __name__ == "__main__":
+
+    old, new = OldANSIParser(), ansi.ANSIParser()
+    cachesize = ansi._PARSE_CACHE_SIZE
+
+    print "%i parses of each text" % NPARSES
+    print "%-10s %10s %10s %10s %8s %8s" % ("text", "old (s)", "new (s)", "cached (s)", "speedup", "cached")
+    for name, text in TEXTS:
+        for xterm256 in (False, True):
+            assert old.parse_ansi(text, xterm256=xterm256) == new.parse_ansi(text, xterm256=xterm256)
+        t_old = timeit(lambda: old.parse_ansi(text), number=NPARSES)
+        ansi._PARSE_CACHE_SIZE = 0
+        new.parse_cache.clear()
+        t_new = timeit(lambda: new.parse_ansi(text), number=NPARSES)
+        ansi._PARSE_CACHE_SIZE = cachesize
+        t_cached = timeit(lambda: new.parse_ansi(text), number=NPARSES)
+        print "%-10s %10.4f %10.4f %10.4f %7.1fx %7.1fx" % (name, t_old, t_new, t_cached,
+                                                           t_old / t_new, t_old / t_cached)
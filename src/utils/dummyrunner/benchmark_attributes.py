@@ -0,0 +1,78 @@
+"""
+This is a little routine for timing reads of Attributes with obj.db,
+such as obj.db.hp, in a tight loop. It compares the current way
+(looking up the Attribute directly in the handler's cache and using
+its cached value) with the old way of going through
+AttributeHandler.get() and re-converting the value with from_pickle
+on every read. No database is used; the Attribute cache of a mocked
+entity is filled directly.
+
+Run from the game/ directory:
+
+    python ../src/utils/dummyrunner/benchmark_attributes.py
+
+"""
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+os.environ["DJANGO_SETTINGS_MODULE"] = "game.settings"
+from timeit import timeit
+
+from src.typeclasses import models
+from src.typeclasses.models import Attribute, AttributeHandler, DbHolder
+from src.utils.dbserialize import to_pickle, from_pickle
+from src.utils.utils import make_iter, to_str
+
+# number of reads of each Attribute
+NREADS = 100000
+
+# (name, value) of the stored Attributes
+VALUES = (
+    ("hp", 100),
+    ("desc", "A large, hairy troll with a bad attitude."),
+    ("inventory", ["sword", "shield", "potion", "rope", "torch"]),
+    ("stats", {"str": 18, "dex": 12, "con": 16, "skills": ["smash", "roar"]}),
+    # a list in a tuple is not saved if changed, so this is not cached
+    ("pos", ("forest", [10, 12])))
+
+
+class _Entity(object):
+    "Mock typeclassed entity with a filled Attribute cache"
+    def __init__(self):
+        self.attributes = AttributeHandler(self)
+        self.attributes._cache = {}
+        for key, value in VALUES:
+            attr = Attribute(db_key=key)
+            # set the field directly, the value property would save
+            attr.db_value = to_pickle(value)
+            self.attributes._cache["%s_none" % key] = attr
+
+
+def old_get(handler, key, category=None):
+    "AttributeHandler.get as it was, for a single key"
+    ret = []
+    catkey = to_str(category, force_string=True).lower()
+    for keystr in ("%s_%s" % (k.lower(), catkey) for k in make_iter(key)):
+        attr_obj = handler._cache.get(keystr)
+        if attr_obj:
+            ret.append(attr_obj)
+        else:
+            ret.append(None)
+    ret = [from_pickle(attr.db_value, db_obj=attr) if attr else None for attr in ret]
+    return ret[0] if len(ret) == 1 else ret
+
+
+if __name__ == "__main__":
+
+    models._TYPECLASS_AGGRESSIVE_CACHE = True
+    entity = _Entity()
+    db = DbHolder(entity)
+    handler = entity.attributes
+
+    print "%i reads of each Attribute" % NREADS
+    print "%-10s %10s %10s %8s" % ("attribute", "old (s)", "new (s)", "speedup")
+    for key, value in VALUES:
+        # (the Saver* wrappers of lists only compare equal by repr)
+        assert repr(old_get(handler, key)) == repr(getattr(db, key)) == repr(value)
+        t_old = timeit(lambda: old_get(handler, key), number=NREADS)
+        t_new = timeit(lambda: getattr(db, key), number=NREADS)
+        print "%-10s %10.4f %10.4f %7.1fx" % (key, t_old, t_new, t_old / t_new)
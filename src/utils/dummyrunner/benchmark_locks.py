@@ -0,0 +1,91 @@
+"""
+This is a little routine for timing lock checks. It compares the
+compiled lock expressions used by the LockHandler against the old
+way of checking a lock - calling all lock functions to build a tuple
+of True/False values and eval():ing that into the lock definition.
+
+The default lockstrings of Objects, Players and Channels are used.
+Run from the game/ directory:
+
+    python ../src/utils/dummyrunner/benchmark_locks.py
+
+"""
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+os.environ["DJANGO_SETTINGS_MODULE"] = "game.settings"
+from timeit import timeit
+
+from src.locks.lockhandler import LockHandler
+
+# number of checks of each lock type to time
+NCHECKS = 100000
+
+# default lockstrings, as set by the basetypes
+DEFAULT_LOCKS = ";".join([
+    "control:perm(Immortals)",
+    "examine:perm(Builders)",
+    "view:all()",
+    "edit:perm(Wizards)",
+    "delete:perm(Wizards)",
+    "get:all()",
+    "call:true()",
+    "tell:perm(Wizards)",
+    "puppet:pid(1) or perm(Immortals) or pperm(Immortals)",
+    "boot:perm(Wizards)",
+    "msg:all()",
+    "attrread:perm(Admins)",
+    "listen:all()",
+    "send:all()",
+    "owner:perm(Wizards) or id(1)",
+    "cmd:all()"])
+
+
+class _Permissions(object):
+    "Mock permission handler"
+    def __init__(self, perms):
+        self.perms = perms
+    def all(self):
+        return self.perms
+
+
+class _Locks(object):
+    "Mock lock handler of the accessing object"
+    lock_bypass = False
+
+
+class _Obj(object):
+    "Mock object, enough for the default lock functions"
+    def __init__(self, dbid, perms):
+        self.dbid = dbid
+        self.permissions = _Permissions(perms)
+        self.locks = _Locks()
+        self.player = self
+        self.lock_storage = DEFAULT_LOCKS
+
+
+def check_eval(handler, accessing_obj, access_type):
+    "The old, eval-based lock check"
+    evalstring, func_tup = handler.locks[access_type][:2]
+    true_false = tuple(bool(tup[0](accessing_obj, handler.obj, *tup[1], **tup[2])) for tup in func_tup)
+    return eval(evalstring % true_false)
+
+
+if __name__ == "__main__":
+
+    accessed_obj = _Obj(2, [])
+    accessed_obj.locks = LockHandler(accessed_obj)
+    accessing_obj = _Obj(3, ["Builders"])
+    handler = accessed_obj.locks
+
+    tot_eval, tot_compiled = 0, 0
+    print "%-10s %12s %12s %8s" % ("lock", "eval (s)", "compiled (s)", "speedup")
+    for access_type in sorted(handler.locks):
+        # make sure the two methods agree
+        assert check_eval(handler, accessing_obj, access_type) == \
+               handler.check(accessing_obj, access_type)
+        t_eval = timeit(lambda: check_eval(handler, accessing_obj, access_type), number=NCHECKS)
+        t_compiled = timeit(lambda: handler.check(accessing_obj, access_type), number=NCHECKS)
+        tot_eval += t_eval
+        tot_compiled += t_compiled
+        print "%-10s %12.4f %12.4f %7.1fx" % (access_type, t_eval, t_compiled, t_eval / t_compiled)
+    print "%-10s %12.4f %12.4f %7.1fx" % ("total", tot_eval, tot_compiled, tot_eval / tot_compiled)
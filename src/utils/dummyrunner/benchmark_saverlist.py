@@ -0,0 +1,73 @@
+"""
+This is a little routine for timing changes to large nested
+Attribute values, such as obj.db.inventory.append(item) or
+obj.db.inventory[500][1] = value on a list with many entries.
+
+Every such change re-converts the Attribute value with to_pickle
+before saving it. The unchanged parts of the structure are cached
+between saves; this compares that with converting the whole
+structure on every change (as was done before). No database is
+used, the Attribute is mocked.
+
+Run from the game/ directory:
+
+    python ../src/utils/dummyrunner/benchmark_saverlist.py
+
+"""
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+os.environ["DJANGO_SETTINGS_MODULE"] = "game.settings"
+from timeit import timeit
+
+from src.utils import dbserialize
+from src.utils.dbserialize import to_pickle, from_pickle
+
+# number of entries in the stored list
+NENTRIES = 10000
+# number of changes to time
+NCHANGES = 50
+
+
+class _Attribute(object):
+    "Mock Attribute, converting its value the same way as the real one"
+    def __init__(self):
+        self.db_value = None
+    def __value_get(self):
+        return from_pickle(self.db_value, db_obj=self)
+    def __value_set(self, value):
+        self.db_value = to_pickle(value)
+    value = property(__value_get, __value_set)
+
+
+def set_caching(enable):
+    "Turn the conversion caches on/off, off forces a full to_pickle"
+    if enable:
+        del dbserialize._SaverMutable._packed
+    else:
+        dbserialize._SaverMutable._packed = property(lambda self: None,
+                                                     lambda self, value: None)
+
+
+def make_value():
+    "Create a stored value; a list of small nested entries"
+    attr = _Attribute()
+    attr.value = [["item%i" % i, {"weight": i, "tags": ["a", "b"]}] for i in xrange(NENTRIES)]
+    return attr.value
+
+
+if __name__ == "__main__":
+
+    tests = (("append", lambda val, i: val.append(["new%i" % i, {"weight": i}])),
+             ("setitem", lambda val, i: val.__setitem__(i, ["set%i" % i, {}])),
+             ("nested setitem", lambda val, i: val[i][1].__setitem__("weight", -i)))
+
+    print "%i entries, %i changes each" % (NENTRIES, NCHANGES)
+    print "%-16s %12s %12s %8s" % ("change", "full (s)", "cached (s)", "speedup")
+    for name, change in tests:
+        set_caching(False)
+        value = make_value()
+        t_full = timeit(lambda: [change(value, i) for i in xrange(NCHANGES)], number=1)
+        set_caching(True)
+        value = make_value()
+        t_cached = timeit(lambda: [change(value, i) for i in xrange(NCHANGES)], number=1)
+        print "%-16s %12.4f %12.4f %7.1fx" % (name, t_full, t_cached, t_full / t_cached)
@@ -4,13 +4,21 @@ Django ID mapper
 Modified for Evennia by making sure that no model references
 leave caching unexpectedly (no use if WeakRefs).
 
-Also adds cache_size() for monitoring the size of the cache.
+Also adds cache_size() for monitoring the size of the cache. The
+cache can optionally be bounded, either by a maximum number of
+instances per model (settings.IDMAPPER_CACHE_MAXSIZE) or by a memory
+budget for the whole process (settings.IDMAPPER_CACHE_MAXRSS). The
+least recently used instances are then evicted first. Instances
+whose at_idmapper_flush() returns False are never evicted.
 """
 
 import os, threading
+from math import ceil
+from collections import OrderedDict, defaultdict
 #from twisted.internet import reactor
 #from twisted.internet.threads import blockingCallFromThread
 from twisted.internet.reactor import callFromThread
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist, FieldError
 from django.db.models.base import Model, ModelBase
 from django.db.models.signals import post_save, pre_delete, post_syncdb
@@ -35,12 +43,29 @@ _SERVER_PID, _PORTAL_PID = get_evennia_pids()
 _IS_SUBPROCESS = (_SERVER_PID and _PORTAL_PID) and not _SELF_PID in (_SERVER_PID, _PORTAL_PID)
 _IS_MAIN_THREAD = threading.currentThread().getName() == "MainThread"
 
+# cache limits
+_CACHE_MAXSIZE = settings.IDMAPPER_CACHE_MAXSIZE
+_CACHE_MAXSIZE_PER_MODEL = settings.IDMAPPER_CACHE_MAXSIZE_PER_MODEL
+_CACHE_MAXRSS = settings.IDMAPPER_CACHE_MAXRSS
+# when a cache grows too big, this fraction of it is evicted at once
+_CACHE_EVICT_FRACTION = 0.1
+# number of evicted instances, per model name
+_EVICTIONS = defaultdict(int)
+
 #_SERVER_PID = None
 #_PORTAL_PID = None
 #        #global _SERVER_PID, _PORTAL_PID, _IS_SUBPROCESS, _SELF_PID
 #        if not _SERVER_PID and not _PORTAL_PID:
 #            _IS_SUBPROCESS = (_SERVER_PID and _PORTAL_PID) and not _SELF_PID in (_SERVER_PID, _PORTAL_PID)
 
+def _new_instance_cache(maxsize):
+    """
+    Returns an empty instance cache. Only caches that may be evicted
+    from keep track of the order of use, with an OrderedDict; it is
+    pure Python and so both bigger and slower than a plain dict.
+    """
+    return OrderedDict() if (maxsize or _CACHE_MAXRSS) else {}
+
 class SharedMemoryModelBase(ModelBase):
     # CL: upstream had a __new__ method that skipped ModelBase's __new__ if
     # SharedMemoryModelBase was not in the model class's ancestors. It's not
@@ -54,24 +79,40 @@ class SharedMemoryModelBase(ModelBase):
         args and kwargs. If instance caching is enabled for this class, the cache is
         populated whenever possible (ie when it is possible to infer the pk value).
         """
-        def new_instance():
-            return super(SharedMemoryModelBase, cls).__call__(*args, **kwargs)
-
-        instance_key = cls._get_cache_key(args, kwargs)
+        pk_position = cls.__pk_position__
+        if len(args) > pk_position:
+            # fast path - this is how querysets create instances from
+            # database rows, so the pk is always at the same position
+            instance_key = args[pk_position]
+            if isinstance(instance_key, Model):
+                instance_key = instance_key._get_pk_val()
+        else:
+            instance_key = cls._get_cache_key(args, kwargs)
         # depending on the arguments, we might not be able to infer the PK, so in that case we create a new instance
         if instance_key is None:
-            return new_instance()
+            return super(SharedMemoryModelBase, cls).__call__(*args, **kwargs)
 
         cached_instance = cls.get_cached_instance(instance_key)
         if cached_instance is None:
-            cached_instance = new_instance()
+            cached_instance = super(SharedMemoryModelBase, cls).__call__(*args, **kwargs)
             cls.cache_instance(cached_instance)
         return cached_instance
 
 
     def _prepare(cls):
-        cls.__instance_cache__ = {}  #WeakValueDictionary()
+        # max number of cached instances, 0 means no limit
+        cls.__instance_cache_maxsize__ = _CACHE_MAXSIZE_PER_MODEL.get(cls.__name__, _CACHE_MAXSIZE)
+        cls.__instance_cache__ = _new_instance_cache(cls.__instance_cache_maxsize__)  #WeakValueDictionary()
         super(SharedMemoryModelBase, cls)._prepare()
+        # find the pk once, for quickly inferring it from constructor arguments
+        # Quick hack for my composites work for now.
+        if hasattr(cls._meta, 'pks'):
+            pk = cls._meta.pks[0]
+        else:
+            pk = cls._meta.pk
+        cls.__pk_position__ = cls._meta.fields.index(pk)
+        cls.__pk_attname__ = pk.attname
+        cls.__pk_name__ = pk.name
 
     def __new__(cls, classname, bases, classdict, *args, **kwargs):
         """
@@ -257,23 +298,16 @@ class SharedMemoryModel(Model):
         It is used to decide if an instance has to be built or is already in the cache.
         """
         result = None
-        # Quick hack for my composites work for now.
-        if hasattr(cls._meta, 'pks'):
-            pk = cls._meta.pks[0]
-        else:
-            pk = cls._meta.pk
-        # get the index of the pk in the class fields. this should be calculated *once*, but isn't atm
-        pk_position = cls._meta.fields.index(pk)
-        if len(args) > pk_position:
+        if len(args) > cls.__pk_position__:
             # if it's in the args, we can get it easily by index
-            result = args[pk_position]
-        elif pk.attname in kwargs:
+            result = args[cls.__pk_position__]
+        elif cls.__pk_attname__ in kwargs:
             # retrieve the pk value. Note that we use attname instead of name, to handle the case where the pk is a
             # a ForeignKey.
-            result = kwargs[pk.attname]
-        elif pk.name != pk.attname and pk.name in kwargs:
+            result = kwargs[cls.__pk_attname__]
+        elif cls.__pk_name__ != cls.__pk_attname__ and cls.__pk_name__ in kwargs:
             # ok we couldn't find the value, but maybe it's a FK and we can find the corresponding object instead
-            result = kwargs[pk.name]
+            result = kwargs[cls.__pk_name__]
 
         if result is not None and isinstance(result, Model):
             # if the pk value happens to be a model instance (which can happen wich a FK), we'd rather use its own pk as the key
@@ -294,17 +328,77 @@ class SharedMemoryModel(Model):
         (which will always be the case when caching is disabled for this class). Please
         note that the lookup will be done even when instance caching is disabled.
         """
-        return cls.__instance_cache__.get(id)
+        cache = cls.__instance_cache__
+        if type(cache) is dict:
+            return cache.get(id)
+        # evictable cache - mark the instance as recently used
+        instance = cache.pop(id, None)
+        if instance is not None:
+            cache[id] = instance
+        return instance
     get_cached_instance = classmethod(get_cached_instance)
 
     def cache_instance(cls, instance):
         """
         Method to store an instance in the cache.
         """
-        if instance._get_pk_val() is not None:
-            cls.__instance_cache__[instance._get_pk_val()] = instance
+        pk = instance._get_pk_val()
+        if pk is not None:
+            cache = cls.__instance_cache__
+            maxsize = cls.__instance_cache_maxsize__
+            if type(cache) is dict:
+                if not maxsize:
+                    cache[pk] = instance
+                    return
+                # a max size was set after the cache was created
+                cache = cls.__instance_cache__ = OrderedDict(cache)
+            cache.pop(pk, None)
+            cache[pk] = instance
+            if maxsize and len(cache) > maxsize:
+                cls.evict_cached_instances(len(cache) - maxsize +
+                                           int(maxsize * _CACHE_EVICT_FRACTION))
     cache_instance = classmethod(cache_instance)
 
+    def evict_cached_instances(cls, num):
+        """
+        Evict up to num of the least recently used instances from the
+        cache. Instances refusing to be flushed (their at_idmapper_flush()
+        returns False) are skipped and marked as recently used instead.
+        Returns the number of instances actually evicted.
+        """
+        cache = cls.__instance_cache__
+        nevicted = 0
+        if type(cache) is dict:
+            # an unbounded cache does not know the order of use
+            for key, instance in cache.items():
+                if nevicted >= num:
+                    break
+                try:
+                    flush = instance.at_idmapper_flush()
+                except Exception:
+                    flush = False
+                if flush:
+                    del cache[key]
+                    nevicted += 1
+            _EVICTIONS[cls.__name__] += nevicted
+            return nevicted
+        for _ in xrange(len(cache)):
+            if nevicted >= num:
+                break
+            key, instance = cache.popitem(last=False)
+            try:
+                flush = instance.at_idmapper_flush()
+            except Exception:
+                flush = False
+            if flush:
+                nevicted += 1
+            else:
+                # pinned; put it back at the recently used end
+                cache[key] = instance
+        _EVICTIONS[cls.__name__] += nevicted
+        return nevicted
+    evict_cached_instances = classmethod(evict_cached_instances)
+
     def get_all_cached_instances(cls):
         "return the objects so far cached by idmapper for this class."
         return cls.__instance_cache__.values()
@@ -319,9 +413,18 @@ class SharedMemoryModel(Model):
     flush_cached_instance = classmethod(flush_cached_instance)
 
     def flush_instance_cache(cls):
-        cls.__instance_cache__ = {} #WeakValueDictionary()
+        cls.__instance_cache__ = _new_instance_cache(cls.__instance_cache_maxsize__) #WeakValueDictionary()
     flush_instance_cache = classmethod(flush_instance_cache)
 
+    def at_idmapper_flush(self):
+        """
+        This is called before this instance is evicted from the
+        idmapper cache to make room for others. If it returns False,
+        the instance is kept in the cache. Overload this to pin
+        instances holding non-persistent state.
+        """
+        return True
+
     def save(cls, *args, **kwargs):
         "save method tracking process/thread issues"
 
@@ -367,21 +470,88 @@ def update_cached_instance(sender, instance, **kwargs):
     sender.cache_instance(instance)
 post_save.connect(update_cached_instance)
 
+def _get_rss_mb():
+    """
+    Returns the resident memory of this process, in MB, or None if
+    this could not be determined (only supported on Linux).
+    """
+    try:
+        with open("/proc/%i/statm" % os.getpid()) as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024.0 ** 2
+    except Exception:
+        return None
+
+# the number of cached instances conditional_flush keeps the caches
+# at, while the process is above its memory budget
+_FLUSH_TARGET = None
+
+def conditional_flush(max_rss=None):
+    """
+    Evict the least recently used instances of all idmapper caches if
+    the resident memory of the process is above max_rss (in MB).
+    This is called regularly by the Server if IDMAPPER_CACHE_MAXRSS
+    is set. Returns the number of evicted instances.
+
+    Python rarely gives freed memory back to the OS, so the resident
+    memory mostly stays above max_rss after evicting, and evicting more
+    every time would empty the caches. Instead, the first time over
+    the limit the caches are shrunk by a fraction of their size, and
+    from then on only kept from growing beyond that (the memory freed
+    is reused by the process). Instances that could not be evicted
+    (being pinned) count towards this size, so they are not tried
+    again. Once the resident memory is below max_rss the caches may
+    grow freely again.
+    """
+    global _FLUSH_TARGET
+    max_rss = max_rss or _CACHE_MAXRSS
+    rss = _get_rss_mb()
+    if not (max_rss and rss and rss > max_rss):
+        _FLUSH_TARGET = None
+        return 0
+    def class_hierarchy(root):
+        """Recursively yield a class hierarchy."""
+        yield root
+        for subcls in root.__subclasses__():
+            for cls in class_hierarchy(subcls):
+                yield cls
+    models = [model for model in class_hierarchy(SharedMemoryModel)
+              if not model._meta.abstract and "__instance_cache__" in model.__dict__]
+    ncached = sum(len(model.__instance_cache__) for model in models)
+    if _FLUSH_TARGET is None:
+        _FLUSH_TARGET = int(ncached * (1 - _CACHE_EVICT_FRACTION))
+    excess = ncached - _FLUSH_TARGET
+    if excess <= 0:
+        return 0
+    nevicted = 0
+    for model in models:
+        ncache = len(model.__instance_cache__)
+        if ncache and nevicted < excess:
+            # evict from each cache in proportion to its size
+            num = min(excess - nevicted, int(ceil(float(ncache) * excess / ncached)))
+            nevicted += model.evict_cached_instances(num)
+    # what could not be evicted now, will not be later either
+    _FLUSH_TARGET = max(_FLUSH_TARGET, ncached - nevicted)
+    return nevicted
+
 def cache_size(mb=True):
     """
     Returns a dictionary with estimates of the
-    cache size of each subclass.
+    cache size of each subclass, as tuples
+    (number of instances, size, number of evicted instances).
 
     mb - return the result in MB.
+
+    This only measures the instances themselves and is quick. See
+    deep_cache_size() for a more accurate, but slower, accounting.
     """
     import sys
-    sizedict = {"_total": [0, 0]}
+    sizedict = {"_total": [0, 0, 0]}
     def getsize(model):
         instances = model.get_all_cached_instances()
         linst = len(instances)
         size = sum([sys.getsizeof(o) for o in instances])
-        size = (mb and size/1024.0) or size
-        return (linst, size)
+        size = (mb and size / 1024.0 ** 2) or size
+        return (linst, size, _EVICTIONS[model.__name__])
     def get_recurse(submodels):
         for submodel in submodels:
             subclasses = submodel.__subclasses__()
@@ -389,6 +559,7 @@ def cache_size(mb=True):
                 tup = getsize(submodel)
                 sizedict["_total"][0] += tup[0]
                 sizedict["_total"][1] += tup[1]
+                sizedict["_total"][2] += tup[2]
                 sizedict[submodel.__name__] = tup
             else:
                 get_recurse(subclasses)
@@ -396,3 +567,87 @@ def cache_size(mb=True):
     sizedict["_total"] = tuple(sizedict["_total"])
     return sizedict
 
+_DEEP_SIZE_SKIP = None
+
+def _deep_getsizeof(instance, seen):
+    """
+    Returns the size of instance plus everything it owns, in bytes.
+    This walks the references of instance (its __dict__, cached
+    typeclass, handlers, Attribute values, ndb data etc). Anything
+    already in seen is not counted again, and seen is updated with
+    everything counted here. The walk does not enter classes,
+    modules, functions, sessions, the reactor or other typeclassed
+    entities (those are accounted for under their own cache entry).
+    """
+    import sys, gc, types, weakref
+    global _DEEP_SIZE_SKIP
+    if not _DEEP_SIZE_SKIP:
+        from twisted.internet.base import ReactorBase
+        from src.server.session import Session
+        _DEEP_SIZE_SKIP = (type, types.ClassType, types.ModuleType,
+                           types.FunctionType, types.BuiltinFunctionType,
+                           types.MethodType, types.FrameType, weakref.ref,
+                           ReactorBase, Session)
+    size = 0
+    stack = [instance]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _DEEP_SIZE_SKIP):
+            continue
+        if (obj is not instance and isinstance(obj, SharedMemoryModel)
+                and "db_typeclass_path" in _GA(obj, "__dict__")):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj, 0)
+        stack.extend(gc.get_referents(obj))
+    return size
+
+def deep_cache_size(mb=True):
+    """
+    Returns the memory used by the idmapper cache, including
+    everything owned by the cached instances. This is much slower
+    than cache_size() since it walks the reference graph of every
+    cached instance.
+
+    Returns two dictionaries, one keyed on model name and one on
+    typeclass path, with tuples (number of instances, size). The model
+    dictionary has a "_total" key for the total cache. Nothing is
+    counted twice: Attributes are counted with the first entity
+    found to hold them and only show up under their own model if
+    they are not held by any cached entity.
+
+    mb - return the result in MB.
+    """
+    seen = set()
+    models = []
+    def get_recurse(submodels):
+        for submodel in submodels:
+            subclasses = submodel.__subclasses__()
+            if not subclasses:
+                models.append(submodel)
+            else:
+                get_recurse(subclasses)
+    get_recurse(SharedMemoryModel.__subclasses__())
+    # typeclassed models first, so they can claim what they own
+    models.sort(key=lambda model: "db_typeclass_path" not in [f.name for f in model._meta.fields])
+
+    sizedict, typeclassdict = {}, {}
+    total = [0, 0]
+    for model in models:
+        instances = model.get_all_cached_instances()
+        msize = 0
+        for instance in instances:
+            size = _deep_getsizeof(instance, seen)
+            msize += size
+            path = _GA(instance, "__dict__").get("db_typeclass_path")
+            if path:
+                ninst, tsize = typeclassdict.get(path, (0, 0))
+                typeclassdict[path] = (ninst + 1, tsize + size)
+        sizedict[model.__name__] = (len(instances), msize)
+        total[0] += len(instances)
+        total[1] += msize
+    sizedict["_total"] = tuple(total)
+    if mb:
+        sizedict = dict((key, (tup[0], tup[1] / 1024.0 ** 2)) for key, tup in sizedict.items())
+        typeclassdict = dict((key, (tup[0], tup[1] / 1024.0 ** 2)) for key, tup in typeclassdict.items())
+    return sizedict, typeclassdict
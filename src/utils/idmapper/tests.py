@@ -1,6 +1,6 @@
 from django.test import TestCase
 
-from base import SharedMemoryModel
+from base import SharedMemoryModel, cache_size, deep_cache_size
 from django.db import models
 
 class Category(SharedMemoryModel):
@@ -67,4 +67,42 @@ class SharedMemorysTest(TestCase):
         article.delete()
         self.assertEquals(pk not in Article.__instance_cache__, True)
         
-        
\ No newline at end of file
+        
+    def testBoundedCache(self):
+        list(Article.objects.all())
+        maxsize = Article.__instance_cache_maxsize__
+        Article.__instance_cache_maxsize__ = 5
+        try:
+            first = Article.objects.all()[0:1].get()
+            Article.objects.create(name="Article 10", category=first.category,
+                                   category2=first.category2)
+            self.assertEquals(len(Article.__instance_cache__) <= 5, True)
+            # the newly saved instance is the most recently used
+            self.assertEquals(Article.__instance_cache__.keys()[-1], Article.objects.latest("id").pk)
+        finally:
+            Article.__instance_cache_maxsize__ = maxsize
+
+    def testDeepCacheSize(self):
+        list(Article.objects.all())
+        shallow = cache_size(mb=False)["Article"]
+        deep = deep_cache_size(mb=False)[0]["Article"]
+        self.assertEquals(deep[0], shallow[0])
+        self.assertEquals(deep[1] > shallow[1], True)
+
+    def testConditionalFlush(self):
+        import base
+        list(Article.objects.all())
+        get_rss_mb = base._get_rss_mb
+        base._get_rss_mb = lambda: 1000.0
+        try:
+            self.assertEquals(base.conditional_flush(max_rss=100) > 0, True)
+            # still above the limit, but the caches did not grow since
+            self.assertEquals(base.conditional_flush(max_rss=100), 0)
+            category, category2 = Category.objects.all()[0], RegularCategory.objects.all()[0]
+            base.conditional_flush(max_rss=100)
+            Article.objects.create(name="Article 10", category=category, category2=category2)
+            # one more instance cached, so one is evicted
+            self.assertEquals(base.conditional_flush(max_rss=100), 1)
+        finally:
+            base._get_rss_mb = get_rss_mb
+            base._FLUSH_TARGET = None
@@ -11,7 +11,9 @@ snippet #577349 on http://code.activestate.com.
 
 import re
 import cgi
+from collections import OrderedDict
 from ansi import *
+from ansi import _PARSE_CACHE_SIZE, _PARSE_CACHE_MAXLEN
 
 
 class TextToHTMLparser(object):
@@ -78,6 +80,10 @@ class TextToHTMLparser(object):
     re_uline = re.compile("(?:%s)(.*?)(?=%s)" % (ANSI_UNDERLINE.replace("[", r"\["), fgstop))
     re_string = re.compile(r'(?P<htmlchars>[<&>])|(?P<space>^[ \t]+)|(?P<lineend>\r\n|\r|\n)', re.S|re.M|re.I)
 
+    def __init__(self):
+        "Sets up the cache of parsed texts"
+        self.parse_cache = OrderedDict()
+
     def re_color(self, text):
         """
         Replace ansi colors with html color class names.
@@ -136,8 +142,20 @@ class TextToHTMLparser(object):
     def parse(self, text, strip_ansi=False):
         """
         Main access function, converts a text containing
-        ansi codes into html statements.
+        ansi codes into html statements. The result is cached,
+        the same text is often sent to many webclients at once.
         """
+        cachekey = (text, strip_ansi)
+        try:
+            result = self.parse_cache.pop(cachekey)
+            # re-insert as the most recently used
+            self.parse_cache[cachekey] = result
+            return result
+        except KeyError:
+            pass
+        except TypeError:
+            # unhashable text, let parse_ansi deal with it
+            cachekey = None
         # parse everything to ansi first
         text = parse_ansi(text, strip_ansi=strip_ansi, xterm256=False)
         # convert all ansi to html
@@ -152,6 +170,10 @@ class TextToHTMLparser(object):
         # clean out eventual ansi that was missed
         #result = parse_ansi(result, strip_ansi=True)
 
+        if cachekey and _PARSE_CACHE_SIZE and len(text) <= _PARSE_CACHE_MAXLEN:
+            self.parse_cache[cachekey] = result
+            if len(self.parse_cache) > _PARSE_CACHE_SIZE:
+                self.parse_cache.popitem(last=False)
         return result
 
 HTML_PARSER = TextToHTMLparser()
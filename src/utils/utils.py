@@ -455,6 +455,26 @@ def inherits_from(obj, parent):
     return any(1 for obj_path in obj_paths if obj_path == parent_path)
 
 
+_DEFAULT_METHOD_CACHE = {}
+def uses_default_method(obj, methodname, parent):
+    """
+    Takes an object instance and determines if its class uses the
+    method methodname as defined on the class parent, that is, does
+    not overload it. This is also True if obj has no such method at
+    all. The result is cached per class, so this is cheap enough to
+    call for every receiver of a message.
+    """
+    key = (obj.__class__, methodname, parent)
+    try:
+        return _DEFAULT_METHOD_CACHE[key]
+    except KeyError:
+        method = getattr(obj.__class__, methodname, None)
+        is_default = (method is None or
+                      getattr(method, "im_func", None) is getattr(parent, methodname).im_func)
+        _DEFAULT_METHOD_CACHE[key] = is_default
+        return is_default
+
+
 def server_services():
     """
     Lists all services active on the Server. Observe that
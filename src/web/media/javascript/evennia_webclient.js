@@ -30,6 +30,12 @@ contain the 'mode' of the request to be handled by the protocol:
 
  mode 'close' - closes the connection. The server closes the session and does
                 cleanup at this point.
+
+If the Portal offers WebSockets (WEBSOCKET_PORT is then set by the
+html page) and the browser supports them, a WebSocket is used
+instead of the requests above. Input is then sent over it as a json
+object {msg:..., data:...} and output arrives the same way, as
+soon as the server sends it.
 */
 
 // jQuery must be imported by the calling html page before this script
@@ -78,6 +84,7 @@ $.fn.appendCaret = function() {
 // Server communications
 
 var CLIENT_HASH = '0'; // variable holding the client id
+var WEBSOCKET = null;  // the open websocket, if used
 
 function webclient_receive(){
     // This starts an asynchronous long-polling request. It will either timeout
@@ -96,7 +103,10 @@ function webclient_receive(){
         // callback methods
 
         success: function(data){       // called when request to waitreceive completes
-            msg_display("out", data.msg);  // Add response to the message area
+            // data is a list of all messages waiting for us
+            $.each(data, function(i, entry){
+                msg_display("out", entry.msg);  // Add response to the message area
+            });
             webclient_receive();              // immediately start a new request
         },
         error: function(XMLHttpRequest, textStatus, errorThrown){
@@ -111,6 +121,17 @@ function webclient_input(arg, no_update){
 
     var outmsg = typeof(arg) != 'undefined' ? arg : $("#inputfield").val();
 
+    if (WEBSOCKET) {
+        // no need for a request, just send over the open websocket
+        WEBSOCKET.send(JSON.stringify({msg:outmsg, data:'NoData'}));
+        if (no_update == undefined) {
+            history_add(outmsg);
+            HISTORY_POS = 0;
+            $('#inputform')[0].reset();                     // clear input field
+        }
+        return;
+    }
+
     $.ajax({
         type: "POST",
         url: "/webclientdata",
@@ -171,8 +192,47 @@ function webclient_init(){
     });
 }
 
+function websocket_init(){
+    // Start the connection over a WebSocket. If it can't be opened,
+    // fall back to the ajax long-polling.
+
+    var opened = false;
+    var websocket = new WebSocket("ws://" + window.location.hostname + ":" + WEBSOCKET_PORT + "/");
+
+    websocket.onopen = function(){
+        opened = true;
+        WEBSOCKET = websocket;
+        $("#connecting").remove() // remove the "connecting ..." message.
+
+        // A small timeout to stop 'loading' indicator in Chrome
+        setTimeout(function () {
+            $("#playercount").fadeOut('slow', webclient_set_sizes);
+        }, 10000);
+
+        // Report success
+        msg_display('sys',"Connected to " + window.location.hostname + ".");
+    };
+    websocket.onmessage = function(event){
+        var data = JSON.parse(event.data);
+        msg_display("out", data.msg);  // Add the message to the message area
+    };
+    websocket.onclose = function(){
+        WEBSOCKET = null;
+        if (opened) {
+            msg_display("err", "The connection was closed. Reload the page to reconnect.");
+        }
+        else {
+            webclient_init();
+        }
+    };
+}
+
 function webclient_close(){
     // Kill the connection and do house cleaning on the server.
+    if (WEBSOCKET) {
+        WEBSOCKET.close();
+        return;
+    }
     $.ajax({
         type: "POST",
         url: "/webclientdata",
@@ -283,7 +343,12 @@ $(document).ready(function(){
     webclient_set_sizes();
     // a small timeout to stop 'loading' indicator in Chrome
     setTimeout(function () {
-        webclient_init();
+        if (typeof(WEBSOCKET_PORT) != 'undefined' && window.WebSocket) {
+            websocket_init();
+        }
+        else {
+            webclient_init();
+        }
     }, 500);
     // set an idle timer to avoid proxy servers to time out on us (every 3 minutes)
     setInterval(function() {
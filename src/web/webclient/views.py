@@ -23,6 +23,9 @@ def webclient(request):
 
     # as an example we send the number of connected players to the template
     pagevars = {'num_players_connected': SESSIONS.player_count()}
+    if settings.WEBSOCKET_ENABLED and settings.WEBSOCKET_PORTS:
+        # tell the client where to find the websocket
+        pagevars['websocket_port'] = settings.WEBSOCKET_PORTS[0]
 
     context_instance = RequestContext(request)
     return render_to_response('webclient.html', pagevars, context_instance)